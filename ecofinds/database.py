@@ -0,0 +1,111 @@
+"""
+DATABASES from the environment.
+
+MARKET_DB_ENGINE picks the backend:
+
+- "sqlite" (default): MARKET_DB_NAME is the file (default db.sqlite3). Unless
+  MARKET_SQLITE_TUNING=0, every new connection switches to WAL (readers no
+  longer wait for writers), waits MARKET_SQLITE_BUSY_TIMEOUT seconds for a
+  lock instead of failing with "database is locked", syncs less often
+  (synchronous=NORMAL is still crash-safe in WAL mode) and memory-maps
+  MARKET_SQLITE_MMAP_MB of the file. Transactions begin IMMEDIATE, taking the
+  write lock up front: a transaction that reads and then writes (checkout)
+  can't be refused the upgrade halfway through, which busy_timeout does not
+  help with.
+  WAL is left off for the development database committed to the repo (no
+  MARKET_DB_NAME): the mode is stored in the file itself, so switching it
+  would modify a tracked file on the first connection. MARKET_SQLITE_WAL=1
+  turns it on there too, MARKET_SQLITE_WAL=0 turns it off everywhere.
+- "postgresql": MARKET_DB_NAME/USER/PASSWORD/HOST/PORT. MARKET_DB_POOL=1 uses
+  psycopg's connection pool (MARKET_DB_POOL_MIN_SIZE/MAX_SIZE); otherwise
+  connections persist for MARKET_DB_CONN_MAX_AGE seconds.
+
+Persistent connections are health-checked before reuse unless
+MARKET_DB_HEALTH_CHECKS=0.
+
+MARKET_DB_REPLICAS lists read replicas, comma-separated: hosts (host or
+host:port) for PostgreSQL, files for SQLite (kept current with
+`manage.py sync_sqlite_replicas`, a local stand-in for replication). They
+become the aliases replica1, replica2, ... that market.routers reads from.
+"""
+import os
+
+SQLITE_BUSY_TIMEOUT = 20
+SQLITE_MMAP_MB = 256
+
+
+def sqlite_options(busy_timeout=SQLITE_BUSY_TIMEOUT, mmap_mb=SQLITE_MMAP_MB, wal=True):
+    """OPTIONS for a tuned SQLite connection (run by Django on every new connection)."""
+    pragmas = ["PRAGMA journal_mode=WAL"] if wal else []
+    pragmas += [
+        f"PRAGMA busy_timeout={int(busy_timeout * 1000)}",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={int(mmap_mb) * 1024 * 1024}",
+    ]
+    return {"init_command": ";".join(pragmas), "transaction_mode": "IMMEDIATE"}
+
+
+def _flag(env, name, default):
+    return env.get(name, default) == "1"
+
+
+def database_settings(base_dir, env=os.environ):
+    """The "default" DATABASES entry described by `env`."""
+    engine = env.get("MARKET_DB_ENGINE", "sqlite")
+    conn_max_age = int(env.get("MARKET_DB_CONN_MAX_AGE", 60))
+    health_checks = _flag(env, "MARKET_DB_HEALTH_CHECKS", "1")
+
+    if engine == "sqlite":
+        config = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": env.get("MARKET_DB_NAME", base_dir / "db.sqlite3"),
+            "CONN_MAX_AGE": conn_max_age,
+            "CONN_HEALTH_CHECKS": health_checks,
+        }
+        if _flag(env, "MARKET_SQLITE_TUNING", "1"):
+            config["OPTIONS"] = sqlite_options(
+                float(env.get("MARKET_SQLITE_BUSY_TIMEOUT", SQLITE_BUSY_TIMEOUT)),
+                int(env.get("MARKET_SQLITE_MMAP_MB", SQLITE_MMAP_MB)),
+                wal=_flag(env, "MARKET_SQLITE_WAL", "1" if "MARKET_DB_NAME" in env else "0"),
+            )
+        return config
+
+    if engine in ("postgres", "postgresql"):
+        config = {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": env.get("MARKET_DB_NAME", "ecofinds"),
+            "USER": env.get("MARKET_DB_USER", ""),
+            "PASSWORD": env.get("MARKET_DB_PASSWORD", ""),
+            "HOST": env.get("MARKET_DB_HOST", ""),
+            "PORT": env.get("MARKET_DB_PORT", ""),
+            "CONN_MAX_AGE": conn_max_age,
+            "CONN_HEALTH_CHECKS": health_checks,
+            "OPTIONS": {},
+        }
+        if _flag(env, "MARKET_DB_POOL", "0"):
+            # the pool owns connection lifetimes; Django requires CONN_MAX_AGE=0 with it
+            config["CONN_MAX_AGE"] = 0
+            config["OPTIONS"]["pool"] = {
+                "min_size": int(env.get("MARKET_DB_POOL_MIN_SIZE", 2)),
+                "max_size": int(env.get("MARKET_DB_POOL_MAX_SIZE", 10)),
+            }
+        return config
+
+    raise ValueError(f"MARKET_DB_ENGINE must be 'sqlite' or 'postgresql', not {engine!r}")
+
+
+def replica_settings(primary, env=os.environ):
+    """{alias: DATABASES entry} for each replica in MARKET_DB_REPLICAS, copied from `primary`."""
+    replicas = {}
+    entries = [e.strip() for e in env.get("MARKET_DB_REPLICAS", "").split(",") if e.strip()]
+    for i, entry in enumerate(entries, 1):
+        config = {**primary, "OPTIONS": dict(primary.get("OPTIONS", {}))}
+        if config["ENGINE"] == "django.db.backends.sqlite3":
+            config["NAME"] = entry
+        else:
+            host, _, port = entry.partition(":")
+            config["HOST"], config["PORT"] = host, port or config.get("PORT", "")
+        # tests run against the primary's test database
+        config["TEST"] = {"MIRROR": "default"}
+        replicas[f"replica{i}"] = config
+    return replicas
@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+
+from .database import database_settings, replica_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'market.instrumentation.InstrumentationMiddleware',
+    'market.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +61,8 @@ ROOT_URLCONF = 'ecofinds.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also times rendering for market.instrumentation
+        'BACKEND': 'market.instrumentation.InstrumentedTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,6 +70,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'market.context_processors.cart_summary',
             ],
         },
     },
@@ -80,17 +87,152 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 CRISPY_TEMPLATE_PACK = "bootstrap4"
 
+# the JSON API (market.api) authenticates with the site's own session login
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['market.api.auth.AccountAuthentication'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DEFAULT_PARSER_CLASSES': ['rest_framework.parsers.JSONParser'],
+    'UNAUTHENTICATED_USER': None,
+}
+
+# seconds a logged-in UserAccount (without its password hash) stays in the
+# "shared" cache between requests; 0 = off, one primary-key query per request
+MARKET_ACCOUNT_CACHE_TTL = int(os.environ.get("MARKET_ACCOUNT_CACHE_TTL", 0))
+# upper bound on how stale a cached cart badge can get (carts invalidate it on change)
+MARKET_CART_CACHE_TTL = int(os.environ.get("MARKET_CART_CACHE_TTL", 300))
+
+# where uploaded photos are validated and resized: "thread" (in-process pool),
+# "worker" (run `manage.py process_image_jobs`), "sync" or "off"
+MARKET_IMAGE_PROCESSING = os.environ.get("MARKET_IMAGE_PROCESSING", "thread")
+MARKET_IMAGE_WORKERS = int(os.environ.get("MARKET_IMAGE_WORKERS", 2))
+MARKET_MAX_IMAGE_BYTES = int(os.environ.get("MARKET_MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+
+# when "similar items" are recomputed after a listing changes: "off" (run
+# `manage.py build_similar_products` on a schedule, e.g. every few minutes),
+# "thread" (at most one background refresh per MARKET_SIMILAR_REFRESH_DELAY
+# seconds, covering every listing changed meanwhile) or "sync"
+MARKET_SIMILAR_REFRESH = os.environ.get("MARKET_SIMILAR_REFRESH", "off")
+MARKET_SIMILAR_REFRESH_DELAY = float(os.environ.get("MARKET_SIMILAR_REFRESH_DELAY", 30))
+
+# password hashing: the first PASSWORD_HASHERS entry hashes new passwords;
+# older hashes (and pre-KDF SHA-256 ones) are upgraded on the next login
+MARKET_PASSWORD_ITERATIONS = int(os.environ.get("MARKET_PASSWORD_ITERATIONS", 600_000))
+PASSWORD_HASHERS = [
+    'market.passwords.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+]
+
+# failed logins allowed per window before the login form answers 429
+MARKET_LOGIN_MAX_PER_IP = int(os.environ.get("MARKET_LOGIN_MAX_PER_IP", 50))
+MARKET_LOGIN_MAX_PER_EMAIL = int(os.environ.get("MARKET_LOGIN_MAX_PER_EMAIL", 5))
+MARKET_LOGIN_WINDOW = int(os.environ.get("MARKET_LOGIN_WINDOW", 300))
+
+# per-request query/latency metrics (served at /metrics to the IPs below)
+MARKET_INSTRUMENTATION = os.environ.get("MARKET_INSTRUMENTATION", "1") == "1"
+# requests slower than this log their queries ("market.requests" logger); 0 = off
+MARKET_SLOW_REQUEST_MS = int(os.environ.get("MARKET_SLOW_REQUEST_MS", 500))
+MARKET_METRICS_ALLOWED_IPS = os.environ.get("MARKET_METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+
+# serve the feed, product, cart and order history pages from async views
+# (market.async_views); turn on when running under ASGI (ecofinds.asgi)
+MARKET_ASYNC_VIEWS = os.environ.get("MARKET_ASYNC_VIEWS", "0") == "1"
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Configured from MARKET_DB_* environment variables, see ecofinds/database.py.
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+    'default': database_settings(BASE_DIR),
+}
+DATABASES.update(replica_settings(DATABASES['default']))
+
+# browse traffic reads from the replicas; a client that wrote reads from the
+# primary for MARKET_REPLICA_PIN_SECONDS, until the replicas have caught up
+MARKET_DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+MARKET_REPLICA_PIN_SECONDS = int(os.environ.get("MARKET_REPLICA_PIN_SECONDS", 5))
+DATABASE_ROUTERS = ['market.routers.ReplicaRouter']
+
+
+# Caches
+# "pages" holds rendered anonymous feed/detail pages. LocMemCache evicts
+# least-recently-used entries once MAX_ENTRIES is reached; set
+# MARKET_PAGE_CACHE=file to share pages between worker processes instead.
+
+PAGE_CACHE_TIMEOUT = int(os.environ.get("MARKET_PAGE_CACHE_TIMEOUT", 600))
+# how long a reverse proxy may serve an anonymous feed/product page before
+# revalidating it with us (Cache-Control s-maxage); browsers always revalidate
+MARKET_PROXY_CACHE_SECONDS = int(os.environ.get("MARKET_PROXY_CACHE_SECONDS", 60))
+
+if os.environ.get("MARKET_PAGE_CACHE") == "file":
+    _page_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("MARKET_PAGE_CACHE_DIR", BASE_DIR / '.page_cache'),
+    }
+else:
+    _page_cache = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'market-pages',
     }
+_page_cache.update({
+    'TIMEOUT': PAGE_CACHE_TIMEOUT,
+    'OPTIONS': {'MAX_ENTRIES': int(os.environ.get("MARKET_PAGE_CACHE_ENTRIES", 2000))},
+})
+
+# "sessions" backs cached_db/cache sessions and "shared" holds per-user state
+# (cached accounts, cart badges, login throttle counters). Both must be
+# shared by every worker process, or a logout or cart change in one would go
+# unseen in the others and each would allow its own round of login attempts:
+# the default is a file cache on this host. MARKET_SESSION_CACHE /
+# MARKET_SHARED_CACHE=locmem is only safe with a single process; a redis://
+# URL shares across hosts (and counts failed logins atomically).
+
+
+def _shared_cache(location, directory, name):
+    if location == "locmem":
+        return {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': name}
+    if location.startswith("redis://"):
+        return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': location}
+    return {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+
+
+_session_cache = _shared_cache(
+    os.environ.get("MARKET_SESSION_CACHE", "file"),
+    os.environ.get("MARKET_SESSION_CACHE_DIR", BASE_DIR / '.session_cache'),
+    'market-sessions',
+)
+_session_cache['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get("MARKET_SESSION_CACHE_ENTRIES", 20000))}
+_state_cache = _shared_cache(
+    os.environ.get("MARKET_SHARED_CACHE", "file"),
+    os.environ.get("MARKET_SHARED_CACHE_DIR", BASE_DIR / '.shared_cache'),
+    'market-shared',
+)
+_state_cache['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get("MARKET_SHARED_CACHE_ENTRIES", 20000))}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': _page_cache,
+    'sessions': _session_cache,
+    'shared': _state_cache,
 }
 
 
+# Sessions
+# MARKET_SESSION_ENGINE: "cached_db" (default; reads from the "sessions"
+# cache, writes through to the database so sessions survive a cache flush),
+# "cache" (no database at all, sessions die with the cache), "db", or
+# "signed_cookies" (the payload rides in the cookie; a copied cookie stays
+# valid until it expires even after logout). Anonymous visitors get no
+# session until something is stored in it, whatever the engine. Expired rows
+# are removed by Django's `manage.py clearsessions`; run it from cron (e.g.
+# hourly).
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get("MARKET_SESSION_ENGINE", "cached_db")
+SESSION_CACHE_ALIAS = 'sessions'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
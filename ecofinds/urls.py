@@ -19,8 +19,12 @@ from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from market.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/v1/', include('market.api.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('market.urls')),
 
 ]
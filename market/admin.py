@@ -22,4 +22,14 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 admin.site.register(CartItem)
 admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+
+@admin.register(ImageUploadJob)
+class ImageUploadJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "product", "original_name", "status", "error", "created_at")
+    list_filter = ("status",)
+
+@admin.register(SimilarProduct)
+class SimilarProductAdmin(admin.ModelAdmin):
+    list_display = ("product", "rank", "neighbour", "score")
+    raw_id_fields = ("product", "neighbour")
@@ -0,0 +1,6 @@
+"""
+Versioned JSON API (mounted at /api/v1/) for the mobile client.
+
+Authentication reuses the site's session login: the same cookie that the
+HTML views read, with Django's CSRF check on unsafe methods.
+"""
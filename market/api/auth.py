@@ -0,0 +1,24 @@
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import BasePermission
+
+from market.utils import get_account
+
+
+class AccountAuthentication(SessionAuthentication):
+    """request.user is the session's UserAccount (not django.contrib.auth)."""
+
+    def authenticate(self, request):
+        account = get_account(request._request)
+        if account is None:
+            return None
+        self.enforce_csrf(request)
+        return (account, None)
+
+    def authenticate_header(self, request):
+        # makes DRF answer 401 rather than 403 for anonymous requests
+        return 'Session realm="api"'
+
+
+class IsLoggedIn(BasePermission):
+    def has_permission(self, request, view):
+        return request.user is not None
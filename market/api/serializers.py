@@ -0,0 +1,108 @@
+from django.urls import reverse
+from rest_framework import serializers
+
+from market.models import CartItem, Order, OrderItem, Product, ProductImage, UserAccount
+
+
+class DynamicFieldsMixin:
+    """
+    Accepts fields=[...] (or the "fields" context key, from ?fields=) and
+    drops every other field from the output. Unknown names are ignored.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            fields = self.context.get("fields")
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class OwnerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserAccount
+        fields = ["id", "username"]
+
+
+class ProductImageSerializer(serializers.ModelSerializer):
+    url = serializers.ImageField(source="image", read_only=True)
+    thumbnail = serializers.CharField(source="thumbnail_url", read_only=True)
+    srcset = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = ProductImage
+        fields = ["id", "url", "thumbnail", "srcset", "alt"]
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Feed card fields. Needs select_related("owner")."""
+
+    url = serializers.SerializerMethodField()
+    owner = OwnerSerializer(read_only=True)
+    image = serializers.CharField(source="primary_thumbnail_url", read_only=True)
+    image_srcset = serializers.CharField(source="primary_image_srcset", read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            "id", "slug", "url", "title", "price", "category", "condition", "quantity",
+            "is_available", "owner", "image", "image_srcset", "created_at",
+        ]
+
+    def get_url(self, obj):
+        return reverse("api-v1:product_detail", args=[obj.slug])
+
+
+class ProductDetailSerializer(ProductSerializer):
+    """Everything on the product page. Also needs prefetch_related("images")."""
+
+    images = ProductImageSerializer(many=True, read_only=True)
+    images_pending = serializers.IntegerField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + [
+            "description", "year_of_manufacture", "brand", "model",
+            "length_cm", "width_cm", "height_cm", "weight_kg", "material", "color",
+            "original_packaging", "manual_included", "working_condition_description",
+            "updated_at", "images", "images_pending",
+        ]
+
+
+CART_PRODUCT_FIELDS = ["id", "slug", "url", "title", "price", "quantity", "is_available", "image"]
+
+
+class CartItemSerializer(serializers.ModelSerializer):
+    """Needs select_related("product")."""
+
+    product = ProductSerializer(fields=CART_PRODUCT_FIELDS, read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = CartItem
+        fields = ["id", "product", "qty", "subtotal", "created_at"]
+
+
+class CartAddSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    qty = serializers.IntegerField(min_value=1, default=1)
+
+
+class CartUpdateSerializer(serializers.Serializer):
+    qty = serializers.IntegerField(min_value=1)
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ["product_id", "title", "qty", "price_snapshot"]
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    """Needs prefetch_related("items")."""
+
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ["id", "created_at", "total", "items"]
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+app_name = "api-v1"
+
+urlpatterns = [
+    path("products/", views.product_list, name="product_list"),
+    path("products/<slug:slug>/", views.product_detail, name="product_detail"),
+    path("cart/", views.cart, name="cart"),
+    path("cart/<int:pk>/", views.cart_item, name="cart_item"),
+    path("orders/", views.order_list, name="order_list"),
+    path("orders/<int:pk>/", views.order_detail, name="order_detail"),
+]
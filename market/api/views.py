@@ -0,0 +1,192 @@
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, set_response_etag
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from market.cart import invalidate_cart_summary
+from market.facets import apply_filters, parse_filters
+from market.models import CartItem, Order, Product
+from market.pagination import cursor_paginate
+from market.search import search_products
+
+from .auth import IsLoggedIn
+from .serializers import (
+    CartAddSerializer,
+    CartItemSerializer,
+    CartUpdateSerializer,
+    OrderSerializer,
+    ProductDetailSerializer,
+    ProductSerializer,
+)
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# search results are ranked, so they page by number; keep that shallow
+MAX_SEARCH_PAGE = 50
+
+
+def conditional(private=False):
+    """
+    ETag every successful GET from its rendered body and answer a matching
+    If-None-Match with 304, so clients skip re-downloading unchanged pages.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            if request.method not in ("GET", "HEAD") or response.status_code != 200:
+                return response
+            response.render()
+            set_response_etag(response)
+            patch_cache_control(response, no_cache=True, private=private)
+            if private:
+                patch_vary_headers(response, ["Cookie"])
+            return get_conditional_response(request, etag=response["ETag"], response=response)
+        return wrapper
+    return decorator
+
+
+def _page_size(request):
+    try:
+        return max(1, min(int(request.query_params.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return PAGE_SIZE
+
+
+def _fields(request):
+    fields = request.query_params.get("fields", "")
+    return [f.strip() for f in fields.split(",") if f.strip()] or None
+
+
+def _link(request, **params):
+    query = request.query_params.copy()
+    for key, value in params.items():
+        query[key] = value
+    return request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+
+@conditional()
+@api_view(["GET"])
+def product_list(request):
+    q = request.query_params.get("q", "").strip()
+    size = _page_size(request)
+
+    qs = Product.objects.filter(is_available=True).select_related("owner")
+    qs = apply_filters(qs, parse_filters(request.query_params))
+
+    if q:
+        page = request.query_params.get("page", "1")
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        if page > MAX_SEARCH_PAGE:
+            raise Http404
+        offset = (page - 1) * size
+        rows = list(search_products(qs, q)[offset:offset + size + 1])
+        products, more = rows[:size], len(rows) > size
+        next_link = _link(request, page=page + 1) if more else None
+    else:
+        page_obj = cursor_paginate(qs, request.query_params.get("cursor"), size)
+        products = page_obj.object_list
+        next_link = _link(request, cursor=page_obj.next_cursor) if page_obj.has_next else None
+
+    serializer = ProductSerializer(products, many=True, context={"fields": _fields(request)})
+    return Response({"results": serializer.data, "next": next_link})
+
+
+@conditional()
+@api_view(["GET"])
+def product_detail(request, slug):
+    product = get_object_or_404(
+        Product.objects.select_related("owner").prefetch_related("images"), slug=slug
+    )
+    return Response(ProductDetailSerializer(product, context={"fields": _fields(request)}).data)
+
+
+def _cart_response(user, status_code=status.HTTP_200_OK):
+    items = list(CartItem.objects.filter(user=user).select_related("product"))
+    return Response({
+        "items": CartItemSerializer(items, many=True).data,
+        "count": len(items),
+        "total": str(sum((it.subtotal for it in items), 0)),
+    }, status=status_code)
+
+
+@conditional(private=True)
+@api_view(["GET", "POST"])
+@permission_classes([IsLoggedIn])
+def cart(request):
+    """GET the cart, or POST {"product": id, "qty": n} to add to it."""
+    user = request.user
+    if request.method == "GET":
+        return _cart_response(user)
+
+    data = CartAddSerializer(data=request.data)
+    data.is_valid(raise_exception=True)
+    product = get_object_or_404(Product, pk=data.validated_data["product"], is_available=True)
+    qty = data.validated_data["qty"]
+    if qty > product.quantity:
+        raise ValidationError({"qty": [f"Only {product.quantity} available."]})
+
+    try:
+        with transaction.atomic():
+            item, created = CartItem.objects.get_or_create(
+                user=user, product=product, defaults={"qty": qty}
+            )
+            if not created:
+                # same as the HTML form: adding past the stock caps the line
+                item.qty = min(item.qty + qty, product.quantity)
+                item.save(update_fields=["qty"])
+    except IntegrityError:
+        raise ValidationError({"product": ["Could not add to cart. Try again."]})
+
+    invalidate_cart_summary(user.id)
+    return _cart_response(user, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@api_view(["PATCH", "DELETE"])
+@permission_classes([IsLoggedIn])
+def cart_item(request, pk):
+    """PATCH {"qty": n} to change a line, DELETE to remove it."""
+    user = request.user
+    item = get_object_or_404(CartItem.objects.select_related("product"), pk=pk, user=user)
+    if request.method == "DELETE":
+        item.delete()
+        invalidate_cart_summary(user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    data = CartUpdateSerializer(data=request.data)
+    data.is_valid(raise_exception=True)
+    qty = data.validated_data["qty"]
+    if qty > item.product.quantity:
+        raise ValidationError({"qty": [f"Only {item.product.quantity} available."]})
+    item.qty = qty
+    item.save(update_fields=["qty"])
+    invalidate_cart_summary(user.id)
+    return _cart_response(user)
+
+
+@conditional(private=True)
+@api_view(["GET"])
+@permission_classes([IsLoggedIn])
+def order_list(request):
+    orders = Order.objects.filter(user=request.user, ordered=True).prefetch_related("items")
+    page_obj = cursor_paginate(orders, request.query_params.get("cursor"), _page_size(request))
+    return Response({
+        "results": OrderSerializer(page_obj.object_list, many=True).data,
+        "next": _link(request, cursor=page_obj.next_cursor) if page_obj.has_next else None,
+    })
+
+
+@conditional(private=True)
+@api_view(["GET"])
+@permission_classes([IsLoggedIn])
+def order_detail(request, pk):
+    order = get_object_or_404(
+        Order.objects.prefetch_related("items"), pk=pk, user=request.user, ordered=True
+    )
+    return Response(OrderSerializer(order).data)
@@ -0,0 +1,148 @@
+"""
+Async versions of the hot read views, served in place of the ones in
+views.py when MARKET_ASYNC_VIEWS is on (run under ASGI: ecofinds.asgi).
+
+They take the same parameters, render the same templates with the same
+context, and go through the same page cache. While a query runs the event
+loop is free to serve other requests, and queries that don't depend on each
+other are started together with asyncio.gather(). Django's async ORM still
+executes SQL through a worker thread per request, so on today's backends
+gathered queries queue up on that thread rather than overlap on the
+database. Templates render in that thread too (context processors may touch
+the session and the database).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import aprefetch_related_objects
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, render
+
+from .facets import afacet_counts, apply_filters, filter_query, parse_filters
+from .models import CartItem, Order, Product
+from .pagecache import cache_anonymous_page, detail_key, detail_validators, feed_key, feed_validators
+from .pagination import acursor_paginate, encode_cursor
+from .recommend import asimilar_products
+from .search import search_products
+from .utils import aget_account, login_required_custom
+from .views import FEED_MAX_PAGE, FEED_PAGE_SIZE, ORDERS_PAGE_SIZE
+
+arender = sync_to_async(render)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _aget_page(queryset, number, per_page):
+    """
+    Paginator(queryset, per_page).get_page(number), with the COUNT and the
+    requested page's rows fetched concurrently. Only an out-of-range page
+    number costs a third query.
+    """
+    paginator = Paginator(queryset, per_page)
+    try:
+        wanted = int(number)
+    except (TypeError, ValueError):
+        wanted = 1
+    bottom = max(wanted - 1, 0) * per_page
+    paginator.count, rows = await asyncio.gather(
+        queryset.acount(), _alist(queryset[bottom:bottom + per_page])
+    )
+    try:
+        number = paginator.validate_number(wanted)
+    except EmptyPage:
+        number = paginator.num_pages
+    if number != wanted:
+        bottom = (number - 1) * per_page
+        rows = await _alist(queryset[bottom:bottom + per_page])
+    return Page(rows, number, paginator)
+
+
+@cache_anonymous_page(feed_key, feed_validators)
+async def product_list(request):
+    q = request.GET.get("q", "").strip()
+    filters = parse_filters(request.GET)
+
+    base = Product.objects.filter(is_available=True)
+    if q:
+        base = search_products(base, q)
+    qs = apply_filters(base, filters)
+
+    cursor = request.GET.get("cursor")
+    next_cursor = None
+    # search results are ordered by rank, so they stay on page numbers
+    if cursor is not None and not q:
+        page_obj, facets = await asyncio.gather(
+            acursor_paginate(qs, cursor, FEED_PAGE_SIZE), afacet_counts(base, filters, q)
+        )
+        next_cursor = page_obj.next_cursor
+    else:
+        page = request.GET.get("page")
+        if page and page.isdigit() and int(page) > FEED_MAX_PAGE:
+            raise Http404("Page too deep, use cursor pagination.")
+        page_obj, facets = await asyncio.gather(
+            _aget_page(qs, page, FEED_PAGE_SIZE), afacet_counts(base, filters, q)
+        )
+        if not q and page_obj.has_next() and page_obj.number >= FEED_MAX_PAGE:
+            next_cursor = encode_cursor(page_obj.object_list[len(page_obj) - 1])
+
+    context = {
+        "page_obj": page_obj,
+        "cursor_mode": cursor is not None and not q,
+        "next_cursor": next_cursor,
+        "q": q,
+        "filters": filters,
+        "filter_query": filter_query(q, filters),
+        "facets": facets,
+    }
+    return await arender(request, "market/product_list.html", context)
+
+
+@cache_anonymous_page(detail_key, detail_validators)
+async def product_detail(request, slug):
+    product = await aget_object_or_404(Product.objects.select_related("owner"), slug=slug)
+    # the photos and the similar items both only need the product's id
+    _, similar = await asyncio.gather(
+        aprefetch_related_objects([product], "images"),
+        asimilar_products(product),
+    )
+    context = {"product": product, "similar_products": similar}
+    return await arender(request, "market/product_detail.html", context)
+
+
+@login_required_custom
+async def cart_view(request):
+    user = await aget_account(request)
+
+    cart_items = []
+    total = 0
+    async for it in CartItem.objects.filter(user=user).select_related("product"):
+        subtotal = it.subtotal
+        cart_items.append({
+            "id": it.id,
+            "product": it.product,
+            "qty": it.qty,
+            "subtotal": subtotal,
+        })
+        total += subtotal
+
+    context = {
+        "cart_items": cart_items,
+        "cart_total": total,
+    }
+    return await arender(request, "market/cart.html", context)
+
+
+@login_required_custom
+async def previous_purchases(request):
+    user = await aget_account(request)
+
+    orders_qs = Order.objects.filter(user=user, ordered=True).prefetch_related("items")
+    page_obj = await acursor_paginate(orders_qs, request.GET.get("cursor"), ORDERS_PAGE_SIZE)
+
+    return await arender(request, "market/previous_purchases.html", {
+        "orders": page_obj,
+        "next_cursor": page_obj.next_cursor,
+    })
@@ -0,0 +1,265 @@
+"""
+Request-level benchmarks for the marketplace's hot views.
+
+Each scenario drives one view through the Django test client against
+whatever data the database holds (see `manage.py seed_marketplace`) and
+records wall time and SQL query count per request. Results are compared
+with a baseline JSON file so a slower p50 or an extra query shows up as a
+regression instead of going unnoticed.
+
+Scenarios that write (checkout, and the staged cart for cart_view) run in a
+transaction that is rolled back, so the benchmark leaves the data as it was.
+"""
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .cart import invalidate_cart_summary
+from .models import CATEGORIES, CartItem, Order, Product, UserAccount
+
+PERCENTILES = (50, 90, 99)
+CART_LINES = 3
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction and throw its writes away."""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    result = {f"p{p}_ms": round(percentile(timings, p) * 1000, 2) for p in PERCENTILES}
+    result["mean_ms"] = round(sum(timings) / len(timings) * 1000, 2) if timings else 0.0
+    result["queries"] = max(queries) if queries else 0
+    result["iterations"] = len(timings)
+    return result
+
+
+class Bench:
+    """The clients, user and sample rows every scenario draws from."""
+
+    def __init__(self, user=None, seed=0, sample=500):
+        self.rng = random.Random(seed)
+        self.user = user or self._busiest_user()
+        if self.user is None:
+            raise ValueError("No accounts in the database; run seed_marketplace first.")
+
+        self.anon = Client()
+        self.client = Client()
+        session = self.client.session
+        session["user_id"] = self.user.id
+        session["username"] = self.user.username
+        session.save()
+
+        available = Product.objects.filter(is_available=True, quantity__gte=1)
+        # a random sample without ORDER BY RANDOM() over the whole table
+        max_id = available.order_by("-id").values_list("id", flat=True).first() or 0
+        ids = {self.rng.randint(1, max_id) for _ in range(sample)} if max_id else set()
+        self.products = list(
+            available.filter(id__in=ids).exclude(owner=self.user).values("id", "slug", "title")
+        ) or list(available.exclude(owner=self.user).values("id", "slug", "title")[:sample])
+        if not self.products:
+            raise ValueError("No available products in the database; run seed_marketplace first.")
+        self.words = sorted({w for p in self.products for w in p["title"].lower().split() if len(w) > 3})
+        self.categories = [k for k, _ in CATEGORIES]
+
+    @staticmethod
+    def _busiest_user():
+        """The account with the longest order history, so paging has work to do."""
+        top = (
+            Order.objects.filter(ordered=True)
+            .values("user_id").order_by().annotate(n=Count("id")).order_by("-n")
+            .values_list("user_id", flat=True).first()
+        )
+        if top is not None:
+            return UserAccount.objects.get(pk=top)
+        return UserAccount.objects.order_by("id").first()
+
+    def pick(self):
+        return self.rng.choice(self.products)
+
+    def stage_cart(self):
+        lines = self.rng.sample(self.products, min(CART_LINES, len(self.products)))
+        CartItem.objects.filter(user=self.user).delete()
+        CartItem.objects.bulk_create([CartItem(user=self.user, product_id=p["id"], qty=1) for p in lines])
+        invalidate_cart_summary(self.user.id)
+
+
+# Each scenario is (request, prepare): `request` issues one timed request and
+# returns the response; `prepare` does untimed setup in the same transaction.
+def _feed(bench):
+    return bench.client.get(reverse("market:product_list"))
+
+
+def _feed_deep(bench):
+    return bench.client.get(reverse("market:product_list"), {"page": 10})
+
+
+def _feed_cursor(bench):
+    return bench.client.get(reverse("market:product_list"), {"cursor": ""})
+
+
+def _feed_category(bench):
+    return bench.client.get(reverse("market:product_list"), {"category": bench.rng.choice(bench.categories)})
+
+
+def _feed_anonymous(bench):
+    return bench.anon.get(reverse("market:product_list"))
+
+
+def _search(bench):
+    q = bench.rng.choice(bench.words) if bench.words else bench.pick()["title"]
+    return bench.client.get(reverse("market:product_list"), {"q": q})
+
+
+def _detail(bench):
+    return bench.client.get(reverse("market:product_detail", kwargs={"slug": bench.pick()["slug"]}))
+
+
+def _cart(bench):
+    return bench.client.get(reverse("market:cart"))
+
+
+def _checkout(bench):
+    return bench.client.post(reverse("market:checkout"))
+
+
+def _orders(bench):
+    return bench.client.get(reverse("market:previous_purchases"))
+
+
+SCENARIOS = {
+    "feed": (_feed, None),
+    "feed_page_10": (_feed_deep, None),
+    "feed_cursor": (_feed_cursor, None),
+    "feed_category": (_feed_category, None),
+    "feed_anonymous_cached": (_feed_anonymous, None),
+    "search": (_search, None),
+    "product_detail": (_detail, None),
+    "cart_view": (_cart, Bench.stage_cart),
+    "checkout": (_checkout, Bench.stage_cart),
+    "previous_purchases": (_orders, None),
+}
+EXPECTED_STATUS = {"checkout": 302}
+
+
+def run_scenario(bench, name, iterations, warmup=2):
+    request, prepare = SCENARIOS[name]
+    expected = EXPECTED_STATUS.get(name, 200)
+    timings, queries = [], []
+    for i in range(warmup + iterations):
+        with rolled_back():
+            if prepare:
+                prepare(bench)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(bench)
+                elapsed = time.perf_counter() - start
+        if response.status_code != expected:
+            raise RuntimeError(f"{name}: expected HTTP {expected}, got {response.status_code}")
+        if i >= warmup:
+            timings.append(elapsed)
+            queries.append(len(captured))
+    if prepare:
+        # the staged cart was rolled back, the cached summary was not
+        invalidate_cart_summary(bench.user.id)
+    return summarize(timings, queries)
+
+
+def run(names=None, iterations=50, warmup=2, user=None, seed=0):
+    """{scenario: summary} for the named scenarios (default all)."""
+    bench = Bench(user=user, seed=seed)
+    # the test client's host must pass ALLOWED_HOSTS, and the slow-request
+    # log would dump every query of every slow iteration
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"], MARKET_SLOW_REQUEST_MS=0):
+        return {name: run_scenario(bench, name, iterations, warmup) for name in names or SCENARIOS}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    [(scenario, metric, baseline value, current value)] for every scenario
+    whose p50 grew by more than `tolerance` or that issues more queries.
+    """
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if current["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            regressions.append((name, "p50_ms", before["p50_ms"], current["p50_ms"]))
+        if current["queries"] > before["queries"]:
+            regressions.append((name, "queries", before["queries"], current["queries"]))
+    return regressions
+
+
+SESSION_ENGINES = ("db", "cached_db", "cache", "signed_cookies")
+
+
+def _session_queries(captured):
+    return sum("django_session" in q["sql"] for q in captured.captured_queries)
+
+
+def session_overhead(engines=SESSION_ENGINES, iterations=200, warmup=5, user=None):
+    """
+    {engine: summary} for a logged-in GET of a page that does nothing but read
+    the session (the about page), once per session backend, plus "anonymous"
+    (no session cookie, so nothing to load) as the floor to subtract.
+    "queries" counts only queries against the session table.
+    """
+    user = user or UserAccount.objects.order_by("id").first()
+    if user is None:
+        raise ValueError("No accounts in the database; run seed_marketplace first.")
+    url = reverse("market:about")
+    results = {}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"], MARKET_SLOW_REQUEST_MS=0):
+        for engine in ("anonymous", *engines):
+            backend = f"django.contrib.sessions.backends.{engine if engine != 'anonymous' else 'db'}"
+            with override_settings(SESSION_ENGINE=backend):
+                # a new client per engine: SessionMiddleware picks its store when built
+                client = Client()
+                if engine != "anonymous":
+                    session = client.session
+                    session["user_id"] = user.id
+                    session["username"] = user.username
+                    session.save()
+                    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+                timings, queries = [], []
+                for i in range(warmup + iterations):
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        elapsed = time.perf_counter() - start
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{engine}: expected HTTP 200, got {response.status_code}")
+                    if i >= warmup:
+                        timings.append(elapsed)
+                        queries.append(_session_queries(captured))
+                if engine != "anonymous":
+                    session.delete()
+            results[engine] = summarize(timings, queries)
+    return results
@@ -0,0 +1,46 @@
+"""
+Per-user cart summary (line count and total) kept in the cache.
+
+The navbar badge shows on every page, so it must not cost a CartItem query
+per request. Views that change a cart call invalidate_cart_summary(); the
+TTL only bounds staleness from things that don't, like a seller changing
+a price. It lives in the "shared" cache, so an invalidation in one worker
+process is seen by all of them.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+
+from .models import CartItem
+from .utils import shared_cache
+
+
+def cart_summary_key(user_id):
+    return f"market:cart:{user_id}"
+
+
+def get_cart_summary(user_id):
+    """{"count": number of cart lines, "total": Decimal}, cached."""
+    key = cart_summary_key(user_id)
+    summary = shared_cache.get(key)
+    if summary is None:
+        line_total = ExpressionWrapper(
+            F("qty") * F("product__price"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        agg = CartItem.objects.filter(user_id=user_id).aggregate(
+            count=Count("id"), total=Sum(line_total)
+        )
+        summary = {"count": agg["count"], "total": agg["total"] or Decimal("0")}
+        shared_cache.set(key, summary, getattr(settings, "MARKET_CART_CACHE_TTL", 300))
+    return summary
+
+
+def invalidate_cart_summary(user_id):
+    # drop it again after commit so a concurrent reader can't re-cache the
+    # pre-transaction state
+    key = cart_summary_key(user_id)
+    shared_cache.delete(key)
+    transaction.on_commit(lambda: shared_cache.delete(key))
@@ -0,0 +1,122 @@
+"""
+Streaming product import/export (CSV and JSON Lines).
+
+Both directions hold one batch at most in memory: imports read rows lazily
+and bulk_create them `batch_size` at a time, exports walk the table with
+.iterator().
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from .models import CATEGORIES, CONDITIONS
+
+TEXT_FIELDS = (
+    "title", "description", "brand", "model", "material", "color",
+    "working_condition_description",
+)
+DECIMAL_FIELDS = ("price", "length_cm", "width_cm", "height_cm", "weight_kg")
+INT_FIELDS = ("quantity", "year_of_manufacture")
+BOOL_FIELDS = ("original_packaging", "manual_included", "is_available")
+
+EXPORT_FIELDS = (
+    "id", "slug", "owner", "title", "description", "category", "condition",
+    *DECIMAL_FIELDS, *INT_FIELDS, "brand", "model", "material", "color",
+    *BOOL_FIELDS, "working_condition_description", "primary_image",
+    "created_at", "updated_at",
+)
+
+_categories = {k for k, _ in CATEGORIES}
+_conditions = {k for k, _ in CONDITIONS}
+_true = {"1", "true", "yes", "y", "on"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "jsonl" if str(path).endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_rows(stream, fmt):
+    """Yield dicts from a CSV or JSONL text stream, one line at a time."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def parse_row(row):
+    """Map a raw row onto Product field values. Raises RowError."""
+    data = {}
+    title = str(row.get("title") or "").strip()
+    if len(title) < 3:
+        raise RowError("title must be at least 3 characters")
+    for field in TEXT_FIELDS:
+        if row.get(field) not in (None, ""):
+            data[field] = str(row[field]).strip()
+    data["title"] = title
+
+    for field in DECIMAL_FIELDS:
+        value = row.get(field)
+        if value in (None, ""):
+            continue
+        try:
+            data[field] = Decimal(str(value))
+        except InvalidOperation:
+            raise RowError(f"{field} is not a number")
+        if data[field] < 0:
+            raise RowError(f"{field} must be non-negative")
+    if "price" not in data:
+        raise RowError("price is required")
+
+    for field in INT_FIELDS:
+        value = row.get(field)
+        if value in (None, ""):
+            continue
+        try:
+            data[field] = int(value)
+        except (TypeError, ValueError):
+            raise RowError(f"{field} is not an integer")
+        if data[field] < 0:
+            raise RowError(f"{field} must be non-negative")
+
+    for field in BOOL_FIELDS:
+        value = row.get(field)
+        if value not in (None, ""):
+            data[field] = value if isinstance(value, bool) else str(value).strip().lower() in _true
+
+    category = row.get("category") or "other"
+    data["category"] = category if category in _categories else "other"
+    condition = row.get("condition") or "used_good"
+    data["condition"] = condition if condition in _conditions else "used_good"
+    return data
+
+
+def image_names(row):
+    """Image file names listed in a row (';'-separated string or a list)."""
+    value = row.get("images") or []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [v.strip() for v in value if v and v.strip()]
+
+
+def export_row(product):
+    row = {}
+    for field in EXPORT_FIELDS:
+        if field == "owner":
+            row[field] = product.owner.username
+        else:
+            value = getattr(product, field)
+            if isinstance(value, Decimal):
+                value = str(value)
+            elif hasattr(value, "isoformat"):
+                value = value.isoformat()
+            row[field] = value
+    return row
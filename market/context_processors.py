@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_summary
+
+
+def cart_summary(request):
+    """Cart badge data for templates; only looked up if a template reads it."""
+    user_id = request.session.get("user_id") if hasattr(request, "session") else None
+    if not user_id:
+        return {"cart_summary": None}
+    return {"cart_summary": SimpleLazyObject(lambda: get_cart_summary(user_id))}
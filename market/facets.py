@@ -0,0 +1,156 @@
+"""
+Faceted filtering for the product feed.
+
+Each facet is a GET parameter holding one value (?brand=Sony&price=500-2000).
+Counts follow the usual disjunctive rule: a facet's own selection is ignored
+when counting its values, so the sidebar still shows the alternatives. All
+facets are counted in one round trip, a UNION ALL of one GROUP BY per facet.
+"""
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Cast
+from django.utils.http import urlencode
+
+from .models import CATEGORIES, CONDITIONS
+
+FACETS = ("category", "condition", "brand", "color", "year", "price")
+FACET_FIELDS = {
+    "category": "category",
+    "condition": "condition",
+    "brand": "brand",
+    "color": "color",
+    "year": "year_of_manufacture",
+}
+# (key, label, low inclusive, high exclusive)
+PRICE_RANGES = (
+    ("0-500", "Under ₹500", None, 500),
+    ("500-2000", "₹500 – ₹2,000", 500, 2000),
+    ("2000-10000", "₹2,000 – ₹10,000", 2000, 10000),
+    ("10000-", "₹10,000 and up", 10000, None),
+)
+# free-text facets only list their most common values
+FACET_LIMIT = 10
+
+_labels = {"category": dict(CATEGORIES), "condition": dict(CONDITIONS)}
+_prices = {key: (low, high) for key, _, low, high in PRICE_RANGES}
+
+
+def parse_filters(params):
+    """{facet: value} for the valid facet parameters in a QueryDict."""
+    filters = {}
+    for facet in FACETS:
+        value = (params.get(facet) or "").strip()
+        if not value:
+            continue
+        if facet in _labels and value not in _labels[facet]:
+            continue
+        if facet == "year" and not value.isdigit():
+            continue
+        if facet == "price" and value not in _prices:
+            continue
+        filters[facet] = value[:150]
+    return filters
+
+
+def _condition(facet, value):
+    if facet == "price":
+        low, high = _prices[value]
+        cond = Q()
+        if low is not None:
+            cond &= Q(price__gte=low)
+        if high is not None:
+            cond &= Q(price__lt=high)
+        return cond
+    return Q(**{FACET_FIELDS[facet]: int(value) if facet == "year" else value})
+
+
+def apply_filters(queryset, filters, exclude=None):
+    for facet, value in filters.items():
+        if facet != exclude:
+            queryset = queryset.filter(_condition(facet, value))
+    return queryset
+
+
+def _value_expression(facet):
+    if facet == "price":
+        return Case(
+            *[When(_condition("price", key), then=Value(key)) for key, *_ in PRICE_RANGES],
+            output_field=CharField(),
+        )
+    return Cast(F(FACET_FIELDS[facet]), CharField())
+
+
+def _counts_query(queryset, filters):
+    branches = []
+    for facet in FACETS:
+        qs = apply_filters(queryset, filters, exclude=facet).order_by()
+        if facet in ("brand", "color"):
+            qs = qs.exclude(**{FACET_FIELDS[facet]: ""})
+        elif facet == "year":
+            qs = qs.filter(year_of_manufacture__isnull=False)
+        branches.append(
+            qs.annotate(facet=Value(facet, output_field=CharField()), value=_value_expression(facet))
+            .values("facet", "value")
+            .annotate(n=Count("pk"))
+        )
+    return branches[0].union(*branches[1:], all=True)
+
+
+def facet_counts(queryset, filters, q=""):
+    """
+    {facet: [{"value", "label", "count", "selected", "url"}, ...]} for the
+    products in `queryset` (before facet filters are applied). `url` is the
+    feed query with that value toggled.
+    """
+    return _options(_counts_query(queryset, filters), filters, q)
+
+
+async def afacet_counts(queryset, filters, q=""):
+    """facet_counts() for async views."""
+    rows = [row async for row in _counts_query(queryset, filters)]
+    return _options(rows, filters, q)
+
+
+def _options(rows, filters, q):
+    counts = {facet: {} for facet in FACETS}
+    for row in rows:
+        counts[row["facet"]][row["value"]] = row["n"]
+
+    result = {}
+    for facet in FACETS:
+        found = counts[facet]
+        if facet in _labels:
+            values = [v for v in _labels[facet] if v in found]
+        elif facet == "price":
+            values = [key for key, *_ in PRICE_RANGES if key in found]
+        elif facet == "year":
+            values = sorted(found, key=int, reverse=True)[:FACET_LIMIT]
+        else:
+            values = sorted(found, key=lambda v: (-found[v], v.lower()))[:FACET_LIMIT]
+        selected = filters.get(facet)
+        if selected and selected not in values:
+            values.append(selected)
+        result[facet] = [
+            {
+                "value": value,
+                "label": _label(facet, value),
+                "count": found.get(value, 0),
+                "selected": value == selected,
+                "url": "?" + filter_query(q, filters, **{facet: "" if value == selected else value}),
+            }
+            for value in values
+        ]
+    return result
+
+
+def _label(facet, value):
+    if facet in _labels:
+        return _labels[facet].get(value, value)
+    if facet == "price":
+        return next(label for key, label, *_ in PRICE_RANGES if key == value)
+    return value
+
+
+def filter_query(q, filters, **changes):
+    """The feed's search and facet parameters as a query string, minus paging."""
+    query = {"q": q, **filters, **changes}
+    return urlencode([(k, v) for k, v in query.items() if v])
@@ -0,0 +1,127 @@
+"""
+Thumbnail and WebP variants for ProductImage.
+
+Uploads are stored as-is by the request; resizing happens afterwards in a
+small thread pool so a listing with many photos doesn't hold a worker.
+Each ProductImage ends up with
+
+    variants = {"webp": {"160": name, "480": name, ...}, "jpeg": {...}}
+
+and the product's primary image variants are mirrored onto
+Product.primary_image_variants so feed cards can build a srcset without
+touching the images table.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 480, 960)
+FORMATS = {"webp": ("WEBP", 80), "jpeg": ("JPEG", 82)}
+
+_executor = None
+
+
+def variant_name(name, width, fmt):
+    root, _ = os.path.splitext(name)
+    return f"{root}__w{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def srcset(variants, fmt="webp"):
+    """'url 160w, url 480w, ...' for an <img>/<source> srcset attribute."""
+    widths = (variants or {}).get(fmt, {})
+    return ", ".join(
+        f"{default_storage.url(name)} {w}w"
+        for w, name in sorted(widths.items(), key=lambda kv: int(kv[0]))
+    )
+
+
+def variant_url(variants, width, fmt="jpeg"):
+    name = (variants or {}).get(fmt, {}).get(str(width))
+    return default_storage.url(name) if name else None
+
+
+def render_variants(source, name):
+    """Resize an open image file into every width/format. Returns the variants dict."""
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        variants = {fmt: {} for fmt in FORMATS}
+        for width in VARIANT_WIDTHS:
+            resized = img.copy()
+            # never upscale; small originals just get re-encoded
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+            for fmt, (pil_format, quality) in FORMATS.items():
+                out = resized.convert("RGB") if pil_format == "JPEG" else resized
+                buf = BytesIO()
+                out.save(buf, pil_format, quality=quality, optimize=True)
+                target = variant_name(name, width, fmt)
+                if default_storage.exists(target):
+                    default_storage.delete(target)
+                variants[fmt][str(width)] = default_storage.save(target, ContentFile(buf.getvalue()))
+    return variants
+
+
+def process_image(image_id):
+    """Build variants for one ProductImage and record them. Safe to re-run."""
+    from .models import Product, ProductImage
+
+    pi = ProductImage.objects.filter(pk=image_id).first()
+    if pi is None or not pi.image:
+        return None
+    try:
+        with pi.image.open("rb") as source:
+            variants = render_variants(source, pi.image.name)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("could not build variants for %s", pi.image.name, exc_info=True)
+        return None
+
+    ProductImage.objects.filter(pk=pi.pk).update(variants=variants)
+    Product.objects.filter(pk=pi.product_id, primary_image=pi.image.name).update(
+        primary_image_variants=variants
+    )
+    return variants
+
+
+def _run(image_id):
+    try:
+        process_image(image_id)
+    except Exception:
+        logger.exception("image processing failed for ProductImage %s", image_id)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "MARKET_IMAGE_WORKERS", 2),
+            thread_name_prefix="market-images",
+        )
+    return _executor
+
+
+def schedule_variants(image_id):
+    """
+    Queue variant generation once the current transaction commits.
+    MARKET_IMAGE_PROCESSING: "sync" runs inline, "off" skips, anything else
+    ("thread", "worker") uses the in-process pool. Uploads that come through
+    market.uploads build their variants in the upload job instead.
+    """
+    mode = getattr(settings, "MARKET_IMAGE_PROCESSING", "thread")
+    if mode == "off":
+        return
+    if mode == "sync":
+        transaction.on_commit(lambda: process_image(image_id))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_run, image_id))
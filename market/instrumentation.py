@@ -0,0 +1,337 @@
+"""
+Per-request SQL and latency instrumentation.
+
+InstrumentationMiddleware times every request and counts its SQL queries
+(all database aliases), identical repeated queries and template render time.
+Each request then
+- updates in-process counters served in Prometheus text format at /metrics,
+- logs one JSON line to the "market.requests" logger,
+- if slower than MARKET_SLOW_REQUEST_MS, logs a warning listing its queries.
+
+The @instrumented decorator records the same numbers for work done outside
+any request (image workers, background refreshes, commands); inside a
+request it is a no-op, the request already being measured.
+
+Counters live in this process only: behind several worker processes, scrape
+each one or put a multiprocess-aware exporter in front.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger("market.requests")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+SLOW_QUERY_DUMP = 50
+
+_current = ContextVar("market_request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self, label=""):
+        self.label = label
+        self.start = time.perf_counter()
+        self.queries = []  # (sql, params, seconds)
+        self.template_seconds = 0.0
+        self.duration = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def duplicate_count(self):
+        return len(self.queries) - len({(sql, repr(params)) for sql, params, _ in self.queries})
+
+    @property
+    def db_seconds(self):
+        return sum(s for _, _, s in self.queries)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}  # (view, method, status) -> n
+            self.durations = {}  # view -> histogram
+            self.query_counts = {}  # view -> histogram
+            self.totals = {}  # (metric, view) -> float
+
+    def _add(self, metric, view, value):
+        key = (metric, view)
+        self.totals[key] = self.totals.get(key, 0) + value
+
+    def observe(self, stats, method, status, slow):
+        view = stats.label
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.durations.setdefault(view, _Histogram(DURATION_BUCKETS)).observe(stats.duration)
+            self.query_counts.setdefault(view, _Histogram(QUERY_BUCKETS)).observe(stats.query_count)
+            self._add("duplicate_queries", view, stats.duplicate_count)
+            self._add("db_seconds", view, stats.db_seconds)
+            self._add("template_seconds", view, stats.template_seconds)
+            if slow:
+                self._add("slow_requests", view, 1)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        from .pagecache import page_cache_stats
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, data, help_text):
+            family(name, "histogram", help_text)
+            for view, h in sorted(data.items()):
+                for bound, n in zip(h.buckets, h.counts):
+                    lines.append(f'{name}_bucket{{view="{_esc(view)}",le="{bound}"}} {n}')
+                lines.append(f'{name}_bucket{{view="{_esc(view)}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{view="{_esc(view)}"}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{view="{_esc(view)}"}} {h.count}')
+
+        with self._lock:
+            family("market_requests_total", "counter", "Requests handled, by view, method and status.")
+            for (view, method, status), n in sorted(self.requests.items()):
+                lines.append(
+                    f'market_requests_total{{view="{_esc(view)}",method="{method}",status="{status}"}} {n}'
+                )
+            histogram("market_request_duration_seconds", self.durations, "Wall time per request.")
+            histogram("market_request_queries", self.query_counts, "SQL queries per request.")
+            for metric, kind, help_text in (
+                ("duplicate_queries", "counter", "Queries repeated verbatim within one request."),
+                ("db_seconds", "counter", "Time spent in SQL."),
+                ("template_seconds", "counter", "Time spent rendering templates."),
+                ("slow_requests", "counter", "Requests over MARKET_SLOW_REQUEST_MS."),
+            ):
+                name = f"market_{metric}_total"
+                family(name, kind, help_text)
+                for (m, view), value in sorted(self.totals.items()):
+                    if m == metric:
+                        lines.append(f'{name}{{view="{_esc(view)}"}} {value:g}')
+
+        family("market_page_cache_total", "counter", "Anonymous page cache lookups by outcome.")
+        for outcome, n in sorted(page_cache_stats().items()):
+            lines.append(f'market_page_cache_total{{outcome="{outcome}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _esc(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+def _slow_ms():
+    return getattr(settings, "MARKET_SLOW_REQUEST_MS", 500)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.record_query(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    # outermost, and first so that execute_wrapper() blocks pop their own
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+# queries are attributed through the context variable, so they are counted
+# on whichever thread runs them: async views run the ORM in worker threads
+connection_created.connect(_install)
+
+
+@contextmanager
+def _track(stats):
+    """Make `stats` the current request's for the duration of the block."""
+    for conn in connections.all():
+        _install(conn)
+    token = _current.set(stats)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _report(stats, method, path, status):
+    threshold = _slow_ms()
+    slow = bool(threshold) and stats.duration * 1000 >= threshold
+    registry.observe(stats, method, status, slow)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "view": stats.label,
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(stats.duration * 1000, 2),
+            "queries": stats.query_count,
+            "duplicate_queries": stats.duplicate_count,
+            "db_ms": round(stats.db_seconds * 1000, 2),
+            "template_ms": round(stats.template_seconds * 1000, 2),
+        }))
+    if slow:
+        worst = sorted(stats.queries, key=lambda q: -q[2])[:SLOW_QUERY_DUMP]
+        logger.warning(
+            "slow request %s %s (%s): %.0f ms, %d queries\n%s",
+            method, path, stats.label, stats.duration * 1000, stats.query_count,
+            "\n".join(f"  {s * 1000:8.2f} ms  {sql}  {params!r}" for sql, params, s in worst),
+        )
+
+
+def _enabled():
+    return getattr(settings, "MARKET_INSTRUMENTATION", True) and _current.get() is None
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _enabled():
+            return self.get_response(request)
+
+        stats = RequestStats("unresolved")
+        with _track(stats):
+            response = self.get_response(request)
+        stats.finish()
+        _report(stats, request.method, request.path, response.status_code)
+        return response
+
+    async def __acall__(self, request):
+        if not _enabled():
+            return await self.get_response(request)
+
+        stats = RequestStats("unresolved")
+        with _track(stats):
+            response = await self.get_response(request)
+        stats.finish()
+        _report(stats, request.method, request.path, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current.get()
+        if stats is not None and request.resolver_match:
+            stats.label = request.resolver_match.view_name
+
+
+def instrumented(func=None, *, name=None):
+    """
+    Measure a view when InstrumentationMiddleware isn't installed, or any
+    other function called outside a request, under `name` (default
+    module.function). Inside an instrumented request it does nothing.
+    """
+    def decorator(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return func(*args, **kwargs)
+            request = args[0] if args and isinstance(args[0], HttpRequest) else None
+            stats = RequestStats(label)
+            result = None
+            with _track(stats):
+                try:
+                    result = func(*args, **kwargs)
+                    return result
+                finally:
+                    stats.finish()
+                    if request is not None:
+                        status = getattr(result, "status_code", 500)
+                        _report(stats, request.method, request.path, status)
+                    else:
+                        _report(stats, "CALL", label, "-")
+        return wrapper
+    return decorator(func) if func else decorator
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.template_seconds += time.perf_counter() - start
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """DjangoTemplates backend that adds render time to the request's stats."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def _metrics_allowed(request):
+    allowed = getattr(settings, "MARKET_METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+    return "*" in allowed or request.META.get("REMOTE_ADDR") in allowed
+
+
+def metrics_view(request):
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
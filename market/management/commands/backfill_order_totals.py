@@ -0,0 +1,26 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from market.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored Order.total from order items in one UPDATE."
+
+    def handle(self, *args, **options):
+        money = DecimalField(max_digits=12, decimal_places=2)
+        line_total = ExpressionWrapper(F("qty") * F("price_snapshot"), output_field=money)
+        items_total = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .order_by()
+            .values("order")
+            .annotate(s=Sum(line_total))
+            .values("s")
+        )
+        updated = Order.objects.update(
+            total=Coalesce(Subquery(items_total, output_field=money), Value(Decimal("0")), output_field=money)
+        )
+        self.stdout.write(self.style.SUCCESS(f"Backfilled totals for {updated} orders"))
@@ -0,0 +1,181 @@
+import random
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+from ecofinds.database import sqlite_options
+
+TABLE = "market_dbbench_row"
+ROWS = 10000
+
+
+def _sqlite_modes(directory):
+    """Django's defaults against the tuned connection settings, each on its own scratch file."""
+    plain = {"ENGINE": "django.db.backends.sqlite3", "CONN_MAX_AGE": 0, "OPTIONS": {}}
+    return {
+        "sqlite-default": {**plain, "NAME": str(Path(directory) / "default.sqlite3")},
+        "sqlite-wal": {
+            **plain, "NAME": str(Path(directory) / "wal.sqlite3"),
+            "CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True, "OPTIONS": sqlite_options(),
+        },
+    }
+
+
+def _postgres_modes(default):
+    """The configured PostgreSQL database, connecting per request, persistent and pooled."""
+    base = {**default, "OPTIONS": {k: v for k, v in default.get("OPTIONS", {}).items() if k != "pool"}}
+    modes = {
+        "postgres-per-request": {**base, "CONN_MAX_AGE": 0},
+        "postgres-persistent": {**base, "CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True},
+    }
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        modes["postgres-pooled"] = {
+            **base, "CONN_MAX_AGE": 0, "OPTIONS": {**base["OPTIONS"], "pool": {"min_size": 2, "max_size": 20}},
+        }
+    return modes
+
+
+class Workload:
+    """
+    Readers list the 12 "newest" rows; writers read a row then update it in
+    one transaction, the shape of a checkout. After every operation the
+    connection is released as at the end of a request, so CONN_MAX_AGE and
+    pooling matter as they would in production.
+    """
+
+    def __init__(self, alias, duration):
+        self.alias = alias
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.counts = {"reads": 0, "writes": 0, "errors": 0}
+        self.latencies = {"reads": [], "writes": []}
+
+    def setup(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"CREATE TABLE {TABLE} (id integer PRIMARY KEY, n integer NOT NULL, label varchar(50))")
+            cursor.execute(f"CREATE INDEX {TABLE}_n ON {TABLE} (n)")
+        with transaction.atomic(using=self.alias), connections[self.alias].cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (id, n, label) VALUES (%s, %s, %s)",
+                [(i, i, f"row {i}") for i in range(1, ROWS + 1)],
+            )
+        connections[self.alias].close()
+
+    def teardown(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        connections[self.alias].close()
+
+    def _read(self, rng):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(f"SELECT id, n, label FROM {TABLE} ORDER BY n DESC LIMIT 12")
+            cursor.fetchall()
+
+    def _write(self, rng):
+        pk = rng.randint(1, ROWS)
+        with transaction.atomic(using=self.alias), connections[self.alias].cursor() as cursor:
+            cursor.execute(f"SELECT n FROM {TABLE} WHERE id = %s", [pk])
+            (n,) = cursor.fetchone()
+            cursor.execute(f"UPDATE {TABLE} SET n = %s WHERE id = %s", [n + ROWS, pk])
+
+    def _loop(self, kind, seed, deadline):
+        rng = random.Random(seed)
+        operation = self._read if kind == "reads" else self._write
+        done, errors, latencies = 0, 0, []
+        connection = connections[self.alias]
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation(rng)
+                except OperationalError:
+                    errors += 1
+                else:
+                    done += 1
+                    latencies.append(time.perf_counter() - start)
+                connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
+        with self.lock:
+            self.counts[kind] += done
+            self.counts["errors"] += errors
+            self.latencies[kind].extend(latencies)
+
+    def run(self, readers, writers):
+        deadline = time.monotonic() + self.duration
+        threads = [
+            threading.Thread(target=self._loop, args=(kind, i, deadline))
+            for i, kind in enumerate(["reads"] * readers + ["writes"] * writers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.counts, self.latencies
+
+
+def _p95_ms(values):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))] * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent read/write throughput across database connection modes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode.")
+        parser.add_argument(
+            "--postgres", action="store_true",
+            help=f"Also run against the configured PostgreSQL database (creates and drops {TABLE}).",
+        )
+
+    def handle(self, *args, **options):
+        scratch = tempfile.mkdtemp(prefix="dbbench-")
+        modes = _sqlite_modes(scratch)
+        if options["postgres"]:
+            default = connections.settings["default"]
+            if default["ENGINE"] != "django.db.backends.postgresql":
+                raise CommandError("--postgres needs MARKET_DB_ENGINE=postgresql")
+            modes.update(_postgres_modes(default))
+
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, {options['duration']:g}s per mode"
+        )
+        self.stdout.write(f"{'mode':<24}{'reads/s':>10}{'writes/s':>10}{'read p95':>10}{'write p95':>11}{'errors':>8}")
+        try:
+            for name, config in modes.items():
+                alias = f"dbbench-{name}"
+                # fill in the defaults Django adds to every DATABASES entry
+                configured = connections.configure_settings({"default": connections.settings["default"], alias: config})
+                connections.settings[alias] = configured[alias]
+                try:
+                    workload = Workload(alias, options["duration"])
+                    workload.setup()
+                    counts, latencies = workload.run(options["readers"], options["writers"])
+                    workload.teardown()
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    del connections.settings[alias]
+                duration = options["duration"]
+                self.stdout.write(
+                    f"{name:<24}{counts['reads'] / duration:>10.0f}{counts['writes'] / duration:>10.0f}"
+                    f"{_p95_ms(latencies['reads']):>9.1f}ms{_p95_ms(latencies['writes']):>9.1f}ms"
+                    f"{counts['errors']:>8}"
+                )
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
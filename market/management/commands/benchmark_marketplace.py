@@ -0,0 +1,93 @@
+import json
+import platform
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from market import benchmarks
+from market.models import Product, UserAccount
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the feed, search, detail, cart, checkout and order history views "
+        "and compare latency percentiles and query counts with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Any of: {', '.join(benchmarks.SCENARIOS)}.")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--user", help="Username to browse as (default: the one with most orders).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--baseline", default=str(Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"),
+        )
+        parser.add_argument("--save-baseline", action="store_true", help="Write these results as the baseline.")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown (0.2 = 20%%).")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        names = options["scenarios"] or list(benchmarks.SCENARIOS)
+        unknown = set(names) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        user = None
+        if options["user"]:
+            user = UserAccount.objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No account named {options['user']!r}")
+
+        try:
+            results = benchmarks.run(
+                names, iterations=options["iterations"], warmup=options["warmup"],
+                user=user, seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'scenario':<24}{'p50':>9}{'p90':>9}{'p99':>9}{'mean':>9}{'queries':>9}")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<24}{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                f"{r['mean_ms']:>9.2f}{r['queries']:>9}"
+            )
+
+        path = Path(options["baseline"])
+        if options["save_baseline"]:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps({"meta": self._meta(options), "scenarios": results}, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {path}"))
+            return
+
+        if not path.exists():
+            self.stdout.write(f"No baseline at {path}; run with --save-baseline to create one.")
+            return
+
+        baseline = json.loads(path.read_text())
+        meta = baseline.get("meta", {})
+        if meta.get("products") != self._meta(options)["products"]:
+            self.stderr.write(
+                f"Note: baseline was taken with {meta.get('products')} products, "
+                f"this database has {Product.objects.count()}."
+            )
+        regressions = benchmarks.compare(results, baseline.get("scenarios", {}), options["tolerance"])
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f"REGRESSION {name} {metric}: {before} -> {after}"))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {path}"))
+        elif options["fail_on_regression"]:
+            raise CommandError(f"{len(regressions)} regression(s) against {path}")
+
+    def _meta(self, options):
+        return {
+            "taken_at": timezone.now().isoformat(timespec="seconds"),
+            "iterations": options["iterations"],
+            "products": Product.objects.count(),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+        }
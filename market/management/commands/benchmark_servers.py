@@ -0,0 +1,172 @@
+import http.client
+import importlib.util
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from market import benchmarks
+from market.models import UserAccount
+
+
+def _server_command(kind, port, threads):
+    """argv that serves the project on `port`, and a label for it."""
+    bind = f"127.0.0.1:{port}"
+    if kind == "asgi":
+        if importlib.util.find_spec("uvicorn") is None:
+            raise CommandError("The ASGI run needs uvicorn (pip install uvicorn).")
+        return [
+            sys.executable, "-m", "uvicorn", "ecofinds.asgi:application",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", "1", "--no-access-log",
+            "--log-level", "warning",
+        ], "uvicorn, async views"
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [
+            sys.executable, "-m", "gunicorn", "ecofinds.wsgi:application", "--bind", bind,
+            "--workers", "1", "--threads", str(threads), "--worker-class", "gthread",
+            "--log-level", "warning",
+        ], f"gunicorn gthread x{threads}, sync views"
+    return [
+        sys.executable, "manage.py", "runserver", bind, "--noreload", "--skip-checks",
+    ], "runserver (threaded WSGI), sync views"
+
+
+def _wait_for(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"Server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/about/")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+        finally:
+            conn.close()
+    raise CommandError(f"Server on port {port} didn't come up within {timeout}s")
+
+
+def _load(port, paths, concurrency, duration, cookie):
+    """Keep `concurrency` keep-alive clients busy for `duration` seconds."""
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    timings, errors = [], [0]
+
+    def client(offset):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        headers = {"Cookie": cookie} if cookie else {}
+        done, failed = [], 0
+        for path in itertools.islice(itertools.cycle(paths), offset, None):
+            if time.monotonic() >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            if ok:
+                done.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        conn.close()
+        with lock:
+            timings.extend(done)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings, errors[0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the site under a WSGI server (sync views) and under uvicorn "
+        "(MARKET_ASYNC_VIEWS=1) and compare concurrent request throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", nargs="+", choices=["wsgi", "asgi"], default=["wsgi", "asgi"])
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per server.")
+        parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument("--port", type=int, default=8701)
+        parser.add_argument("--user", help="Browse as this username (default: the one with most orders).")
+        parser.add_argument(
+            "--anonymous", action="store_true",
+            help="Don't log in (feed and product pages are then mostly page-cache hits).",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            user = UserAccount.objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No account named {options['user']!r}")
+        try:
+            bench = benchmarks.Bench(user=user)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        paths = [reverse("market:product_list"), reverse("market:product_list") + "?page=2"]
+        paths += [reverse("market:product_detail", kwargs={"slug": p["slug"]}) for p in bench.products[:20]]
+        cookie = None
+        session = None
+        if not options["anonymous"]:
+            paths += [reverse("market:cart"), reverse("market:previous_purchases")]
+            # the servers load sessions through the configured engine, so store it there
+            session = import_module(settings.SESSION_ENGINE).SessionStore()
+            session["user_id"] = bench.user.id
+            session["username"] = bench.user.username
+            session.save()
+            cookie = f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+        self.stdout.write(
+            f"{options['concurrency']} concurrent clients, {options['duration']:g}s per server, "
+            f"{len(paths)} URLs, {'anonymous' if options['anonymous'] else 'logged in as ' + bench.user.username}"
+        )
+        self.stdout.write(f"{'server':<40}{'req/s':>9}{'p50':>9}{'p99':>9}{'errors':>8}")
+        try:
+            for i, kind in enumerate(options["servers"]):
+                port = options["port"] + i
+                argv, label = _server_command(kind, port, options["threads"])
+                env = {
+                    **os.environ,
+                    "MARKET_ASYNC_VIEWS": "1" if kind == "asgi" else "0",
+                    "MARKET_SLOW_REQUEST_MS": "0",
+                }
+                process = subprocess.Popen(
+                    argv, cwd=settings.BASE_DIR, env=env,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                try:
+                    _wait_for(port, process)
+                    timings, errors = _load(port, paths, options["concurrency"], options["duration"], cookie)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=10)
+                timings.sort()
+                self.stdout.write(
+                    f"{label:<40}{len(timings) / options['duration']:>9.0f}"
+                    f"{benchmarks.percentile(timings, 50) * 1000:>7.1f}ms"
+                    f"{benchmarks.percentile(timings, 99) * 1000:>7.1f}ms{errors:>8}"
+                )
+        finally:
+            if session is not None:
+                session.delete()
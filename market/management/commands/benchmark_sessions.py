@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from market import benchmarks
+from market.models import UserAccount
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what loading a logged-in session costs per request under each "
+        "session backend (db, cached_db, cache, signed_cookies)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("engines", nargs="*", help=f"Any of: {', '.join(benchmarks.SESSION_ENGINES)}.")
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--user", help="Username the sessions belong to (default: the first account).")
+
+    def handle(self, *args, **options):
+        engines = options["engines"] or list(benchmarks.SESSION_ENGINES)
+        unknown = set(engines) - set(benchmarks.SESSION_ENGINES)
+        if unknown:
+            raise CommandError(f"Unknown session engines: {', '.join(sorted(unknown))}")
+
+        user = None
+        if options["user"]:
+            user = UserAccount.objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No account named {options['user']!r}")
+        try:
+            results = benchmarks.session_overhead(
+                engines,
+                iterations=options["iterations"], warmup=options["warmup"], user=user,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        floor = results["anonymous"]["p50_ms"]
+        configured = settings.SESSION_ENGINE.rsplit(".", 1)[-1]
+        self.stdout.write(f"{'engine':<24}{'p50':>9}{'p99':>9}{'overhead':>10}{'queries':>9}")
+        for engine, r in results.items():
+            label = f"{engine} (configured)" if engine == configured else engine
+            overhead = r["p50_ms"] - floor if engine != "anonymous" else 0.0
+            self.stdout.write(
+                f"{label:<24}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{overhead:>10.2f}{r['queries']:>9}"
+            )
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from market.images import process_image
+from market.models import ProductImage
+
+
+def _process(image_id):
+    try:
+        return process_image(image_id) is not None
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and WebP variants for existing product images."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild images that already have variants.")
+        parser.add_argument("--workers", type=int, default=4)
+
+    def handle(self, *args, **options):
+        qs = ProductImage.objects.order_by("id")
+        if not options["all"]:
+            qs = qs.filter(variants={})
+        ids = list(qs.values_list("id", flat=True))
+
+        start = time.monotonic()
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                done = sum(pool.map(_process, ids))
+        else:
+            done = sum(process_image(i) is not None for i in ids)
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Built variants for {done}/{len(ids)} images in {elapsed:.1f}s"
+        ))
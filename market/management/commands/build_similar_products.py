@@ -0,0 +1,61 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from market import recommend
+
+
+def _synthetic_corpus(n, seed=0):
+    """n fake listings drawn from a Zipf-ish vocabulary, for timing only."""
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(20000)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocab))))
+    brands = [f"brand{i}" for i in range(500)]
+    for _ in range(n):
+        yield recommend.tokens({
+            "title": " ".join(rng.choices(vocab, cum_weights=cum_weights, k=5)),
+            "brand": rng.choice(brands),
+            "description": " ".join(rng.choices(vocab, cum_weights=cum_weights, k=40)),
+        })
+
+
+class Command(BaseCommand):
+    help = "Recompute the 'similar items' table (only changed listings unless --full)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rebuild every product's neighbours.")
+        parser.add_argument("--limit", type=int, help="Refresh at most this many changed products.")
+        parser.add_argument(
+            "--benchmark", type=int, nargs="?", const=100000, metavar="N",
+            help="Time a full rebuild over N synthetic products (default 100k, no database access).",
+        )
+
+    def handle(self, *args, **options):
+        backend = "numpy/scipy" if recommend.sparse is not None else "pure python"
+        start = time.monotonic()
+
+        if options["benchmark"]:
+            n = options["benchmark"]
+            token_lists = list(_synthetic_corpus(n))
+            built = time.monotonic()
+            corpus = recommend.Corpus(list(range(n)), token_lists)
+            vectorized = time.monotonic()
+            corpus.neighbours(list(range(n)))
+            ranked = time.monotonic()
+            self.stdout.write(
+                f"{n} products ({backend}): tokenize {built - start:.1f}s, "
+                f"tf-idf {vectorized - built:.1f}s, top-{recommend.TOP_K} {ranked - vectorized:.1f}s"
+            )
+            self.stdout.write(self.style.SUCCESS(f"Full rebuild of {n} products: {ranked - start:.1f}s"))
+            return
+
+        if options["full"]:
+            count = recommend.rebuild()
+        else:
+            count = recommend.refresh(limit=options["limit"])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed similar items for {count} products in {elapsed:.1f}s ({backend})"
+        ))
@@ -0,0 +1,52 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from market.catalog_io import EXPORT_FIELDS, detect_format, export_row
+from market.models import Product
+
+
+class Command(BaseCommand):
+    help = "Stream the product catalog to CSV or JSON Lines (stdout by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", default="-")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension, else csv.")
+        parser.add_argument("--owner", help="Only this seller's listings (username).")
+        parser.add_argument("--available", action="store_true", help="Skip unavailable listings.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        qs = Product.objects.select_related("owner").order_by("id")
+        if options["owner"]:
+            qs = qs.filter(owner__username=options["owner"])
+        if options["available"]:
+            qs = qs.filter(is_available=True)
+
+        path = options["output"]
+        fmt = detect_format(path, options["format"])
+        out = self.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+
+        count = 0
+        start = time.monotonic()
+        try:
+            if fmt == "csv":
+                writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+                writer.writeheader()
+                write = writer.writerow
+            else:
+                def write(row):
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            for product in qs.iterator(chunk_size=options["chunk_size"]):
+                write(export_row(product))
+                count += 1
+        finally:
+            if out is not self.stdout:
+                out.close()
+
+        elapsed = time.monotonic() - start
+        self.stderr.write(
+            f"Exported {count} products in {elapsed:.1f}s, {count / elapsed if elapsed else count:.0f} rows/s"
+        )
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from market.catalog_io import RowError, detect_format, image_names, parse_row, read_rows
+from market.models import ImageUploadJob, Product, UserAccount
+from market.pagecache import invalidate_product_pages
+from market.search import get_backend
+from market.slugs import allocate_slugs, random_slug
+from market.uploads import run_pending_jobs, stage_local_file
+
+SLUG_RETRIES = 3
+
+
+def _batches(iterable, size):
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Bulk-create products from a CSV or JSON Lines file (use - for stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--owner", help="Username or email of the seller; rows may override with an 'owner' column.")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--images-dir", help="Directory that the 'images' column (';'-separated) is relative to.")
+        parser.add_argument(
+            "--defer-images", action="store_true",
+            help="Only queue image jobs; leave them for process_image_jobs.",
+        )
+        parser.add_argument("--image-workers", type=int, default=getattr(settings, "MARKET_IMAGE_WORKERS", 2))
+
+    def handle(self, *args, **options):
+        self.owners = {}
+        self.default_owner = None
+        if options["owner"]:
+            try:
+                self.default_owner = self._owner(options["owner"])
+            except RowError as e:
+                raise CommandError(e)
+        self.images_dir = os.path.realpath(options["images_dir"]) if options["images_dir"] else None
+        self.backend = get_backend()
+
+        path = options["path"]
+        fmt = detect_format(path, options["format"])
+        created = skipped = images = 0
+        start = time.monotonic()
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            rows = enumerate(read_rows(stream, fmt), start=2 if fmt == "csv" else 1)
+            for batch in _batches(rows, options["batch_size"]):
+                pending = []
+                for line, row in batch:
+                    try:
+                        pending.append(self._build(row))
+                    except RowError as e:
+                        skipped += 1
+                        self.stderr.write(f"line {line}: {e}")
+                if not pending:
+                    continue
+                images += self._save_batch(pending)
+                created += len(pending)
+                if options["verbosity"] > 1:
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(f"{created} rows ({created / elapsed:.0f} rows/s)")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        invalidate_product_pages()
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} products ({skipped} skipped) in {elapsed:.1f}s, "
+            f"{created / elapsed if elapsed else created:.0f} rows/s"
+        ))
+
+        if images:
+            mode = getattr(settings, "MARKET_IMAGE_PROCESSING", "thread")
+            if options["defer_images"] or mode in ("worker", "off"):
+                self.stdout.write(f"Queued {images} images for process_image_jobs")
+            else:
+                start = time.monotonic()
+                done = run_pending_jobs(workers=options["image_workers"])
+                self.stdout.write(f"Processed {done} images in {time.monotonic() - start:.1f}s")
+
+    def _owner(self, ref):
+        if ref not in self.owners:
+            user = UserAccount.objects.filter(Q(username=ref) | Q(email=ref)).first()
+            if user is None:
+                raise RowError(f"unknown owner {ref!r}")
+            self.owners[ref] = user
+        return self.owners[ref]
+
+    def _image_paths(self, row):
+        names = image_names(row)
+        if names and not self.images_dir:
+            raise RowError("row lists images but --images-dir was not given")
+        paths = []
+        for name in names:
+            path = os.path.realpath(os.path.join(self.images_dir, name))
+            if not path.startswith(self.images_dir + os.sep) or not os.path.isfile(path):
+                raise RowError(f"image not found: {name}")
+            paths.append(path)
+        return paths
+
+    def _build(self, row):
+        data = parse_row(row)
+        owner = self._owner(row["owner"]) if row.get("owner") else self.default_owner
+        if owner is None:
+            raise RowError("no owner (pass --owner or an 'owner' column)")
+        paths = self._image_paths(row)
+        return Product(owner=owner, images_pending=len(paths), **data), paths
+
+    def _save_batch(self, pending):
+        """Insert one batch with its search rows and image jobs. Returns the job count."""
+        products = [p for p, _ in pending]
+        with transaction.atomic():
+            self._insert(products)
+            self.backend.index_many(products)
+            jobs = ImageUploadJob.objects.bulk_create([
+                ImageUploadJob(product=product, staged_name=stage_local_file(path),
+                               original_name=os.path.basename(path))
+                for product, paths in pending
+                for path in paths
+            ])
+        return len(jobs)
+
+    def _insert(self, products):
+        # slugs are allocated per batch, so a concurrent import can take one
+        # first; re-allocate a couple of times, then fall back to random
+        for attempt in range(SLUG_RETRIES + 1):
+            if attempt < SLUG_RETRIES:
+                slugs = allocate_slugs(Product, [p.title for p in products])
+            else:
+                slugs = [random_slug(p.title) for p in products]
+            for product, slug in zip(products, slugs):
+                product.slug = slug
+            try:
+                with transaction.atomic():
+                    return Product.objects.bulk_create(products)
+            except IntegrityError:
+                for product in products:
+                    product.pk = None
+                if attempt == SLUG_RETRIES:
+                    raise
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from market.models import ImageUploadJob
+from market.uploads import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Work through queued listing photo uploads (use with MARKET_IMAGE_PROCESSING=worker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--batch", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to sleep when idle.")
+        parser.add_argument(
+            "--stale-after", type=int, default=10,
+            help="Minutes after which a running job is assumed orphaned and retried.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            cutoff = timezone.now() - timedelta(minutes=options["stale_after"])
+            ImageUploadJob.objects.filter(status="running", updated_at__lt=cutoff).update(status="pending")
+
+            start = time.monotonic()
+            done = run_pending_jobs(limit=options["batch"], workers=options["workers"])
+            if done:
+                elapsed = time.monotonic() - start
+                self.stdout.write(f"processed {done} uploads in {elapsed:.1f}s")
+            if options["once"]:
+                if done < options["batch"]:
+                    break
+                continue
+            if not done:
+                time.sleep(options["interval"])
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        start = time.monotonic()
+        total = backend.rebuild(batch_size=options["batch_size"])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {total} products with {type(backend).__name__} in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,218 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from market.models import (
+    CATEGORIES, CONDITIONS, CartItem, Order, OrderItem, Product, ProductImage, UserAccount,
+)
+from market.pagecache import invalidate_product_pages
+from market.passwords import hash_password
+from market.search import get_backend
+from market.slugs import slug_base
+
+SEED_PASSWORD = "password"
+PLACEHOLDER_DIR = "seed"
+PLACEHOLDER_COUNT = 24
+
+NOUNS = {
+    "electronics": ["headphones", "speaker", "phone", "laptop", "camera", "monitor", "keyboard", "tablet"],
+    "books": ["novel", "textbook", "cookbook", "comic", "atlas", "dictionary", "biography"],
+    "clothing": ["jacket", "jeans", "sweater", "dress", "sneakers", "scarf", "shirt"],
+    "furniture": ["sofa", "desk", "chair", "bookshelf", "wardrobe", "bed frame", "dining table"],
+    "home": ["lamp", "rug", "mirror", "kettle", "curtains", "vase", "toaster"],
+    "toys": ["puzzle", "lego set", "doll", "board game", "rc car", "kite"],
+    "other": ["guitar", "bicycle", "yoga mat", "suitcase", "umbrella", "backpack"],
+}
+ADJECTIVES = ["vintage", "compact", "wireless", "wooden", "leather", "classic", "portable",
+              "foldable", "waterproof", "handmade", "large", "small", "mini", "pro", "retro"]
+BRANDS = ["Sony", "Samsung", "Apple", "Ikea", "Nike", "Adidas", "Philips", "Bosch", "Lenovo",
+          "Canon", "Decathlon", "Penguin", "Hasbro", "Levi's", "Puma", "Dell", "HP", "Yamaha"]
+COLORS = ["black", "white", "grey", "blue", "red", "green", "brown", "beige", "silver"]
+SENTENCES = [
+    "Works perfectly, barely used.", "Minor scratches on the side.", "Comes with the original box.",
+    "Selling because I moved.", "Pick up only.", "Cleaned and tested.", "Some signs of wear.",
+    "All parts included.", "Smoke-free home.", "Battery holds charge well.",
+]
+
+
+@contextmanager
+def manual_timestamps(*models):
+    """Let bulk inserts keep the created_at/updated_at values we generate."""
+    fields = [f for m in models for f in m._meta.fields if getattr(f, "auto_now_add", False) or getattr(f, "auto_now", False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def _chunks(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate a realistic catalog (users, products, images, carts, orders) for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--users", type=int, help="Defaults to one seller per 20 products.")
+        parser.add_argument("--images-per-product", type=int, default=1)
+        parser.add_argument("--carts", type=int, help="Users with a non-empty cart (default users / 4).")
+        parser.add_argument("--orders", type=int, help="Completed orders (default products / 5).")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--days", type=int, default=365, help="Spread created_at over this many days.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.run = uuid.uuid4().hex[:4]
+        self.now = timezone.now()
+        self.span = timedelta(days=options["days"]).total_seconds()
+        self.batch = options["batch_size"]
+        n_products = options["products"]
+        n_users = options["users"] or max(1, n_products // 20)
+        n_carts = options["carts"] if options["carts"] is not None else n_users // 4
+        n_orders = options["orders"] if options["orders"] is not None else n_products // 5
+
+        with manual_timestamps(Product, ProductImage, CartItem, UserAccount):
+            user_ids = self._step("users", n_users, self._users)
+            self.placeholders = self._placeholders() if options["images_per_product"] else []
+            product_ids = self._step(
+                "products", n_products,
+                lambda start, size: self._products(start, size, user_ids, options["images_per_product"]),
+            )
+            self._step("carts", n_carts, lambda start, size: self._carts(size, user_ids, product_ids))
+            self._step("orders", n_orders, lambda start, size: self._orders(size, user_ids, product_ids))
+
+        invalidate_product_pages()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded run {self.run}; every seeded account's password is {SEED_PASSWORD!r}"
+        ))
+
+    def _step(self, label, total, make_batch):
+        start_time = time.monotonic()
+        ids = []
+        for start, size in _chunks(total, self.batch):
+            with transaction.atomic():
+                ids.extend(make_batch(start, size))
+        elapsed = time.monotonic() - start_time
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(f"{label}: {total} rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
+        return ids
+
+    def _past(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.span)
+
+    def _users(self, start, size):
+        password = getattr(self, "_password", None) or hash_password(SEED_PASSWORD)
+        self._password = password
+        users = UserAccount.objects.bulk_create([
+            UserAccount(
+                username=f"seed{self.run}_{i}", email=f"seed{self.run}_{i}@example.com",
+                password=password, created_at=self._past(),
+            )
+            for i in range(start, start + size)
+        ])
+        return [u.pk for u in users]
+
+    def _placeholders(self):
+        names = []
+        for i in range(PLACEHOLDER_COUNT):
+            name = f"{PLACEHOLDER_DIR}/placeholder-{i}.jpg"
+            if not default_storage.exists(name):
+                buf = BytesIO()
+                color = tuple(self.rng.randrange(40, 220) for _ in range(3))
+                Image.new("RGB", (800, 600), color).save(buf, "JPEG", quality=80)
+                name = default_storage.save(name, ContentFile(buf.getvalue()))
+            names.append(name)
+        return names
+
+    def _products(self, start, size, user_ids, images_per_product):
+        rng = self.rng
+        categories = [k for k, _ in CATEGORIES]
+        conditions = [k for k, _ in CONDITIONS]
+        products = []
+        for i in range(start, start + size):
+            category = rng.choice(categories)
+            brand = rng.choice(BRANDS) if rng.random() < 0.7 else ""
+            title = " ".join(filter(None, [brand, rng.choice(ADJECTIVES), rng.choice(NOUNS[category])]))
+            created = self._past()
+            products.append(Product(
+                owner_id=rng.choice(user_ids),
+                title=title if brand else title.capitalize(),
+                # the "-sRUNi" suffix can't collide with allocate_slug's numeric ones
+                slug=f"{slug_base(title)}-s{self.run}{i}",
+                description=" ".join(rng.sample(SENTENCES, 3)),
+                category=category,
+                condition=rng.choice(conditions),
+                price=Decimal(round(rng.lognormvariate(7, 1.2), 2)).quantize(Decimal("0.01")),
+                quantity=rng.choice([1, 1, 1, 2, 3, 5, 10]),
+                brand=brand,
+                color=rng.choice(COLORS) if rng.random() < 0.6 else "",
+                year_of_manufacture=rng.randint(1990, self.now.year) if rng.random() < 0.5 else None,
+                is_available=rng.random() < 0.95,
+                primary_image=self.placeholders[i % len(self.placeholders)] if images_per_product else "",
+                created_at=created,
+                updated_at=created,
+            ))
+        Product.objects.bulk_create(products)
+        get_backend().index_many(products)
+        if images_per_product:
+            ProductImage.objects.bulk_create([
+                ProductImage(
+                    product_id=p.pk, created_at=p.created_at,
+                    image=self.placeholders[(i + k) % len(self.placeholders)] if k else p.primary_image,
+                )
+                for i, p in enumerate(products)
+                for k in range(images_per_product)
+            ])
+        return [p.pk for p in products]
+
+    def _carts(self, size, user_ids, product_ids):
+        owners = self.rng.sample(user_ids, min(size, len(user_ids)))
+        items = []
+        for user_id in owners:
+            for product_id in set(self.rng.sample(product_ids, min(len(product_ids), self.rng.randint(1, 5)))):
+                items.append(CartItem(user_id=user_id, product_id=product_id, qty=1, created_at=self._past()))
+        CartItem.objects.bulk_create(items, ignore_conflicts=True)
+        return owners
+
+    def _orders(self, size, user_ids, product_ids):
+        rng = self.rng
+        picks = [rng.sample(product_ids, min(len(product_ids), rng.randint(1, 4))) for _ in range(size)]
+        prices = dict(
+            Product.objects.filter(pk__in={pk for p in picks for pk in p}).values_list("pk", "price")
+        )
+        titles = dict(
+            Product.objects.filter(pk__in=prices).values_list("pk", "title")
+        )
+        orders, lines = [], []
+        for chosen in picks:
+            items = [(pk, rng.randint(1, 2)) for pk in chosen]
+            orders.append(Order(
+                user_id=rng.choice(user_ids), ordered=True, created_at=self._past(),
+                total=sum(prices[pk] * qty for pk, qty in items),
+            ))
+            lines.append(items)
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order.pk, product_id=pk, title=titles[pk], qty=qty, price_snapshot=prices[pk])
+            for order, items in zip(orders, lines)
+            for pk, qty in items
+        ])
+        return [o.pk for o in orders]
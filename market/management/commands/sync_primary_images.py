@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import JSONField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from market.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.primary_image for every product in one UPDATE."
+
+    def handle(self, *args, **options):
+        first_image = (
+            ProductImage.objects.filter(product=OuterRef("pk"))
+            .order_by("created_at", "id")
+        )
+        updated = Product.objects.update(
+            primary_image=Coalesce(Subquery(first_image.values("image")[:1]), Value("")),
+            primary_image_variants=Coalesce(
+                Subquery(first_image.values("variants")[:1]),
+                Value({}, output_field=JSONField()),
+            ),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Synced primary image for {updated} products"))
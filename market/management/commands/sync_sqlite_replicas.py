@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into every SQLite replica in MARKET_DB_REPLICAS. "
+        "A local stand-in for replication: run it once, or with --every N to simulate lag."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--every", type=float, help="Keep copying every N seconds.")
+
+    def handle(self, *args, **options):
+        primary = connections["default"]
+        if primary.vendor != "sqlite":
+            raise CommandError("The primary isn't SQLite; use the database's own replication.")
+        targets = [
+            connections.settings[alias]["NAME"]
+            for alias in settings.MARKET_DB_REPLICAS
+            if connections.settings[alias]["ENGINE"] == "django.db.backends.sqlite3"
+        ]
+        if not targets:
+            raise CommandError("No SQLite replicas configured (set MARKET_DB_REPLICAS).")
+
+        while True:
+            start = time.monotonic()
+            primary.ensure_connection()
+            for name in targets:
+                target = sqlite3.connect(name)
+                try:
+                    primary.connection.backup(target)
+                finally:
+                    target.close()
+            self.stdout.write(f"Copied to {len(targets)} replica(s) in {time.monotonic() - start:.2f}s")
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
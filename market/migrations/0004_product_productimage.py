@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(db_index=True, max_length=250)),
+                ('slug', models.SlugField(blank=True, max_length=280, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('category', models.CharField(choices=[('electronics', 'Electronics'), ('books', 'Books'), ('clothing', 'Clothing'), ('furniture', 'Furniture'), ('home', 'Home'), ('toys', 'Toys'), ('other', 'Other')], default='other', max_length=50)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('condition', models.CharField(choices=[('new', 'New'), ('like_new', 'Like New'), ('used_good', 'Used - Good'), ('used_fair', 'Used - Fair'), ('for_parts', 'For parts / not working')], default='used_good', max_length=30)),
+                ('year_of_manufacture', models.PositiveIntegerField(blank=True, null=True)),
+                ('brand', models.CharField(blank=True, max_length=150)),
+                ('model', models.CharField(blank=True, max_length=150)),
+                ('length_cm', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True)),
+                ('width_cm', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True)),
+                ('height_cm', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True)),
+                ('weight_kg', models.DecimalField(blank=True, decimal_places=3, max_digits=7, null=True)),
+                ('material', models.CharField(blank=True, max_length=100)),
+                ('color', models.CharField(blank=True, max_length=80)),
+                ('original_packaging', models.BooleanField(default=False)),
+                ('manual_included', models.BooleanField(default=False)),
+                ('working_condition_description', models.TextField(blank=True)),
+                ('is_available', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='market.useraccount')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='products/%Y/%m/%d/')),
+                ('alt', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='market.product')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
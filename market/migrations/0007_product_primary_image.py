@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:43
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_primary_image(apps, schema_editor):
+    # same UPDATE as `manage.py sync_primary_images`, on the historical models
+    Product = apps.get_model('market', 'Product')
+    ProductImage = apps.get_model('market', 'ProductImage')
+    first_image = (
+        ProductImage.objects.filter(product=OuterRef('pk'))
+        .order_by('created_at', 'id')
+        .values('image')[:1]
+    )
+    Product.objects.update(primary_image=Coalesce(Subquery(first_image), Value('')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_useraccount_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_primary_image, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:43
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    # same UPDATE as `manage.py backfill_order_totals`, on the historical models
+    Order = apps.get_model('market', 'Order')
+    OrderItem = apps.get_model('market', 'OrderItem')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    line_total = ExpressionWrapper(F('qty') * F('price_snapshot'), output_field=money)
+    items_total = (
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(s=Sum(line_total))
+        .values('s')
+    )
+    Order.objects.update(
+        total=Coalesce(Subquery(items_total, output_field=money), Value(Decimal('0')), output_field=money)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
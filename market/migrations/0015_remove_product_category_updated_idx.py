@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_product_category_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_updated_idx',
+        ),
+    ]
@@ -1,6 +1,13 @@
-from django.db import models
-from django.utils.text import slugify
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
+
+from .images import srcset, variant_url
+from .slugs import allocate_slug, random_slug
+
+SLUG_RETRIES = 3
+
+
 class UserAccount(models.Model):
     username = models.CharField(max_length=150, unique=True)
     email = models.EmailField(unique=True)
@@ -61,36 +68,90 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # storage name of the first ProductImage, kept in sync by signals so cards
+    # can render their image without touching the images table
+    primary_image = models.CharField(max_length=255, blank=True, editable=False)
+    primary_image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # uploads still waiting in ImageUploadJob; the page shows "processing" while > 0
+    images_pending = models.PositiveIntegerField(default=0, editable=False)
+    # text changed since the similar-products index last looked at this row
+    similar_stale = models.BooleanField(default=True, editable=False)
+
     class Meta:
-        ordering = ["-created_at"]
+        # id breaks ties so keyset pagination never skips or repeats a row
+        ordering = ["-created_at", "-id"]
+        indexes = [
+            # is_available is a bare boolean in the WHERE clause, which SQLite
+            # can't seek through for ORDER BY; partial indexes sidestep that
+            models.Index(
+                fields=["category", "created_at", "id"],
+                name="product_feed_cat_idx",
+                condition=models.Q(is_available=True),
+            ),
+            models.Index(
+                fields=["created_at", "id"],
+                name="product_feed_idx",
+                condition=models.Q(is_available=True),
+            ),
+            # dashboard "my listings": only in-stock rows are ever read
+            models.Index(
+                fields=["owner", "created_at"],
+                name="product_owner_instock_idx",
+                condition=models.Q(is_available=True, quantity__gt=0),
+            ),
+            models.Index(fields=["id"], name="product_similar_stale_idx", condition=models.Q(similar_stale=True)),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base = slugify(self.title)[:220]
-            slug = base
-            num = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f"{base}-{num}"
-                num += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        # another insert can grab the same slug between allocation and
+        # INSERT; re-allocate a couple of times, then fall back to random
+        for attempt in range(SLUG_RETRIES + 1):
+            if attempt < SLUG_RETRIES:
+                self.slug = allocate_slug(Product, self.title)
+            else:
+                self.slug = random_slug(self.title)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SLUG_RETRIES or not Product.objects.filter(slug=self.slug).exists():
+                    self.slug = ""
+                    raise
 
     @property
     def primary_image_url(self):
-        first = self.images.first()
-        if first and first.image:
-            return first.image.url
+        if self.primary_image:
+            return default_storage.url(self.primary_image)
         return "/static/img/placeholder.png"
 
+    @property
+    def primary_thumbnail_url(self):
+        """480px JPEG for cards, or the original until variants exist."""
+        return variant_url(self.primary_image_variants, 480) or self.primary_image_url
+
+    @property
+    def primary_image_srcset(self):
+        return srcset(self.primary_image_variants)
+
+    @property
+    def primary_image_jpeg_srcset(self):
+        """The <img> fallback next to a WebP <source>, for browsers without WebP."""
+        return srcset(self.primary_image_variants, "jpeg")
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to="products/%Y/%m/%d/")
     alt = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # resized copies, filled in by market.images after upload
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ["created_at"]
@@ -98,6 +159,55 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"Image for {self.product.title}"
 
+    @property
+    def thumbnail_url(self):
+        return variant_url(self.variants, 160) or self.image.url
+
+    @property
+    def srcset(self):
+        return srcset(self.variants)
+
+JOB_STATUSES = [
+    ("pending", "Pending"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+]
+
+class ImageUploadJob(models.Model):
+    """An uploaded file parked in staging until a worker turns it into a ProductImage."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="upload_jobs")
+    staged_name = models.CharField(max_length=255)
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default="pending")
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["id"], name="imagejob_pending_idx", condition=models.Q(status="pending")),
+        ]
+
+    def __str__(self):
+        return f"{self.original_name} for product {self.product_id} ({self.status})"
+
+class SimilarProduct(models.Model):
+    """One precomputed neighbour of a product; see market.recommend."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="similar_links")
+    neighbour = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="similar_to")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="similar_product_rank_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} ~ {self.neighbour_id} ({self.score:.3f})"
+
 class CartItem(models.Model):
     user = models.ForeignKey("market.UserAccount", on_delete=models.CASCADE, related_name="cart_items")
     product = models.ForeignKey("market.Product", on_delete=models.CASCADE)
@@ -107,6 +217,9 @@ class CartItem(models.Model):
     class Meta:
         unique_together = ("user", "product")
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="cartitem_user_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.product.title} x {self.qty} ({self.user.username})"
@@ -123,15 +236,24 @@ class Order(models.Model):
     user = models.ForeignKey("market.UserAccount", on_delete=models.CASCADE, related_name="orders")
     ordered = models.BooleanField(default=False)  # False -> active (shouldn't happen), True -> completed
     created_at = models.DateTimeField(default=timezone.now)
+    # sum of qty * price_snapshot, written once at checkout
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "created_at"],
+                name="order_user_history_idx",
+                condition=models.Q(ordered=True),
+            ),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} for {self.user.username}"
 
     @property
     def total_amount(self):
-        items = self.items.all()
-        total = sum((it.price_snapshot or 0) * it.qty for it in items)
-        return total
+        return self.total
 
 
 class OrderItem(models.Model):
@@ -0,0 +1,70 @@
+"""
+Checkout pipeline.
+
+Stock is deducted with one conditional UPDATE per product
+(quantity = quantity - qty WHERE quantity >= qty). The database decides
+whether enough stock is left, so there is no read-then-write window to
+oversell through, and a zero row count means someone else got there first.
+Prices and titles are read again after those UPDATEs, while this transaction
+holds the rows, so a price changed after the cart was read is the one charged.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cart import invalidate_cart_summary
+from .models import CartItem, Order, OrderItem, Product
+from .pagecache import invalidate_product_pages
+
+
+class OutOfStock(Exception):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f"Not enough stock for {product.title}")
+
+
+def place_order(user):
+    """
+    Turn the user's cart into a completed Order.
+
+    Returns the Order, or None if the cart is empty. Raises OutOfStock (and
+    rolls everything back) if any line can't be filled.
+    """
+    with transaction.atomic():
+        cart_items = list(CartItem.objects.filter(user=user).select_related("product"))
+        if not cart_items:
+            return None
+
+        now = timezone.now()
+        # lock rows in a stable order so two carts can't deadlock each other
+        for ci in sorted(cart_items, key=lambda ci: ci.product_id):
+            updated = Product.objects.filter(
+                pk=ci.product_id, is_available=True, quantity__gte=ci.qty
+            ).update(quantity=F("quantity") - ci.qty, updated_at=now)
+            if not updated:
+                raise OutOfStock(ci.product)
+
+        product_ids = [ci.product_id for ci in cart_items]
+        Product.objects.filter(pk__in=product_ids, quantity=0).update(
+            is_available=False, updated_at=now
+        )
+        products = Product.objects.only("title", "slug", "price").in_bulk(product_ids)
+
+        total = sum(products[ci.product_id].price * ci.qty for ci in cart_items)
+        order = Order.objects.create(user=user, ordered=True, total=total)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=ci.product_id,
+                title=products[ci.product_id].title,
+                qty=ci.qty,
+                price_snapshot=products[ci.product_id].price,
+            )
+            for ci in cart_items
+        ])
+        CartItem.objects.filter(user=user).delete()
+        invalidate_cart_summary(user.id)
+        # stock changed through update(), which sends no signals
+        slugs = [p.slug for p in products.values()]
+        transaction.on_commit(lambda: invalidate_product_pages(slugs))
+    return order
@@ -0,0 +1,259 @@
+"""
+Whole-page cache for anonymous browsing of the feed and product pages.
+
+Logged-in visitors always get a fresh render (owner buttons, cart badge).
+Anonymous responses are stored in the "pages" cache alias, which is a
+LocMemCache (LRU) by default or a file cache when configured.
+
+Invalidation:
+- feed pages embed a version number; any Product/ProductImage change bumps
+  it, which orphans every cached feed page at once (LRU evicts them later).
+- a product page is keyed by slug and deleted when that product changes.
+
+Conditional GET: anonymous responses carry an ETag and Last-Modified from the
+view's validators function (feed_validators, detail_validators), stored with
+the cached page. A request whose If-None-Match/If-Modified-Since still
+matches gets a 304 before anything is rendered: straight from the cached
+entry on a hit, or after the validators on a miss (a cache read for the
+feed, two queries for a product page). Anonymous pages are marked public
+for MARKET_PROXY_CACHE_SECONDS (s-maxage) so a reverse proxy can serve them,
+while browsers revalidate every time; every other response from these views
+is private.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from .models import Product, SimilarProduct
+from .routers import use_primary
+
+PAGE_CACHE_ALIAS = "pages"
+FEED_PARAMS = ("q", "category", "condition", "brand", "color", "year", "price", "page", "cursor")
+FEED_VERSION_KEY = "feed:version"
+
+_stats = {"hit": 0, "miss": 0, "bypass": 0, "not_modified": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def page_cache_stats():
+    """Hit/miss/bypass counters for this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+
+def feed_version():
+    version = _cache().get(FEED_VERSION_KEY)
+    if version is None:
+        # a fresh value can't collide with pages cached under an evicted one
+        version = time.time_ns()
+        _cache().add(FEED_VERSION_KEY, version, None)
+    return version
+
+
+def _feed_params(request):
+    return urlencode(sorted(
+        (k, request.GET.get(k, "").strip()) for k in FEED_PARAMS if request.GET.get(k)
+    ))
+
+
+def feed_key(request):
+    digest = hashlib.md5(_feed_params(request).encode()).hexdigest()
+    return f"feed:{feed_version()}:{digest}"
+
+
+def detail_key(request, slug):
+    return f"detail:{slug}"
+
+
+def _etag(*parts):
+    return '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def feed_validators(request):
+    """
+    (ETag, Last-Modified) of a feed page: its query and the feed version,
+    which every Product/ProductImage change and checkout bumps (the facet
+    counts cover every category, so any change is a new version). No queries;
+    if the version is evicted, clients simply download the page once more.
+    """
+    version = feed_version()
+    return _etag(_feed_params(request), version), datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+
+def detail_validators(request, slug):
+    """
+    (ETag, Last-Modified) of a product page: the product row, its image set
+    and its similar items (which and how current). None if there is no such
+    product (the view answers 404). Two plain queries compile far faster
+    than one with correlated subqueries.
+    """
+    row = next(iter(
+        Product.objects.filter(slug=slug).order_by()
+        .values_list("id", "updated_at", "images_pending", "owner__username")
+        .annotate(image_count=Count("images"), last_image=Max("images__id"), last_image_at=Max("images__created_at"))
+    ), None)
+    if row is None:
+        return None
+    similar = list(
+        SimilarProduct.objects.filter(product_id=row[0]).order_by("rank")
+        .values_list("neighbour_id", "neighbour__updated_at")
+    )
+    # updated_at, the newest photo, the newest similar item
+    last_modified = max(t for t in (row[1], row[-1], *(at for _, at in similar)) if t)
+    return _etag(slug, row, similar), last_modified
+
+
+def invalidate_product_pages(slugs=()):
+    cache = _cache()
+    cache.set(FEED_VERSION_KEY, time.time_ns(), None)
+    cache.delete_many([f"detail:{slug}" for slug in slugs])
+
+
+def proxy_cache_seconds():
+    return getattr(settings, "MARKET_PROXY_CACHE_SECONDS", 60)
+
+
+def _public(response, etag, last_modified):
+    if etag:
+        response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    patch_cache_control(response, public=True, max_age=0, s_maxage=proxy_cache_seconds())
+    # the same URL renders differently once logged in
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+def _private(response):
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _not_modified(request, etag, last_modified):
+    """The 304 (or 412) for a conditional request the validators satisfy, else None."""
+    if not etag and not last_modified:
+        return None
+    headers = _public(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(
+        request, etag=etag, response=headers,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    return None if response is headers else response
+
+
+def _from_cache(request, cached):
+    content, content_type, *validators = cached
+    # entries stored before validators were kept have none
+    etag, last_modified = validators or (None, None)
+    response = _not_modified(request, etag, last_modified)
+    if response is None:
+        response = _public(HttpResponse(content, content_type=content_type), etag, last_modified)
+    response["X-Page-Cache"] = "hit"
+    return response
+
+
+def _store(response, etag, last_modified):
+    if response.status_code == 200 and not response.streaming:
+        _public(response, etag, last_modified)
+        return response.content, response["Content-Type"], etag, last_modified
+    return None
+
+
+def _cacheable(request):
+    if request.method != "GET" or request.session.get("user_id"):
+        return False
+    # a flash message would otherwise be frozen into the page for everyone
+    return len(get_messages(request)) == 0
+
+
+def cache_anonymous_page(key_func, validators_func=None):
+    """
+    Serve and store full responses for anonymous GETs under key_func(request, ...),
+    answering conditional GETs from validators_func(request, ...) when given.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            return _async_cached(view_func, key_func, validators_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable(request):
+                _count("bypass")
+                return _private(view_func(request, *args, **kwargs))
+
+            key = key_func(request, *args, **kwargs)
+            cached = _cache().get(key)
+            if cached is not None:
+                _count("hit")
+                return _from_cache(request, cached)
+
+            # whatever is stored now outlives the replicas' lag
+            use_primary()
+            validators = validators_func and validators_func(request, *args, **kwargs)
+            etag, last_modified = validators or (None, None)
+            response = _not_modified(request, etag, last_modified)
+            if response is not None:
+                _count("not_modified")
+                return response
+
+            _count("miss")
+            response = view_func(request, *args, **kwargs)
+            entry = _store(response, etag, last_modified)
+            if entry is not None:
+                _cache().set(key, entry)
+            response["X-Page-Cache"] = "miss"
+            return response
+        return wrapper
+    return decorator
+
+
+def _async_cached(view_func, key_func, validators_func):
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        # the session and message storage may have to hit the database
+        if not await sync_to_async(_cacheable)(request):
+            _count("bypass")
+            return _private(await view_func(request, *args, **kwargs))
+
+        key = key_func(request, *args, **kwargs)
+        cached = await _cache().aget(key)
+        if cached is not None:
+            _count("hit")
+            return _from_cache(request, cached)
+
+        use_primary()
+        validators = validators_func and await sync_to_async(validators_func)(request, *args, **kwargs)
+        etag, last_modified = validators or (None, None)
+        response = _not_modified(request, etag, last_modified)
+        if response is not None:
+            _count("not_modified")
+            return response
+
+        _count("miss")
+        response = await view_func(request, *args, **kwargs)
+        entry = _store(response, etag, last_modified)
+        if entry is not None:
+            await _cache().aset(key, entry)
+        response["X-Page-Cache"] = "miss"
+        return response
+    return wrapper
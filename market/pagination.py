@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination for the product feed and order history.
+
+Paginator does a COUNT(*) and an OFFSET scan, both of which get slower the
+deeper you go. A cursor page instead remembers the (created_at, id) of the
+last row it showed and asks for rows strictly after it, which the
+partial (..., created_at) indexes on Product and Order answer directly.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+CURSOR_ORDERING = ("-created_at", "-id")
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (created_at, id), or None if the token is missing or mangled."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        created, pk = raw.split("|", 1)
+        return datetime.fromisoformat(created), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class CursorPage:
+    def __init__(self, object_list, per_page, cursor):
+        self.object_list = object_list[:per_page]
+        self.has_previous = cursor is not None
+        self.has_next = len(object_list) > per_page
+        self.next_cursor = encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_queryset(queryset, cursor):
+    """Order `queryset` for the feed and drop everything up to `cursor`."""
+    qs = queryset.order_by(*CURSOR_ORDERING)
+    if cursor:
+        created_at, pk = cursor
+        # the leading created_at__lte keeps this a single index range scan;
+        # a bare OR would make SQLite merge two scans and sort again
+        qs = qs.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk)
+        )
+    return qs
+
+
+def cursor_paginate(queryset, token, per_page):
+    """One query, no COUNT: fetch per_page + 1 rows to know if there is more."""
+    cursor = decode_cursor(token)
+    qs = keyset_queryset(queryset, cursor)
+    return CursorPage(list(qs[:per_page + 1]), per_page, cursor)
+
+
+async def acursor_paginate(queryset, token, per_page):
+    """cursor_paginate() for async views."""
+    cursor = decode_cursor(token)
+    qs = keyset_queryset(queryset, cursor)
+    return CursorPage([obj async for obj in qs[:per_page + 1]], per_page, cursor)
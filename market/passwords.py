@@ -0,0 +1,59 @@
+"""
+Password hashing for UserAccount.
+
+Hashes are Django's salted "algorithm$params$salt$hash" strings, made with
+the first entry of PASSWORD_HASHERS (PBKDF2 by default, its cost set by
+MARKET_PASSWORD_ITERATIONS). Accounts created before this still hold a bare
+unsalted SHA-256 hex digest; those, and hashes made with an older cost or
+algorithm, are re-hashed the next time the password is verified.
+"""
+import hashlib
+import hmac
+import re
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+_legacy_re = re.compile(r"[0-9a-f]{64}")
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 with the iteration count taken from settings."""
+
+    @property
+    def iterations(self):
+        return getattr(settings, "MARKET_PASSWORD_ITERATIONS", hashers.PBKDF2PasswordHasher.iterations)
+
+
+def hash_password(password):
+    return hashers.make_password(password)
+
+
+def _is_legacy(encoded):
+    return bool(_legacy_re.fullmatch(encoded or ""))
+
+
+def verify_password(user, password):
+    """
+    Check `password` against the user's stored hash, upgrading the stored
+    hash in place when it is legacy or weaker than the current settings.
+    """
+    def upgrade(raw):
+        user.password = hash_password(raw)
+        user.save(update_fields=["password"])
+
+    if _is_legacy(user.password):
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(digest, user.password):
+            return False
+        upgrade(password)
+        return True
+    return hashers.check_password(password, user.password, setter=upgrade)
+
+
+def burn_password_check(password):
+    """
+    Do the same KDF work as a real check for an unknown email, so response
+    time doesn't reveal which addresses have accounts.
+    """
+    hashers.make_password(password)
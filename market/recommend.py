@@ -0,0 +1,328 @@
+"""
+"Similar items" for the product page.
+
+Every product is turned into a TF-IDF vector over its title, brand and
+description; its neighbours are the K products with the highest cosine
+similarity. Those are precomputed into SimilarProduct so the page reads them
+with a single join.
+
+Vectorizing uses NumPy/SciPy sparse matrices when they are installed and a
+pure-Python inverted index otherwise (same scores, much slower on big
+catalogs).
+
+Keeping the table fresh:
+- rebuild() recomputes everything (`manage.py build_similar_products --full`).
+- refresh() only recomputes products whose text changed (similar_stale) and
+  splices them into the lists of products they now resemble. Lists they
+  drop out of are left one short until the next full rebuild.
+
+Each refresh() re-vectorizes the whole catalog (seconds of CPU at 100k
+products), so it must not run once per save. MARKET_SIMILAR_REFRESH decides
+when it runs after a product is saved: "off" (default; run
+`manage.py build_similar_products` on a schedule), "thread" (one background
+refresh per MARKET_SIMILAR_REFRESH_DELAY seconds, batching every product
+saved meanwhile) or "sync" (inline after commit, for tests and tiny catalogs).
+"""
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .instrumentation import instrumented
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - exercised where SciPy isn't installed
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 8
+MIN_SCORE = 0.05
+# a refreshed product may also enter the lists of this many of its own top matches
+SPLICE_CANDIDATES = 4 * TOP_K
+CHUNK_ROWS = 1000
+# terms in more than this share of products (and more than MAX_DF_FLOOR of
+# them) are dropped: they add little to the ranking, but every pair that
+# shares one gets a score, so they decide how dense the similarity products get
+MAX_DF_RATIO = 0.01
+MAX_DF_FLOOR = 50
+# no category: a term every product in a category shares would give each
+# same-category pair a score, and make the similarity products nearly dense
+SIMILAR_FIELDS = ("title", "brand", "description")
+# repeat the stronger signals so sublinear tf still favours them
+FIELD_WEIGHTS = {"title": 3, "brand": 2, "description": 1}
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or "
+    "the this that to was with very used good new".split()
+)
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+_executor = None
+# a refresh is waiting out its delay; later saves ride along with it
+_queued = False
+_queued_lock = threading.Lock()
+
+
+def tokens(doc):
+    """Weighted token list for one document dict (keys from SIMILAR_FIELDS)."""
+    out = []
+    for field in SIMILAR_FIELDS:
+        value = doc.get(field) or ""
+        words = [w for w in _token_re.findall(value.lower()) if len(w) > 1 and w not in STOPWORDS]
+        out.extend(words * FIELD_WEIGHTS[field])
+    return out
+
+
+class Corpus:
+    """TF-IDF rows for a list of documents, in the same order as `ids`."""
+
+    def __init__(self, ids, token_lists):
+        self.ids = ids
+        self.position = {pk: i for i, pk in enumerate(ids)}
+        counts = [Counter(t) for t in token_lists]
+        df = Counter(term for c in counts for term in c)
+        n = len(ids)
+        max_df = max(MAX_DF_FLOOR, MAX_DF_RATIO * n)
+        common = {term for term, d in df.items() if d > max_df}
+        if common:
+            counts = [Counter({t: tf for t, tf in c.items() if t not in common}) for c in counts]
+            df = Counter({t: d for t, d in df.items() if t not in common})
+        self.idf = {term: math.log((1 + n) / (1 + d)) + 1 for term, d in df.items()}
+        if sparse is not None:
+            self._build_sparse(counts)
+        else:
+            self._build_python(counts)
+
+    def _build_sparse(self, counts):
+        vocab = {term: i for i, term in enumerate(self.idf)}
+        idf = np.array(list(self.idf.values()), dtype=np.float64)
+        indptr, indices, data = [0], [], []
+        for c in counts:
+            for term, tf in c.items():
+                indices.append(vocab[term])
+                data.append(1 + math.log(tf))
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(counts), len(vocab)),
+        )
+        matrix = matrix.multiply(idf).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        self.matrix = sparse.diags(1.0 / norms) @ matrix
+        self.matrix_t = self.matrix.T.tocsr()
+
+    def _build_python(self, counts):
+        self.vectors = []
+        self.postings = defaultdict(list)
+        for i, c in enumerate(counts):
+            vec = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in c.items()}
+            norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+            vec = {term: w / norm for term, w in vec.items()}
+            self.vectors.append(vec)
+            for term, w in vec.items():
+                self.postings[term].append((i, w))
+
+    def neighbours(self, rows, k=TOP_K):
+        """{row: [(row, score), ...]} with the k best matches for each row, best first."""
+        if sparse is not None:
+            return self._neighbours_sparse(rows, k)
+        return {r: self._neighbours_python(r, k) for r in rows}
+
+    def _neighbours_sparse(self, rows, k):
+        result = {}
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = rows[start:start + CHUNK_ROWS]
+            scores = (self.matrix[chunk] @ self.matrix_t).tocsr()
+            for i, row in enumerate(chunk):
+                lo, hi = scores.indptr[i], scores.indptr[i + 1]
+                cols, vals = scores.indices[lo:hi], scores.data[lo:hi]
+                keep = (cols != row) & (vals >= MIN_SCORE)
+                cols, vals = cols[keep], vals[keep]
+                if len(vals) > k:
+                    top = np.argpartition(-vals, k)[:k]
+                    cols, vals = cols[top], vals[top]
+                order = np.lexsort((cols, -vals))
+                result[row] = [(int(cols[j]), float(vals[j])) for j in order]
+        return result
+
+    def _neighbours_python(self, row, k):
+        scores = defaultdict(float)
+        for term, w in self.vectors[row].items():
+            for other, w2 in self.postings[term]:
+                scores[other] += w * w2
+        scores.pop(row, None)
+        best = heapq.nsmallest(k, ((-s, other) for other, s in scores.items() if s >= MIN_SCORE))
+        return [(other, -s) for s, other in best]
+
+
+def load_corpus():
+    from .models import Product
+
+    ids, token_lists = [], []
+    rows = Product.objects.order_by("id").values("id", *SIMILAR_FIELDS)
+    for row in rows.iterator(chunk_size=2000):
+        ids.append(row["id"])
+        token_lists.append(tokens(row))
+    return Corpus(ids, token_lists)
+
+
+def _links(corpus, row, matches):
+    from .models import SimilarProduct
+
+    product_id = corpus.ids[row]
+    return [
+        SimilarProduct(product_id=product_id, neighbour_id=corpus.ids[other], rank=rank, score=score)
+        for rank, (other, score) in enumerate(matches)
+    ]
+
+
+def rebuild(batch_size=1000):
+    """Recompute every product's neighbours. Returns the number of products."""
+    from .models import Product, SimilarProduct
+
+    corpus = load_corpus()
+    rows = list(range(len(corpus.ids)))
+    with transaction.atomic():
+        SimilarProduct.objects.all().delete()
+        for start in range(0, len(rows), batch_size):
+            batch = corpus.neighbours(rows[start:start + batch_size])
+            SimilarProduct.objects.bulk_create(
+                [link for row, matches in batch.items() for link in _links(corpus, row, matches)],
+                batch_size=batch_size,
+            )
+        Product.objects.filter(similar_stale=True).update(similar_stale=False)
+
+    from .pagecache import invalidate_product_pages
+    slugs = Product.objects.order_by().values_list("slug", flat=True)
+    for start in range(0, len(corpus.ids), batch_size):
+        invalidate_product_pages(list(slugs[start:start + batch_size]))
+    return len(rows)
+
+
+@instrumented
+def refresh(limit=None):
+    """
+    Recompute neighbours for products marked similar_stale and splice them
+    into other products' lists where they now rank. Returns the count.
+    """
+    from .models import Product, SimilarProduct
+    from .pagecache import invalidate_product_pages
+
+    stale = Product.objects.filter(similar_stale=True).order_by("id").values_list("id", flat=True)
+    stale = list(stale[:limit] if limit else stale)
+    if not stale:
+        return 0
+
+    corpus = load_corpus()
+    rows = [corpus.position[pk] for pk in stale if pk in corpus.position]
+    found = corpus.neighbours(rows, k=max(TOP_K, SPLICE_CANDIDATES))
+
+    touched = set(stale)
+    with transaction.atomic():
+        # a changed product may no longer belong in lists it is on
+        on_lists = SimilarProduct.objects.filter(neighbour_id__in=stale)
+        changed = set(on_lists.values_list("product_id", flat=True))
+        on_lists.delete()
+        SimilarProduct.objects.filter(product_id__in=stale).delete()
+
+        links = []
+        for row, matches in found.items():
+            links.extend(_links(corpus, row, matches[:TOP_K]))
+        SimilarProduct.objects.bulk_create(links)
+
+        # cosine is symmetric: sim(p, s) is already known for s's candidates
+        offers = defaultdict(list)
+        for row, matches in found.items():
+            for other, score in matches:
+                if corpus.ids[other] not in touched:
+                    offers[corpus.ids[other]].append((corpus.ids[row], score))
+        current = defaultdict(list)
+        for link in SimilarProduct.objects.filter(product_id__in=offers).order_by("product_id", "rank"):
+            current[link.product_id].append((link.neighbour_id, link.score))
+
+        for product_id, offered in offers.items():
+            merged = sorted(current[product_id] + offered, key=lambda m: (-m[1], m[0]))[:TOP_K]
+            if merged != current[product_id]:
+                changed.add(product_id)
+                SimilarProduct.objects.filter(product_id=product_id).delete()
+                SimilarProduct.objects.bulk_create([
+                    SimilarProduct(product_id=product_id, neighbour_id=n, rank=rank, score=score)
+                    for rank, (n, score) in enumerate(merged)
+                ])
+        Product.objects.filter(pk__in=stale).update(similar_stale=False)
+
+    slugs = Product.objects.filter(pk__in=touched | changed).values_list("slug", flat=True)
+    invalidate_product_pages(list(slugs))
+    return len(stale)
+
+
+def _similar_queryset(product, k):
+    from .models import Product
+
+    return (
+        Product.objects
+        .filter(similar_to__product=product, is_available=True)
+        .only("id", "slug", "title", "price", "primary_image", "primary_image_variants")
+        .order_by("similar_to__rank")[:k]
+    )
+
+
+def similar_products(product, k=TOP_K):
+    """The product's precomputed neighbours that are still for sale, in one query."""
+    return list(_similar_queryset(product, k))
+
+
+async def asimilar_products(product, k=TOP_K):
+    """similar_products() for async views."""
+    return [p async for p in _similar_queryset(product, k)]
+
+
+def _run():
+    global _queued
+    time.sleep(getattr(settings, "MARKET_SIMILAR_REFRESH_DELAY", 30))
+    with _queued_lock:
+        _queued = False
+    try:
+        refresh()
+    except Exception:
+        logger.exception("similar products refresh failed")
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # one worker: refreshes of the same table would only contend
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market-similar")
+    return _executor
+
+
+def _queue():
+    global _queued
+    with _queued_lock:
+        if _queued:
+            return
+        _queued = True
+    _get_executor().submit(_run)
+
+
+def schedule_refresh():
+    mode = getattr(settings, "MARKET_SIMILAR_REFRESH", "off")
+    if mode == "off":
+        return
+    if mode == "sync":
+        transaction.on_commit(refresh)
+    else:
+        transaction.on_commit(_queue)
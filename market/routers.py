@@ -0,0 +1,122 @@
+"""
+Read-replica routing.
+
+ReplicaRouter sends ORM reads to one of settings.MARKET_DB_REPLICAS (picked
+at random per query), but only inside a request that
+ReplicaPinMiddleware has cleared for it: a GET/HEAD from a client that
+hasn't written recently. Everything else reads from the primary:
+
+- unsafe methods (POST, ...) and anything after the request's first write,
+- for MARKET_REPLICA_PIN_SECONDS after a request wrote, so the client sees
+  its own changes while the replicas catch up (a cookie carries the pin),
+- sessions, which are written on login and read on the very next request,
+- anonymous page-cache misses (see use_primary): the page and its ETag are
+  served to everyone until the next invalidation, which a page built from a
+  lagging replica would already have missed,
+- work outside requests: commands, image workers, background refreshes.
+
+Writes always go to the primary. With no replicas configured the router
+changes nothing.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PIN_COOKIE = "market_primary"
+PRIMARY = "default"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# per request: {"replica": may read from a replica, "wrote": a write was routed}
+_state = ContextVar("market_replica_state", default=None)
+
+
+def replicas():
+    return getattr(settings, "MARKET_DB_REPLICAS", [])
+
+
+def pin_seconds():
+    return getattr(settings, "MARKET_REPLICA_PIN_SECONDS", 5)
+
+
+def use_primary():
+    """Send the rest of the current request's reads to the primary."""
+    state = _state.get()
+    if state is not None:
+        state["replica"] = False
+
+
+class ReplicaRouter:
+    primary_only_apps = {"sessions"}
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if not state or not state["replica"] or model._meta.app_label in self.primary_only_apps:
+            return PRIMARY
+        aliases = replicas()
+        return random.choice(aliases) if aliases else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in self.primary_only_apps:
+            state["replica"] = False
+            state["wrote"] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaPinMiddleware:
+    """Decides per request whether reads may use a replica, and pins writers to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+
+        state, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(request, state, response)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+
+        # the ORM's worker threads get a copy of this context, so the router
+        # there sees (and updates) the same state dict
+        state, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(request, state, response)
+
+    def _start(self, request):
+        state = {
+            "replica": request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES,
+            "wrote": False,
+        }
+        return state, _state.set(state)
+
+    def _finish(self, request, state, response):
+        if state["wrote"] or request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, "1", max_age=pin_seconds(), httponly=True, samesite="Lax")
+        return response
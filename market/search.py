@@ -0,0 +1,167 @@
+"""
+Product search.
+
+The feed used to run `title__icontains | description__icontains`, which is a
+full table LIKE scan on every keystroke. Search now goes through a backend:
+
+- SQLiteFTSBackend (default on SQLite): keeps an FTS5 table in sync with
+  Product and ranks matches with bm25().
+- LikeBackend: plain icontains fallback for databases without FTS5.
+
+Pick one explicitly with settings.MARKET_SEARCH_BACKEND (dotted path).
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+SEARCH_FIELDS = ("title", "description", "brand", "model", "material")
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+
+
+class BaseSearchBackend:
+    """Interface every search backend implements."""
+
+    def setup(self):
+        """Create any storage the backend needs (idempotent)."""
+
+    def index(self, product):
+        """Add or refresh one product."""
+
+    def index_many(self, products):
+        """Add or refresh a batch of products (bulk_create skips the signals)."""
+        for product in products:
+            self.index(product)
+
+    def remove(self, product_id):
+        """Drop one product from the index."""
+
+    def rebuild(self, batch_size=1000):
+        """Re-index every product. Returns the number of rows indexed."""
+        return 0
+
+    def search(self, queryset, q):
+        """Filter `queryset` down to products matching `q`, best match first."""
+        raise NotImplementedError
+
+
+class LikeBackend(BaseSearchBackend):
+    def search(self, queryset, q):
+        cond = Q()
+        for field in SEARCH_FIELDS:
+            cond |= Q(**{f"{field}__icontains": q})
+        return queryset.filter(cond)
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    table = "market_product_fts"
+    # bm25 column weights, same order as SEARCH_FIELDS
+    weights = (10.0, 1.0, 5.0, 5.0, 2.0)
+
+    def setup(self):
+        cols = ", ".join(SEARCH_FIELDS)
+        with connection.cursor() as cur:
+            cur.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                f"{cols}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+
+    def _row(self, product):
+        return [product.pk] + [getattr(product, f) or "" for f in SEARCH_FIELDS]
+
+    def index(self, product):
+        self.index_many([product])
+
+    def index_many(self, products):
+        cols = ", ".join(SEARCH_FIELDS)
+        marks = ", ".join(["%s"] * (len(SEARCH_FIELDS) + 1))
+        with connection.cursor() as cur:
+            cur.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (rowid, {cols}) VALUES ({marks})",
+                [self._row(p) for p in products],
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [product_id])
+
+    def rebuild(self, batch_size=1000):
+        from .models import Product
+
+        self.setup()
+        cols = ", ".join(SEARCH_FIELDS)
+        marks = ", ".join(["%s"] * (len(SEARCH_FIELDS) + 1))
+        sql = f"INSERT INTO {self.table} (rowid, {cols}) VALUES ({marks})"
+
+        total = 0
+        batch = []
+        rows = Product.objects.order_by().values_list("pk", *SEARCH_FIELDS)
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table}")
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append([v or "" for v in row])
+                if len(batch) >= batch_size:
+                    cur.executemany(sql, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                cur.executemany(sql, batch)
+                total += len(batch)
+            # merge the b-tree segments written above into one
+            cur.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return total
+
+    def match_expression(self, q):
+        """
+        Turn free text into a safe FTS5 query: every word must appear, and the
+        last word is a prefix so results show up while the user is still typing.
+        """
+        tokens = _token_re.findall(q.lower())
+        if not tokens:
+            return ""
+        terms = [f'"{t}"' for t in tokens]
+        terms[-1] += "*"
+        return " ".join(terms)
+
+    def search(self, queryset, q):
+        expr = self.match_expression(q)
+        if not expr:
+            return queryset.none()
+        table = self.table
+        weights = ", ".join(str(w) for w in self.weights)
+        db_table = queryset.model._meta.db_table
+        return (
+            queryset
+            .filter(pk__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [expr]))
+            .annotate(search_rank=RawSQL(
+                f"SELECT bm25({table}, {weights}) FROM {table} "
+                f"WHERE {table} MATCH %s AND rowid = {db_table}.id",
+                [expr],
+            ))
+            # bm25() is lower-is-better
+            .order_by("search_rank", "-created_at")
+        )
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "MARKET_SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "sqlite":
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = LikeBackend()
+    return _backend
+
+
+def search_products(queryset, q):
+    return get_backend().search(queryset, q)
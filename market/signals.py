@@ -0,0 +1,92 @@
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductImage, UserAccount
+from .images import schedule_variants
+from .pagecache import invalidate_product_pages
+from .recommend import schedule_refresh
+from .search import get_backend
+from .utils import account_cache_key, shared_cache
+
+
+@receiver(post_migrate)
+def setup_search_index(sender, **kwargs):
+    if sender.name == "market":
+        get_backend().setup()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_backend().remove(instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def mark_similar_stale(sender, instance, raw=False, update_fields=None, **kwargs):
+    # partial saves (update_fields) come from code that doesn't touch the text
+    if raw or update_fields is not None:
+        return
+    instance.similar_stale = True
+
+
+@receiver(post_save, sender=Product)
+def refresh_similar(sender, instance, raw=False, **kwargs):
+    if not raw and instance.similar_stale:
+        schedule_refresh()
+
+
+@receiver(post_save, sender=ProductImage)
+def set_primary_image(sender, instance, created, raw=False, **kwargs):
+    if raw or not created or not instance.image:
+        return
+    # only the first image becomes primary; later uploads are a no-op update.
+    # The feed card shows it, so it counts as a listing change (feed ETags)
+    updated = Product.objects.filter(pk=instance.product_id, primary_image="").update(
+        primary_image=instance.image.name, primary_image_variants=instance.variants, updated_at=timezone.now()
+    )
+    if updated and ProductImage.product.is_cached(instance):
+        instance.product.primary_image = instance.image.name
+        instance.product.primary_image_variants = instance.variants
+    if not getattr(instance, "_defer_variants", False):
+        schedule_variants(instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def reset_primary_image(sender, instance, **kwargs):
+    if not instance.image:
+        return
+    name, variants = (
+        ProductImage.objects.filter(product_id=instance.product_id)
+        .order_by("created_at", "id")
+        .values_list("image", "variants")
+        .first()
+    ) or ("", {})
+    Product.objects.filter(pk=instance.product_id, primary_image=instance.image.name).update(
+        primary_image=name, primary_image_variants=variants, updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=UserAccount)
+@receiver(post_delete, sender=UserAccount)
+def forget_cached_account(sender, instance, **kwargs):
+    shared_cache.delete(account_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def expire_product_pages(sender, instance, **kwargs):
+    invalidate_product_pages([instance.slug])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def expire_product_image_pages(sender, instance, **kwargs):
+    slug = Product.objects.filter(pk=instance.product_id).values_list("slug", flat=True).first()
+    invalidate_product_pages([slug] if slug else [])
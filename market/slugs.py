@@ -0,0 +1,77 @@
+"""
+Slug allocation for Product.
+
+A free slug costs one indexed query however many "iphone-12-N" listings
+already exist: we read the largest numeric suffix in the slug range
+[base-, base.) and go one higher. Concurrent inserts can still race to the
+same value, which Product.save resolves by retrying on IntegrityError.
+"""
+import re
+import uuid
+
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+MAX_BASE_LENGTH = 220
+
+
+def slug_base(title):
+    return slugify(title)[:MAX_BASE_LENGTH].strip("-") or "item"
+
+
+def taken_slugs(model, base):
+    """`base` and every `base-N` in use, highest suffix first."""
+    # '-' sorts right before '.', so this range is exactly "starts with base-"
+    # and can be answered from the unique slug index
+    return (
+        model._default_manager
+        .filter(Q(slug=base) | Q(slug__gte=f"{base}-", slug__lt=f"{base}.",
+                                 slug__regex=rf"^{re.escape(base)}-[0-9]+$"))
+        .annotate(slug_len=Length("slug"))
+        .order_by("-slug_len", "-slug")
+        .values_list("slug", flat=True)
+    )
+
+
+def _max_suffix(model, base):
+    """
+    None if `base` is free, 0 if only `base` itself is taken, otherwise the
+    highest N in use as `base-N`.
+    """
+    taken = taken_slugs(model, base).first()
+    if taken is None:
+        return None
+    if taken == base:
+        return 0
+    return int(taken.rsplit("-", 1)[1])
+
+
+def _with_suffix(base, n):
+    return base if n is None else f"{base}-{n + 1}"
+
+
+def allocate_slug(model, title):
+    base = slug_base(title)
+    return _with_suffix(base, _max_suffix(model, base))
+
+
+def allocate_slugs(model, titles):
+    """
+    Slugs for a batch of new rows, unique among themselves and against the
+    table. One query per distinct title rather than per row.
+    """
+    next_n = {}
+    slugs = []
+    for title in titles:
+        base = slug_base(title)
+        if base not in next_n:
+            next_n[base] = _max_suffix(model, base)
+        n = next_n[base]
+        slugs.append(_with_suffix(base, n))
+        next_n[base] = 0 if n is None else n + 1
+    return slugs
+
+
+def random_slug(title):
+    return f"{slug_base(title)}-{uuid.uuid4().hex[:6]}"
@@ -1,3 +1,1746 @@
-from django.test import TestCase
+import csv
+import hashlib
+import importlib
+import itertools
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync
+from django.urls import clear_url_caches, reverse
+from django.utils import timezone
+from PIL import Image
+
+from ecofinds.database import database_settings, replica_settings, sqlite_options
+
+from . import recommend, routers
+from . import urls as market_urls
+from .instrumentation import instrumented, registry
+from .models import (
+    CartItem, ImageUploadJob, Order, OrderItem, Product, ProductImage, SimilarProduct, UserAccount,
+)
+from .orders import OutOfStock, place_order
+from .pagecache import FEED_VERSION_KEY, feed_version, page_cache_stats
+from .pagination import keyset_queryset
+from .passwords import hash_password, verify_password
+from .recommend import rebuild, refresh
+from .routers import PIN_COOKIE, ReplicaRouter
+from .slugs import allocate_slugs, taken_slugs
+from .search import SQLiteFTSBackend, get_backend, search_products
+from .uploads import _claim
+from .utils import account_cache_key, get_account
+
+
+# the "sessions" and "shared" caches are file caches on this host by default;
+# tests get private in-memory ones so clearing them can't touch a dev server
+TEST_CACHES = {
+    **settings.CACHES,
+    "sessions": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "market-test-sessions"},
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "market-test-shared"},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MarketTestCase(TestCase):
+    """Cached accounts, carts and pages must not leak between tests."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        caches["pages"].clear()
+        caches["sessions"].clear()
+        caches["shared"].clear()
+
+
+def make_user(username="seller", **kwargs):
+    kwargs.setdefault("email", f"{username}@example.com")
+    kwargs.setdefault("password", "x")
+    return UserAccount.objects.create(username=username, **kwargs)
+
+
+def make_product(owner, title="Item", **kwargs):
+    kwargs.setdefault("price", 10)
+    return Product.objects.create(owner=owner, title=title, **kwargs)
+
+
+class SearchTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user()
+        cls.phone = make_product(cls.owner, "iPhone 12", brand="Apple", description="Good battery")
+        cls.case = make_product(cls.owner, "Phone case", description="Fits iphone 12 and 13")
+        cls.chair = make_product(cls.owner, "Oak chair", material="Oak", category="furniture")
+
+    def search(self, q):
+        return list(search_products(Product.objects.all(), q))
+
+    def test_matches_indexed_fields(self):
+        self.assertEqual(self.search("apple"), [self.phone])
+        self.assertEqual(self.search("oak"), [self.chair])
+        self.assertEqual(self.search("nothing here"), [])
+
+    def test_prefix_and_ranking(self):
+        # title hit ranks above a description-only hit
+        self.assertEqual(self.search("iphone 1"), [self.phone, self.case])
+
+    def test_special_characters_do_not_break_query(self):
+        self.assertEqual(self.search('"iphone" -'), [self.phone, self.case])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.chair.title = "Walnut stool"
+        self.chair.material = "Walnut"
+        self.chair.save()
+        self.assertEqual(self.search("oak"), [])
+        self.assertEqual(self.search("walnut"), [self.chair])
+
+        self.phone.delete()
+        self.assertEqual(self.search("apple"), [])
+
+    def test_rebuild_command(self):
+        if not isinstance(get_backend(), SQLiteFTSBackend):
+            self.skipTest("FTS backend not in use")
+        get_backend().remove(self.phone.pk)
+        self.assertEqual(self.search("apple"), [])
+        call_command("rebuild_search_index", batch_size=2, stdout=StringIO())
+        self.assertEqual(self.search("apple"), [self.phone])
+
+    def test_product_list_view(self):
+        resp = self.client.get(reverse("market:product_list"), {"q": "oak"})
+        self.assertEqual(list(resp.context["page_obj"]), [self.chair])
+
+
+class PrimaryImageTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user()
+
+    def add_products(self, count, images=2):
+        for i in range(count):
+            p = make_product(self.owner, f"Lamp {i}")
+            for j in range(images):
+                ProductImage.objects.create(product=p, image=f"products/lamp-{i}-{j}.jpg")
+
+    def test_first_image_becomes_primary(self):
+        p = make_product(self.owner, "Desk")
+        self.assertEqual(p.primary_image_url, "/static/img/placeholder.png")
+        first = ProductImage.objects.create(product=p, image="products/a.jpg")
+        ProductImage.objects.create(product=p, image="products/b.jpg")
+        p.refresh_from_db()
+        self.assertEqual(p.primary_image, "products/a.jpg")
+
+        first.delete()
+        p.refresh_from_db()
+        self.assertEqual(p.primary_image, "products/b.jpg")
+
+        p.images.all().delete()
+        p.refresh_from_db()
+        self.assertEqual(p.primary_image, "")
+
+    def test_sync_command(self):
+        self.add_products(2, images=1)
+        Product.objects.update(primary_image="")
+        call_command("sync_primary_images", stdout=StringIO())
+        self.assertEqual(
+            sorted(Product.objects.values_list("primary_image", flat=True)),
+            ["products/lamp-0-0.jpg", "products/lamp-1-0.jpg"],
+        )
+
+    def test_feed_query_count_is_constant(self):
+        url = reverse("market:product_list")
+        self.add_products(2)
+        with self.assertNumQueries(3) as ctx:  # count, facet counts, page
+            resp = self.client.get(url)
+        self.assertContains(resp, "/media/products/lamp-0-0.jpg")
+
+        self.add_products(10)
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            self.client.get(url)
+
+    def test_detail_query_count_is_constant(self):
+        self.add_products(1, images=5)
+        p = Product.objects.get()
+        with self.assertNumQueries(5):  # validators (2), product + owner, images, similar items
+            self.client.get(reverse("market:product_detail", args=[p.slug]))
+
+
+class CursorPaginationTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user()
+        for i in range(30):
+            make_product(owner, f"Book {i}", category="books")
+        # identical timestamps must still page cleanly on id
+        Product.objects.filter(title__in=["Book 3", "Book 4", "Book 5"]).update(
+            created_at=Product.objects.get(title="Book 3").created_at
+        )
+
+    def test_walks_feed_without_gaps_or_repeats(self):
+        url = reverse("market:product_list")
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            with self.assertNumQueries(2):  # page, facet counts
+                resp = self.client.get(url, {"cursor": cursor, "category": "books"})
+            self.assertTrue(resp.context["cursor_mode"])
+            seen += [p.pk for p in resp.context["page_obj"]]
+            cursor = resp.context["next_cursor"]
+        expected = list(Product.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_starts_from_top(self):
+        resp = self.client.get(reverse("market:product_list"), {"cursor": "not-a-cursor"})
+        first = Product.objects.order_by("-created_at", "-id").first()
+        self.assertEqual(resp.context["page_obj"].object_list[0], first)
+
+    def test_deep_page_numbers_are_rejected(self):
+        resp = self.client.get(reverse("market:product_list"), {"page": "5000"})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(reverse("market:product_list"), {"page": "2"})
+        self.assertEqual(resp.status_code, 200)
+
+
+class QueryPlanTests(MarketTestCase):
+    """Hot queries from views.py must be answered from an index."""
+
+    full_scan = re.compile(r"\bSCAN (?!.*\bUSING (COVERING )?INDEX\b)")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [make_user(f"user{i}") for i in range(5)]
+        cats = ["books", "toys", "home"]
+        for i in range(60):
+            make_product(
+                cls.users[i % 5], f"Thing {i}", category=cats[i % 3],
+                quantity=i % 4, is_available=i % 7 != 0,
+            )
+        products = list(Product.objects.all())
+        for i, user in enumerate(cls.users):
+            for p in products[i:i + 4]:
+                CartItem.objects.create(user=user, product=p)
+            for _ in range(5):
+                Order.objects.create(user=user, ordered=True)
+        with connection.cursor() as cur:
+            cur.execute("ANALYZE")
+
+    def assertUsesIndex(self, qs):
+        if connection.vendor != "sqlite":
+            self.skipTest("plan assertions are written against SQLite")
+        plan = qs.explain()
+        for line in plan.splitlines():
+            self.assertIsNone(self.full_scan.search(line), f"full scan:\n{plan}\n{qs.query}")
+            self.assertNotIn("TEMP B-TREE", line, f"sort without index:\n{plan}\n{qs.query}")
+
+    def test_feed(self):
+        self.assertUsesIndex(Product.objects.filter(is_available=True)[:13])
+
+    def test_feed_by_category(self):
+        self.assertUsesIndex(Product.objects.filter(is_available=True, category="books")[:13])
+
+    def test_feed_cursor(self):
+        last = Product.objects.first()
+        qs = keyset_queryset(
+            Product.objects.filter(is_available=True, category="books"),
+            (last.created_at, last.pk),
+        )
+        self.assertUsesIndex(qs[:13])
+
+    def test_dashboard_listings(self):
+        qs = Product.objects.filter(owner=self.users[0], is_available=True, quantity__gt=0)
+        self.assertUsesIndex(qs.order_by("-created_at")[:8])
+
+    def test_order_history(self):
+        last = Order.objects.filter(user=self.users[0]).last()
+        qs = Order.objects.filter(user=self.users[0], ordered=True)
+        self.assertUsesIndex(keyset_queryset(qs, None)[:11])
+        self.assertUsesIndex(keyset_queryset(qs, (last.created_at, last.pk))[:11])
+
+    def test_cart(self):
+        self.assertUsesIndex(CartItem.objects.filter(user=self.users[0]))
+
+    def test_slug_allocation(self):
+        # the ORDER BY sorts a handful of matching slugs, so only scans matter
+        plan = taken_slugs(Product, "thing-1").explain()
+        for line in plan.splitlines():
+            self.assertIsNone(self.full_scan.search(line), plan)
+
+
+def make_upload(name="photo.jpg", size=(1200, 900), fmt="JPEG", exif=None):
+    buf = BytesIO()
+    img = Image.new("RGB", size, (40, 120, 90))
+    if exif:
+        img.save(buf, fmt, exif=exif)
+    else:
+        img.save(buf, fmt)
+    return SimpleUploadedFile(name, buf.getvalue(), content_type="image/jpeg")
+
+
+class MediaTestMixin:
+    """Point MEDIA_ROOT at a throwaway directory for tests that write files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+
+def login(client, user):
+    session = client.session
+    session["user_id"] = user.id
+    session["username"] = user.username
+    session.save()
+
+
+class CheckoutTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_user("buyer")
+        seller = make_user()
+        cls.lamp = make_product(seller, "Lamp", price=30, quantity=2)
+        cls.desk = make_product(seller, "Desk", price=100, quantity=5)
+
+    def setUp(self):
+        super().setUp()
+        login(self.client, self.buyer)
+
+    def test_checkout_deducts_stock_and_clears_cart(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, qty=2)
+        CartItem.objects.create(user=self.buyer, product=self.desk, qty=1)
+        resp = self.client.post(reverse("market:checkout"))
+
+        order = Order.objects.get(user=self.buyer)
+        self.assertRedirects(resp, reverse("market:order_detail", args=[order.pk]))
+        self.assertEqual(
+            sorted(order.items.values_list("title", "qty")), [("Desk", 1), ("Lamp", 2)]
+        )
+        self.lamp.refresh_from_db()
+        self.desk.refresh_from_db()
+        self.assertEqual((self.lamp.quantity, self.lamp.is_available), (0, False))
+        self.assertEqual((self.desk.quantity, self.desk.is_available), (4, True))
+        self.assertFalse(CartItem.objects.filter(user=self.buyer).exists())
+
+    def test_insufficient_stock_rolls_back(self):
+        CartItem.objects.create(user=self.buyer, product=self.desk, qty=1)
+        CartItem.objects.create(user=self.buyer, product=self.lamp, qty=3)
+        resp = self.client.post(reverse("market:checkout"))
+
+        self.assertRedirects(resp, reverse("market:cart"), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.desk.refresh_from_db()
+        self.assertEqual(self.desk.quantity, 5)
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 2)
+
+    def test_one_update_per_line_and_bulk_inserts(self):
+        seller = self.lamp.owner
+        for i in range(10):
+            CartItem.objects.create(user=self.buyer, product=make_product(seller, f"Cup {i}"))
+        # savepoint, cart, 10 stock updates, availability flip, prices,
+        # order, order items, cart delete, release
+        with self.assertNumQueries(18):
+            place_order(self.buyer)
+
+
+# commits are real here; keep the similar-items refresh thread out of the way
+@override_settings(MARKET_SIMILAR_REFRESH="off", CACHES=TEST_CACHES)
+class CheckoutConcurrencyTests(TransactionTestCase):
+    buyers = 12
+    stock = 5
+    # seconds each buyer keeps retrying a locked database before giving up
+    patience = 30
+
+    def test_no_overselling(self):
+        seller = make_user()
+        product = make_product(seller, "Last few", quantity=self.stock)
+        users = [make_user(f"buyer{i}") for i in range(self.buyers)]
+        for u in users:
+            CartItem.objects.create(user=u, product=product, qty=1)
+
+        results, gave_up = [], []
+        start = threading.Barrier(len(users))
+
+        def buy(user):
+            start.wait()
+            try:
+                # sqlite serializes writers; retry until we get a turn, within limits
+                deadline = time.monotonic() + self.patience
+                while time.monotonic() < deadline:
+                    try:
+                        results.append(place_order(user))
+                        return
+                    except OutOfStock:
+                        results.append(None)
+                        return
+                    except OperationalError:
+                        time.sleep(0.01)
+                gave_up.append(user.username)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=2 * self.patience)
+        self.assertFalse([t for t in threads if t.is_alive()], "checkout threads hung")
+        self.assertEqual(gave_up, [])
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        self.assertFalse(product.is_available)
+        self.assertEqual(len([r for r in results if r]), self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(OrderItem.objects.filter(product_id=product.pk).count(), self.stock)
+
+
+class OrderTotalTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_user("buyer")
+        seller = make_user()
+        cls.lamp = make_product(seller, "Lamp", price="12.50", quantity=10)
+
+    def add_order(self, *lines):
+        order = Order.objects.create(user=self.buyer, ordered=True)
+        for qty, price in lines:
+            OrderItem.objects.create(order=order, product_id=self.lamp.pk, qty=qty, price_snapshot=price)
+        return order
+
+    def test_checkout_stores_total(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, qty=3)
+        order = place_order(self.buyer)
+        order.refresh_from_db()
+        self.assertEqual(str(order.total_amount), "37.50")
+
+    def test_checkout_charges_the_price_at_commit(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, qty=2)
+        real_now = timezone.now
+
+        def reprice():
+            # the seller changes the price after the cart was read
+            Product.objects.filter(pk=self.lamp.pk).update(price="20.00")
+            return real_now()
+
+        with mock.patch("market.orders.timezone.now", side_effect=reprice):
+            order = place_order(self.buyer)
+        order.refresh_from_db()
+        self.assertEqual(str(order.total), "40.00")
+        self.assertEqual(str(order.items.get().price_snapshot), "20.00")
+
+    def test_backfill_command(self):
+        order = self.add_order((2, "10.00"), (1, "5.25"))
+        empty = self.add_order()
+        call_command("backfill_order_totals", stdout=StringIO())
+        order.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(str(order.total), "25.25")
+        self.assertEqual(empty.total, 0)
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=0)
+    def test_history_pages_do_not_query_per_order(self):
+        login(self.client, self.buyer)
+        self.add_order((1, "1.00"))
+        counts = {}
+        for url in (reverse("market:previous_purchases"), reverse("market:user_dashboard")):
+            caches["shared"].clear()
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url)
+            counts[url] = len(ctx.captured_queries)
+        for _ in range(5):
+            self.add_order((2, "3.00"), (1, "4.00"))
+        for url, count in counts.items():
+            caches["shared"].clear()
+            with self.assertNumQueries(count):
+                self.client.get(url)
+
+
+class OrderHistoryTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_user("buyer")
+        for i in range(25):
+            order = Order.objects.create(user=cls.buyer, ordered=True, total=i * 2)
+            OrderItem.objects.create(order=order, product_id=1, title=f"Thing {i}", qty=2, price_snapshot=i)
+            OrderItem.objects.create(order=order, product_id=2, title="Extra", qty=1, price_snapshot=0)
+        Order.objects.create(user=make_user("other"), ordered=True)
+
+    def setUp(self):
+        super().setUp()
+        login(self.client, self.buyer)
+
+    def test_history_is_paginated(self):
+        url = reverse("market:previous_purchases")
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            resp = self.client.get(url, {"cursor": cursor})
+            page = list(resp.context["orders"])
+            self.assertLessEqual(len(page), 10)
+            seen += [o.pk for o in page]
+            cursor = resp.context["next_cursor"]
+        expected = Order.objects.filter(user=self.buyer).order_by("-created_at", "-id")
+        self.assertEqual(seen, list(expected.values_list("pk", flat=True)))
+
+    def test_csv_export(self):
+        resp = self.client.get(reverse("market:export_orders"), {"format": "csv"})
+        self.assertEqual(resp["Content-Type"], "text/csv")
+        rows = list(csv.reader(b"".join(resp.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][0], "order_id")
+        self.assertEqual(len(rows), 1 + 50)
+
+    def test_json_export(self):
+        resp = self.client.get(reverse("market:export_orders"), {"format": "json"})
+        data = json.loads(b"".join(resp.streaming_content))
+        self.assertEqual(len(data), 25)
+        self.assertEqual(data[0]["items"][0]["title"], "Thing 24")
+        self.assertEqual(len(data[0]["items"]), 2)
+
+
+class AccountLoadingTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user("buyer")
+
+    def setUp(self):
+        super().setUp()
+        login(self.client, self.user)
+
+    def user_queries(self, ctx):
+        return [q for q in ctx.captured_queries if "market_useraccount" in q["sql"]]
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=0)
+    def test_loaded_once_per_request(self):
+        request = RequestFactory().get("/")
+        request.session = {"user_id": self.user.pk}
+        with self.assertNumQueries(1):
+            self.assertEqual(get_account(request), self.user)
+            self.assertEqual(get_account(request), self.user)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("market:cart"))
+        self.assertEqual(len(self.user_queries(ctx)), 1)
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=30)
+    def test_cached_between_requests(self):
+        self.client.get(reverse("market:cart"))
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("market:cart"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.user_queries(ctx), [])
+        # the password hash never reaches the on-disk cache
+        self.assertNotIn("password", caches["shared"].get(account_cache_key(self.user.pk)).__dict__)
+
+        self.user.username = "renamed"
+        self.user.save()
+        resp = self.client.get(reverse("market:user_dashboard"))
+        self.assertEqual(resp.context["user_obj"].username, "renamed")
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=30)
+    def test_dashboard_save_keeps_columns_it_did_not_change(self):
+        self.client.get(reverse("market:cart"))
+        # changed by another process while this one still has the account cached
+        UserAccount.objects.filter(pk=self.user.pk).update(password="newer-hash")
+        self.client.post(reverse("market:user_dashboard"), {"username": "renamed"})
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.username, self.user.password), ("renamed", "newer-hash"))
+
+    def test_deleted_account_logs_out(self):
+        self.user.delete()
+        resp = self.client.get(reverse("market:cart"))
+        self.assertRedirects(resp, reverse("market:login"))
+        self.assertNotIn("user_id", self.client.session)
+
+
+class CartSummaryTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_user("buyer")
+        seller = make_user()
+        cls.lamp = make_product(seller, "Lamp", price=20, quantity=10)
+        cls.desk = make_product(seller, "Desk", price=100, quantity=10)
+
+    def setUp(self):
+        super().setUp()
+        login(self.client, self.buyer)
+
+    def cart_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        return resp, [q for q in ctx.captured_queries if "market_cartitem" in q["sql"]]
+
+    def test_badge_is_served_from_cache(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, qty=2)
+        resp, queries = self.cart_queries(reverse("market:product_list"))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(resp.context["cart_summary"]["total"], 40)
+
+        resp, queries = self.cart_queries(reverse("market:about"))
+        self.assertEqual(queries, [])
+        self.assertContains(resp, '<span class="badge bg-secondary">1</span>')
+
+    def test_cart_views_invalidate(self):
+        url = reverse("market:product_list")
+        self.client.get(url)
+
+        self.client.post(reverse("market:add_to_cart"), {"product_id": self.desk.pk, "qty": 2})
+        resp = self.client.get(url)
+        self.assertEqual(dict(resp.context["cart_summary"]), {"count": 1, "total": 200})
+
+        item = CartItem.objects.get(user=self.buyer)
+        self.client.post(reverse("market:update_cart"), {"item_id": item.pk, "qty": 1})
+        resp = self.client.get(url)
+        self.assertEqual(resp.context["cart_summary"]["total"], 100)
+
+        self.client.post(reverse("market:checkout"))
+        resp = self.client.get(url)
+        self.assertEqual(resp.context["cart_summary"]["count"], 0)
+
+        CartItem.objects.create(user=self.buyer, product=self.lamp)
+        caches["shared"].clear()
+        item = CartItem.objects.get(user=self.buyer)
+        self.client.get(url)
+        self.client.post(reverse("market:remove_from_cart"), {"item_id": item.pk})
+        resp = self.client.get(url)
+        self.assertEqual(resp.context["cart_summary"]["count"], 0)
+
+    def test_anonymous_pages_skip_cart(self):
+        self.client.logout()
+        resp, queries = self.cart_queries(reverse("market:product_list"))
+        self.assertIsNone(resp.context["cart_summary"])
+        self.assertEqual(queries, [])
+
+
+class PageCacheTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.lamp = make_product(cls.seller, "Brass lamp", quantity=1)
+
+    def get(self, url, **params):
+        resp = self.client.get(url, params)
+        return resp, resp.get("X-Page-Cache")
+
+    def test_anonymous_feed_is_cached_per_query(self):
+        url = reverse("market:product_list")
+        before = page_cache_stats()
+        self.assertEqual(self.get(url)[1], "miss")
+        with self.assertNumQueries(0):
+            resp, state = self.get(url)
+        self.assertEqual(state, "hit")
+        self.assertContains(resp, "Brass lamp")
+        self.assertEqual(self.get(url, category="books")[1], "miss")
+        self.assertEqual(self.get(url, category="books")[1], "hit")
+
+        after = page_cache_stats()
+        self.assertEqual(after["hit"] - before["hit"], 2)
+        self.assertEqual(after["miss"] - before["miss"], 2)
+
+    def test_product_changes_invalidate(self):
+        feed = reverse("market:product_list")
+        detail = reverse("market:product_detail", args=[self.lamp.slug])
+        self.get(feed)
+        self.get(detail)
+
+        self.lamp.price = 99
+        self.lamp.save()
+        self.assertEqual(self.get(feed)[1], "miss")
+        resp, state = self.get(detail)
+        self.assertEqual(state, "miss")
+        self.assertContains(resp, "99")
+
+        ProductImage.objects.create(product=self.lamp, image="products/lamp.jpg")
+        resp, state = self.get(detail)
+        self.assertEqual(state, "miss")
+        self.assertContains(resp, "/media/products/lamp.jpg")
+
+    def test_logged_in_users_bypass_cache(self):
+        url = reverse("market:product_detail", args=[self.lamp.slug])
+        self.get(url)
+        login(self.client, self.seller)
+        resp, state = self.get(url)
+        self.assertIsNone(state)
+        self.assertContains(resp, "Edit")
+
+
+# commits are real here; keep the similar-items refresh thread out of the way
+@override_settings(MARKET_SIMILAR_REFRESH="off", CACHES=TEST_CACHES)
+class PageCacheCheckoutTests(TransactionTestCase):
+    def test_checkout_expires_sold_out_product(self):
+        caches["pages"].clear()
+        seller = make_user()
+        lamp = make_product(seller, "Brass lamp", quantity=1)
+        url = reverse("market:product_detail", args=[lamp.slug])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "hit")
+
+        buyer = make_user("buyer")
+        CartItem.objects.create(user=buyer, product=lamp)
+        place_order(buyer)
+        resp = self.client.get(url)
+        self.assertEqual(resp["X-Page-Cache"], "miss")
+        self.assertContains(resp, "Sold out")
+
+
+@override_settings(MARKET_IMAGE_PROCESSING="sync")
+class ImageVariantTests(MediaTestMixin, MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = make_product(make_user(), "Bike")
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=make_upload(**kwargs))
+
+    def test_variants_are_generated_after_upload(self):
+        pi = self.upload()
+        pi.refresh_from_db()
+        self.assertEqual(sorted(pi.variants), ["jpeg", "webp"])
+        self.assertEqual(sorted(pi.variants["webp"], key=int), ["160", "480", "960"])
+        with default_storage.open(pi.variants["webp"]["480"]) as f, Image.open(f) as img:
+            self.assertEqual((img.format, img.size), ("WEBP", (480, 360)))
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image_variants, pi.variants)
+        self.assertIn(" 960w", self.product.primary_image_srcset)
+        self.assertTrue(self.product.primary_thumbnail_url.endswith("__w480.jpg"))
+
+    def test_webp_is_only_offered_through_a_source(self):
+        self.upload()
+        self.product.refresh_from_db()
+        resp = self.client.get(reverse("market:product_detail", args=[self.product.slug]))
+        html = resp.content.decode()
+        img_srcsets = re.findall(r'<img [^>]*srcset="([^"]*)"', html)
+        self.assertTrue(img_srcsets)
+        for value in img_srcsets:
+            self.assertNotIn(".webp", value)
+        self.assertIn(f'<source type="image/webp" srcset="{self.product.primary_image_srcset}"', html)
+
+    def test_small_images_are_not_upscaled(self):
+        pi = self.upload(size=(200, 100))
+        pi.refresh_from_db()
+        with default_storage.open(pi.variants["jpeg"]["960"]) as f, Image.open(f) as img:
+            self.assertEqual(img.size, (200, 100))
+
+    def test_unreadable_file_is_skipped(self):
+        with self.assertLogs("market.images", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                pi = ProductImage.objects.create(
+                    product=self.product,
+                    image=SimpleUploadedFile("bad.jpg", b"not an image"),
+                )
+        pi.refresh_from_db()
+        self.assertEqual(pi.variants, {})
+
+    @override_settings(MARKET_IMAGE_PROCESSING="off")
+    def test_backfill_command(self):
+        pi = self.upload()
+        self.assertEqual(pi.variants, {})
+        call_command("build_image_variants", workers=1, stdout=StringIO())
+        pi.refresh_from_db()
+        self.assertIn("160", pi.variants["jpeg"])
+
+
+@override_settings(MARKET_SIMILAR_REFRESH="off")
+class UploadJobTests(MediaTestMixin, MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+
+    def setUp(self):
+        super().setUp()
+        login(self.client, self.seller)
+
+    def create_listing(self, *files):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("market:product_create"), {
+                "title": "Road bike", "price": "250", "quantity": "1", "images": list(files),
+            })
+        return Product.objects.get(title="Road bike")
+
+    @override_settings(MARKET_IMAGE_PROCESSING="sync")
+    def test_uploads_are_cleaned_and_attached(self):
+        exif = Image.Exif()
+        exif[0x010F] = "SecretCam"
+        product = self.create_listing(make_upload("a.jpg", exif=exif), make_upload("b.png", fmt="PNG"))
+
+        self.assertEqual(product.images_pending, 0)
+        images = list(product.images.all())
+        self.assertEqual(len(images), 2)
+        with images[0].image.open("rb") as f, Image.open(f) as img:
+            self.assertEqual(dict(img.getexif()), {})
+        self.assertTrue(images[0].variants)
+        self.assertEqual(product.primary_image, images[0].image.name)
+        self.assertEqual(
+            set(ImageUploadJob.objects.values_list("status", flat=True)), {"done"}
+        )
+        self.assertEqual(default_storage.listdir("uploads/pending")[1], [])
+
+    @override_settings(MARKET_IMAGE_PROCESSING="worker")
+    def test_listing_shows_processing_until_worker_runs(self):
+        product = self.create_listing(make_upload())
+        self.assertEqual(product.images_pending, 1)
+        self.assertFalse(product.images.exists())
+        resp = self.client.get(reverse("market:product_detail", args=[product.slug]))
+        self.assertContains(resp, "Processing 1 image")
+
+        call_command("process_image_jobs", once=True, workers=1, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.images_pending, 0)
+        self.assertEqual(product.images.count(), 1)
+        resp = self.client.get(reverse("market:product_detail", args=[product.slug]))
+        self.assertNotContains(resp, "Processing")
+
+    @override_settings(MARKET_IMAGE_PROCESSING="sync")
+    def test_invalid_upload_fails_job(self):
+        bogus = SimpleUploadedFile("notes.jpg", b"definitely not a jpeg")
+        with self.assertLogs("market.uploads", "WARNING"):
+            product = self.create_listing(bogus)
+        product.refresh_from_db()
+        self.assertEqual(product.images_pending, 0)
+        self.assertFalse(product.images.exists())
+        self.assertEqual(ImageUploadJob.objects.get().status, "failed")
+
+    @override_settings(MARKET_IMAGE_PROCESSING="worker", MARKET_MAX_IMAGE_BYTES=1024)
+    def test_oversize_uploads_are_never_staged(self):
+        with mock.patch("market.uploads._stage") as stage:
+            product = self.create_listing(make_upload("huge.jpg"))
+        stage.assert_not_called()
+        self.assertEqual(product.images_pending, 0)
+        self.assertFalse(ImageUploadJob.objects.exists())
+        resp = self.client.get(reverse("market:product_detail", args=[product.slug]))
+        self.assertContains(resp, "Skipped photos over 1.0\xa0KB: huge.jpg")
+
+    @override_settings(MARKET_IMAGE_PROCESSING="worker")
+    def test_edit_keeps_columns_the_worker_updated(self):
+        product = self.create_listing()
+        loaded = Product.objects.get(pk=product.pk)
+        # the worker attaches a photo while the edit request is in flight
+        Product.objects.filter(pk=product.pk).update(primary_image="products/bike.jpg", images_pending=0)
+        with mock.patch("market.views.get_object_or_404", return_value=loaded):
+            self.client.post(reverse("market:product_edit", args=[product.pk]), {"title": "Racing bike"})
+        product.refresh_from_db()
+        self.assertEqual((product.title, product.primary_image), ("Racing bike", "products/bike.jpg"))
+        self.assertTrue(product.similar_stale)
+
+    @override_settings(MARKET_IMAGE_PROCESSING="worker")
+    def test_claim_refreshes_updated_at(self):
+        product = self.create_listing(make_upload())
+        job = ImageUploadJob.objects.get(product=product)
+        # queued long before a worker got to it
+        ImageUploadJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertTrue(_claim(job.pk))
+
+        # the stale sweep must leave a freshly claimed job alone
+        with mock.patch("market.management.commands.process_image_jobs.run_pending_jobs", return_value=0):
+            call_command("process_image_jobs", once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "running")
+        default_storage.delete(job.staged_name)
+
+
+class SlugTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user()
+
+    def test_suffixes_continue_from_highest(self):
+        slugs = [make_product(self.owner, "iPhone 12").slug for _ in range(3)]
+        self.assertEqual(slugs, ["iphone-12", "iphone-12-1", "iphone-12-2"])
+        Product.objects.filter(slug="iphone-12-1").delete()
+        make_product(self.owner, "iPhone 12 Pro")
+        self.assertEqual(make_product(self.owner, "iPhone 12").slug, "iphone-12-3")
+
+    def test_one_query_per_allocation(self):
+        for _ in range(12):
+            make_product(self.owner, "Chair")
+        with CaptureQueriesContext(connection) as ctx:
+            p = make_product(self.owner, "Chair")
+        self.assertEqual(p.slug, "chair-12")
+        slug_lookups = [q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(slug_lookups), 1)
+
+    def test_blank_title_slug(self):
+        self.assertEqual(make_product(self.owner, "!!!").slug, "item")
+
+    def test_collision_is_retried(self):
+        first = make_product(self.owner, "Lamp")
+        p = Product(owner=self.owner, title="Lamp", price=1)
+        # a concurrent insert took the slug between allocation and INSERT
+        with mock.patch("market.models.allocate_slug", side_effect=[first.slug, "lamp-1"]) as alloc:
+            p.save()
+        self.assertEqual(p.slug, "lamp-1")
+        self.assertEqual(alloc.call_count, 2)
+
+    def test_bulk_allocation(self):
+        make_product(self.owner, "Desk")
+        with self.assertNumQueries(2):
+            slugs = allocate_slugs(Product, ["Desk", "Desk", "Shelf", "Desk", "Shelf"])
+        self.assertEqual(slugs, ["desk-1", "desk-2", "shelf", "desk-3", "shelf-1"])
+
+
+class CatalogImportExportTests(MediaTestMixin, MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+
+    def write(self, name, text):
+        path = f"{self._media_root}/{name}"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_import_in_batches(self):
+        make_product(self.seller, "Desk lamp")
+        path = self.write("items.csv", (
+            "title,price,quantity,category,brand\n"
+            "Desk lamp,12.50,2,electronics,Ikea\n"
+            "Desk lamp,9,1,nonsense,\n"
+            "x,1,1,other,\n"
+            "Oak table,80,1,home,\n"
+        ))
+        out, err = StringIO(), StringIO()
+        call_command("import_products", path, owner="seller", batch_size=2, stdout=out, stderr=err)
+
+        self.assertIn("Imported 3 products (1 skipped)", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        self.assertIn("line 4: title", err.getvalue())
+        lamps = Product.objects.filter(title="Desk lamp").order_by("id")
+        self.assertEqual([p.slug for p in lamps], ["desk-lamp", "desk-lamp-1", "desk-lamp-2"])
+        self.assertEqual(lamps[2].category, "other")
+        # bulk_create skips signals, so the command indexes the rows itself
+        self.assertEqual(search_products(Product.objects.all(), "oak").get().title, "Oak table")
+
+    @override_settings(MARKET_IMAGE_PROCESSING="sync")
+    def test_jsonl_import_attaches_images(self):
+        with open(f"{self._media_root}/bike.jpg", "wb") as f:
+            f.write(make_upload().read())
+        path = self.write("items.jsonl", "\n".join([
+            json.dumps({"title": "Road bike", "price": "250", "images": ["bike.jpg"]}),
+            json.dumps({"title": "Helmet", "price": 30, "images": "../etc/passwd"}),
+        ]))
+        err = StringIO()
+        call_command("import_products", path, owner=self.seller.email, images_dir=self._media_root,
+                     image_workers=1, stdout=StringIO(), stderr=err)
+
+        self.assertIn("image not found", err.getvalue())
+        bike = Product.objects.get(title="Road bike")
+        self.assertEqual(bike.images_pending, 0)
+        self.assertEqual(bike.primary_image, bike.images.get().image.name)
+        self.assertTrue(bike.primary_image_variants)
+
+    def test_export_streams_every_product(self):
+        other = make_user("other")
+        make_product(self.seller, "Chair", price=15)
+        make_product(other, "Sofa", price=200)
+
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command("export_products", format="csv", chunk_size=1, stdout=out, stderr=StringIO())
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(r["title"], r["owner"]) for r in rows], [("Chair", "seller"), ("Sofa", "other")])
+
+        path = f"{self._media_root}/dump.jsonl"
+        call_command("export_products", output=path, owner="other", stderr=StringIO())
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([r["price"] for r in rows], ["200.00"])
+
+    def test_export_then_import_round_trip(self):
+        make_product(self.seller, "Kettle", price=20, brand="Bosch")
+        path = f"{self._media_root}/dump.csv"
+        call_command("export_products", output=path, stderr=StringIO())
+        call_command("import_products", path, stdout=StringIO(), stderr=StringIO())
+        copies = Product.objects.filter(brand="Bosch").order_by("id")
+        self.assertEqual([p.slug for p in copies], ["kettle", "kettle-1"])
+
+
+class ApiTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.buyer = make_user("buyer")
+        cls.products = [make_product(cls.seller, f"Lamp {i}", quantity=3) for i in range(5)]
+
+    def test_product_list_cursor_and_fields(self):
+        url = reverse("api-v1:product_list")
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {"limit": 2, "fields": "slug,owner"}).json()
+        self.assertEqual(data["results"], [
+            {"slug": "lamp-4", "owner": {"id": self.seller.id, "username": "seller"}},
+            {"slug": "lamp-3", "owner": {"id": self.seller.id, "username": "seller"}},
+        ])
+        rest = self.client.get(data["next"]).json()
+        self.assertEqual([p["slug"] for p in rest["results"]], ["lamp-2", "lamp-1"])
+
+        data = self.client.get(url, {"q": "lamp", "limit": 4}).json()
+        self.assertEqual(len(data["results"]), 4)
+        self.assertIn("page=2", data["next"])
+
+    def test_product_detail_queries_do_not_grow_with_images(self):
+        product = self.products[0]
+        url = reverse("api-v1:product_detail", args=[product.slug])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        for i in range(3):
+            ProductImage.objects.create(product=product, image=f"products/{i}.jpg")
+        with self.assertNumQueries(2):
+            data = self.client.get(url).json()
+        self.assertEqual(len(data["images"]), 3)
+        self.assertEqual(self.client.get(reverse("api-v1:product_detail", args=["nope"])).status_code, 404)
+
+    def test_etag_answers_304(self):
+        url = reverse("api-v1:product_detail", args=[self.products[0].slug])
+        resp = self.client.get(url)
+        etag = resp["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.filter(pk=self.products[0].pk).update(title="Lamp zero")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_requires_login(self):
+        self.assertEqual(self.client.get(reverse("api-v1:cart")).status_code, 401)
+
+    def test_cart_operations(self):
+        login(self.client, self.buyer)
+        url = reverse("api-v1:cart")
+        resp = self.client.post(url, {"product": self.products[0].id, "qty": 2}, content_type="application/json")
+        self.assertEqual(resp.status_code, 201)
+        resp = self.client.post(url, {"product": self.products[0].id, "qty": 2}, content_type="application/json")
+        self.assertEqual(resp.json()["items"][0]["qty"], 3)
+        self.assertEqual(
+            self.client.post(url, {"product": self.products[1].id, "qty": 9},
+                             content_type="application/json").status_code, 400,
+        )
+
+        item_url = reverse("api-v1:cart_item", args=[resp.json()["items"][0]["id"]])
+        data = self.client.patch(item_url, {"qty": 1}, content_type="application/json").json()
+        self.assertEqual((data["count"], data["total"]), (1, "10.00"))
+        self.assertEqual(self.client.delete(item_url).status_code, 204)
+        self.assertEqual(self.client.get(url).json()["count"], 0)
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=30)
+    def test_cart_query_count_is_constant(self):
+        login(self.client, self.buyer)
+        url = reverse("api-v1:cart")
+        CartItem.objects.create(user=self.buyer, product=self.products[0])
+        self.client.get(url)  # warm the account cache
+        # the session comes from the session cache, so only the cart query
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        for p in self.products[1:]:
+            CartItem.objects.create(user=self.buyer, product=p)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).json()["count"], 5)
+
+    @override_settings(MARKET_ACCOUNT_CACHE_TTL=30)
+    def test_order_history(self):
+        login(self.client, self.buyer)
+        for p in self.products[:3]:
+            CartItem.objects.create(user=self.buyer, product=p)
+            place_order(self.buyer)
+        self.client.get(reverse("api-v1:order_list"))
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse("api-v1:order_list"), {"limit": 2}).json()
+        self.assertEqual([o["items"][0]["title"] for o in data["results"]], ["Lamp 2", "Lamp 1"])
+        self.assertIsNotNone(data["next"])
+
+        other = make_user("other")
+        order = Order.objects.filter(user=self.buyer).first()
+        login(self.client, other)
+        self.assertEqual(self.client.get(reverse("api-v1:order_detail", args=[order.pk])).status_code, 404)
+
+
+@override_settings(MARKET_PASSWORD_ITERATIONS=1000)
+class LoginTests(MarketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user(password=hash_password("s3cret-pass"))
+
+    def post_login(self, password, email="seller@example.com", **extra):
+        return self.client.post(reverse("market:login"), {"email": email, "password": password}, **extra)
+
+    def test_hashes_are_salted(self):
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+        self.assertNotEqual(hash_password("s3cret-pass"), self.user.password)
+
+    def test_login_checks_hash_after_email_lookup(self):
+        self.assertRedirects(self.post_login("s3cret-pass"), reverse("market:user_dashboard"),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.session["user_id"], self.user.id)
+        self.client.cookies.clear()
+        resp = self.post_login("wrong")
+        self.assertRedirects(resp, reverse("market:login"), fetch_redirect_response=False)
+
+    def test_legacy_and_weaker_hashes_are_upgraded(self):
+        legacy = hashlib.sha256(b"old-pass").hexdigest()
+        UserAccount.objects.filter(pk=self.user.pk).update(password=legacy)
+        self.post_login("wrong")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, legacy)
+
+        self.post_login("old-pass")
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+
+        with self.settings(MARKET_PASSWORD_ITERATIONS=2000):
+            self.assertTrue(verify_password(self.user, "old-pass"))
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertTrue(verify_password(UserAccount.objects.get(pk=self.user.pk), "old-pass"))
+
+    @override_settings(MARKET_LOGIN_MAX_PER_EMAIL=3, MARKET_LOGIN_MAX_PER_IP=5)
+    def test_throttle_rejects_before_any_work(self):
+        for _ in range(3):
+            self.post_login("wrong")
+        with self.assertNumQueries(0), mock.patch("market.passwords.hashers.check_password") as check:
+            resp = self.post_login("s3cret-pass")
+        self.assertEqual(resp.status_code, 429)
+        check.assert_not_called()
+
+        # other emails from the same address run into the per-IP limit
+        self.post_login("x", email="a@example.com")
+        self.post_login("x", email="b@example.com")
+        self.assertEqual(self.post_login("x", email="c@example.com").status_code, 429)
+        self.assertEqual(self.post_login("x", email="c@example.com", REMOTE_ADDR="10.0.0.9").status_code, 302)
+
+    @override_settings(MARKET_LOGIN_MAX_PER_EMAIL=3)
+    def test_successful_login_resets_email_counter(self):
+        self.post_login("wrong")
+        self.post_login("wrong")
+        self.post_login("s3cret-pass")
+        self.client.cookies.clear()
+        self.post_login("wrong")
+        self.post_login("wrong")
+        self.assertEqual(self.post_login("s3cret-pass").status_code, 302)
+
+
+@override_settings(MARKET_SIMILAR_REFRESH="off")
+class SimilarProductTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.phone = make_product(cls.seller, "Apple iPhone 12 smartphone", brand="Apple", category="electronics")
+        cls.phone2 = make_product(cls.seller, "iPhone 12 mini smartphone", brand="Apple", category="electronics")
+        cls.android = make_product(cls.seller, "Samsung Galaxy smartphone", brand="Samsung", category="electronics")
+        cls.sofa = make_product(cls.seller, "Leather sofa", category="home",
+                                description="Three seater sofa in brown leather")
+        cls.chair = make_product(cls.seller, "Leather armchair", category="home")
+
+    def neighbours(self, product):
+        return list(
+            SimilarProduct.objects.filter(product=product).order_by("rank").values_list("neighbour__title", flat=True)
+        )
+
+    def test_rebuild_ranks_by_cosine(self):
+        self.assertEqual(rebuild(), 5)
+        self.assertEqual(self.neighbours(self.phone), [self.phone2.title, self.android.title])
+        self.assertEqual(self.neighbours(self.sofa), [self.chair.title])
+        self.assertFalse(Product.objects.filter(similar_stale=True).exists())
+
+    def test_saving_marks_stale_and_refresh_splices(self):
+        rebuild()
+        self.chair.title = "Apple iPhone 12 Pro smartphone"
+        self.chair.brand = "Apple"
+        self.chair.category = "electronics"
+        self.chair.save()
+        self.assertTrue(Product.objects.get(pk=self.chair.pk).similar_stale)
+
+        self.assertEqual(refresh(), 1)
+        self.assertEqual(self.neighbours(self.sofa), [])
+        self.assertIn(self.chair.title, self.neighbours(self.phone))
+        self.assertEqual(self.neighbours(self.chair)[0], self.phone.title)
+        self.assertEqual(refresh(), 0)
+
+    @override_settings(MARKET_SIMILAR_REFRESH="sync")
+    def test_new_listing_is_picked_up_after_commit(self):
+        rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp = make_product(self.seller, "Leather sofa cushion", category="home")
+        self.assertIn(lamp.title, self.neighbours(self.sofa))
+
+    @override_settings(MARKET_SIMILAR_REFRESH="thread", MARKET_SIMILAR_REFRESH_DELAY=0.2)
+    def test_thread_mode_batches_saves_into_one_refresh(self):
+        with mock.patch("market.recommend.refresh") as refresh_mock:
+            for title in ("Sofa cover", "Sofa bed", "Sofa table"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    make_product(self.seller, title, category="home")
+            # all three saves land inside the first one's delay
+            recommend._get_executor().submit(lambda: None).result()
+            refresh_mock.assert_called_once_with()
+
+    def test_detail_page_reads_neighbours_in_one_query(self):
+        rebuild()
+        Product.objects.filter(pk=self.android.pk).update(is_available=False)
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("market:product_detail", args=[self.phone.slug]))
+        self.assertEqual([p.title for p in resp.context["similar_products"]], [self.phone2.title])
+        # the other query reading it is the page's validators
+        self.assertEqual(len([q for q in ctx.captured_queries if 'JOIN "market_similarproduct"' in q["sql"]]), 1)
+        self.assertContains(resp, "Similar items")
+
+    def test_category_alone_is_not_similarity(self):
+        lamp = make_product(self.seller, "Brass desk lamp", category="home")
+        rebuild()
+        self.assertEqual(self.neighbours(lamp), [])
+
+    def test_terms_in_most_products_are_dropped(self):
+        docs = [["listing", f"word{i}"] for i in range(recommend.MAX_DF_FLOOR + 1)]
+        corpus = recommend.Corpus(list(range(len(docs))), docs)
+        self.assertNotIn("listing", corpus.idf)
+        self.assertEqual(corpus.neighbours([0]), {0: []})
+
+    @skipUnless(recommend.sparse is not None, "SciPy is not installed")
+    def test_sparse_and_python_backends_agree(self):
+        make_product(self.seller, "Apple iPhone 12 case", brand="Apple", category="electronics")
+        make_product(self.seller, "Brown leather sofa cushion", category="home")
+        corpus = recommend.load_corpus()
+        rows = list(range(len(corpus.ids)))
+        found = corpus.neighbours(rows)
+        with mock.patch.object(recommend, "sparse", None):
+            expected = recommend.load_corpus().neighbours(rows)
+        self.assertTrue(any(found.values()))
+        self.assertEqual(found.keys(), expected.keys())
+        for row, matches in expected.items():
+            self.assertEqual([o for o, _ in found[row]], [o for o, _ in matches])
+            for (_, got), (_, want) in zip(found[row], matches):
+                self.assertAlmostEqual(got, want)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("build_similar_products", benchmark=200, stdout=out)
+        self.assertIn("Full rebuild of 200 products", out.getvalue())
+
+
+class FacetTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user()
+        make_product(owner, "Sony headphones", category="electronics", brand="Sony", color="black",
+                     price=1500, year_of_manufacture=2020)
+        make_product(owner, "Sony speaker", category="electronics", brand="Sony", color="white",
+                     price=6000, year_of_manufacture=2021)
+        make_product(owner, "Bose speaker", category="electronics", brand="Bose", color="black", price=300)
+        make_product(owner, "Oak desk", category="home", color="brown", price=4000, condition="new")
+        make_product(owner, "Sold speaker", category="electronics", brand="Sony", is_available=False)
+
+    def get(self, **params):
+        return self.client.get(reverse("market:product_list"), params)
+
+    def counts(self, resp, facet):
+        return {o["value"]: o["count"] for o in resp.context["facets"][facet]}
+
+    def test_filters_narrow_the_feed(self):
+        resp = self.get(brand="Sony", color="black")
+        self.assertEqual([p.title for p in resp.context["page_obj"]], ["Sony headphones"])
+        resp = self.get(price="2000-10000", category="home")
+        self.assertEqual([p.title for p in resp.context["page_obj"]], ["Oak desk"])
+        resp = self.get(year="2021")
+        self.assertEqual([p.title for p in resp.context["page_obj"]], ["Sony speaker"])
+
+    def test_counts_ignore_their_own_selection(self):
+        resp = self.get(brand="Sony")
+        self.assertEqual(self.counts(resp, "brand"), {"Sony": 2, "Bose": 1})
+        self.assertEqual(self.counts(resp, "color"), {"black": 1, "white": 1})
+        self.assertEqual(self.counts(resp, "category"), {"electronics": 2})
+        self.assertEqual(self.counts(resp, "price"), {"500-2000": 1, "2000-10000": 1})
+        self.assertEqual(self.counts(resp, "year"), {"2021": 1, "2020": 1})
+        sony = resp.context["facets"]["brand"][0]
+        self.assertTrue(sony["selected"])
+        self.assertEqual(sony["url"], "?")
+
+    def test_counts_follow_search(self):
+        resp = self.get(q="speaker")
+        self.assertEqual(self.counts(resp, "brand"), {"Sony": 1, "Bose": 1})
+        self.assertEqual(self.counts(resp, "category"), {"electronics": 2})
+        self.assertContains(resp, "?q=speaker&amp;brand=Bose")
+
+    def test_one_query_for_all_facets(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.get(brand="Sony", price="500-2000", condition="used_good")
+        facet_queries = [q for q in ctx.captured_queries if "UNION ALL" in q["sql"]]
+        self.assertEqual(len(facet_queries), 1)
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_invalid_values_are_ignored(self):
+        resp = self.get(category="spaceships", price="cheap", year="new")
+        self.assertEqual(resp.context["filters"], {})
+        self.assertEqual(len(resp.context["page_obj"]), 4)
+
+
+class InstrumentationTests(MarketTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.seller = make_user()
+
+    def test_requests_are_logged_and_counted(self):
+        make_product(self.seller, "Lamp")
+        with self.assertLogs("market.requests", "INFO") as logs:
+            self.client.get(reverse("market:product_list"))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["view"], "market:product_list")
+        self.assertEqual(line["status"], 200)
+        self.assertEqual(line["queries"], 3)
+        self.assertGreater(line["template_ms"], 0)
+
+        metrics = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('market_requests_total{view="market:product_list",method="GET",status="200"} 1', metrics)
+        self.assertIn('market_request_queries_bucket{view="market:product_list",le="5"} 1', metrics)
+        self.assertIn('market_page_cache_total{outcome="miss"}', metrics)
+
+    def test_duplicate_queries_are_counted(self):
+        def view(request):
+            for _ in range(3):
+                UserAccount.objects.filter(pk=1).exists()
+            return HttpResponse("ok")
+
+        request = RequestFactory().get("/x")
+        with self.assertLogs("market.requests", "INFO") as logs:
+            instrumented(view, name="dup")(request)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line["view"], line["queries"], line["duplicate_queries"]), ("dup", 3, 2))
+
+    @override_settings(MARKET_SLOW_REQUEST_MS=1)
+    def test_slow_requests_dump_their_queries(self):
+        make_product(self.seller, "Lamp")
+        with mock.patch("market.instrumentation.time.perf_counter", side_effect=itertools.count(0, 0.01)):
+            with self.assertLogs("market.requests", "WARNING") as logs:
+                self.client.get(reverse("market:product_list"))
+        self.assertIn("slow request GET /", logs.output[0])
+        self.assertIn('FROM "market_product"', logs.output[0])
+        self.assertIn('market_slow_requests_total{view="market:product_list"} 1', registry.render())
+
+    # DEBUG is on in the shipped settings; it must not open the endpoint
+    @override_settings(MARKET_METRICS_ALLOWED_IPS=["10.1.1.1"], DEBUG=True)
+    def test_metrics_are_restricted(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.1.1.1").status_code, 200)
+
+    def test_checkout_errors_are_logged(self):
+        login(self.client, self.seller)
+        with mock.patch("market.views.place_order", side_effect=RuntimeError("boom")):
+            with self.assertLogs("market.views", "ERROR") as logs:
+                resp = self.client.post(reverse("market:checkout"))
+        self.assertRedirects(resp, reverse("market:cart"), fetch_redirect_response=False)
+        self.assertIn("boom", logs.output[0])
+
+
+class SeedAndBenchmarkTests(MediaTestMixin, MarketTestCase):
+    def test_seed_then_benchmark_against_a_baseline(self):
+        call_command(
+            "seed_marketplace", products=60, users=6, carts=3, orders=20,
+            images_per_product=2, batch_size=25, stdout=StringIO(),
+        )
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertEqual(ProductImage.objects.count(), 120)
+        self.assertEqual(Order.objects.filter(ordered=True).count(), 20)
+        self.assertTrue(OrderItem.objects.exists())
+        self.assertTrue(CartItem.objects.exists())
+        vintage = Product.objects.filter(title__icontains="vintage").count()
+        self.assertEqual(search_products(Product.objects.all(), "vintage").count(), vintage)
+        # seeded timestamps are spread out, not all "now"
+        self.assertGreater(Product.objects.dates("created_at", "day").count(), 1)
+        stock = dict(Product.objects.values_list("pk", "quantity"))
+
+        baseline = f"{self._media_root}/baseline.json"
+        call_command("benchmark_marketplace", iterations=2, baseline=baseline, save_baseline=True, stdout=StringIO())
+        with open(baseline) as f:
+            saved = json.load(f)
+        self.assertEqual(set(saved["scenarios"]), {
+            "feed", "feed_page_10", "feed_cursor", "feed_category", "feed_anonymous_cached",
+            "search", "product_detail", "cart_view", "checkout", "previous_purchases",
+        })
+        self.assertEqual(saved["scenarios"]["feed_anonymous_cached"]["queries"], 0)
+        # checkout ran in a rolled-back transaction
+        self.assertEqual(dict(Product.objects.values_list("pk", "quantity")), stock)
+        self.assertEqual(Order.objects.count(), 20)
+
+        for result in saved["scenarios"].values():
+            result["queries"] -= 1
+        with open(baseline, "w") as f:
+            json.dump(saved, f)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                "benchmark_marketplace", "feed", iterations=2, baseline=baseline,
+                tolerance=1000, fail_on_regression=True, stdout=out, stderr=StringIO(),
+            )
+        self.assertIn("REGRESSION feed queries", out.getvalue())
+
+
+class DatabaseSettingsTests(MarketTestCase):
+    def test_sqlite_is_tuned_unless_disabled(self):
+        config = database_settings(Path("/srv"), {})
+        self.assertEqual(config["NAME"], Path("/srv/db.sqlite3"))
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+        self.assertEqual(config["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertIn("PRAGMA busy_timeout=20000", config["OPTIONS"]["init_command"])
+        self.assertNotIn("OPTIONS", database_settings(Path("/srv"), {"MARKET_SQLITE_TUNING": "0"}))
+
+    def test_wal_stays_off_for_the_committed_database(self):
+        def wal(env):
+            return "journal_mode=WAL" in database_settings(Path("/srv"), env)["OPTIONS"]["init_command"]
+
+        self.assertFalse(wal({}))
+        self.assertTrue(wal({"MARKET_DB_NAME": "/var/lib/ecofinds.sqlite3"}))
+        self.assertTrue(wal({"MARKET_SQLITE_WAL": "1"}))
+        self.assertFalse(wal({"MARKET_DB_NAME": "/var/lib/ecofinds.sqlite3", "MARKET_SQLITE_WAL": "0"}))
+
+    def test_postgres_pool_turns_off_persistent_connections(self):
+        env = {"MARKET_DB_ENGINE": "postgresql", "MARKET_DB_HOST": "db", "MARKET_DB_CONN_MAX_AGE": "300"}
+        config = database_settings(Path("/srv"), env)
+        self.assertEqual((config["HOST"], config["CONN_MAX_AGE"], config["OPTIONS"]), ("db", 300, {}))
+        pooled = database_settings(Path("/srv"), {**env, "MARKET_DB_POOL": "1", "MARKET_DB_POOL_MAX_SIZE": "30"})
+        self.assertEqual(pooled["CONN_MAX_AGE"], 0)
+        self.assertEqual(pooled["OPTIONS"]["pool"], {"min_size": 2, "max_size": 30})
+        with self.assertRaises(ValueError):
+            database_settings(Path("/srv"), {"MARKET_DB_ENGINE": "oracle"})
+
+    def test_tuned_connection_applies_pragmas(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        wrapper = connections["default"].__class__(
+            {**connection.settings_dict, "NAME": f"{directory}/x.sqlite3", "OPTIONS": sqlite_options(busy_timeout=3)},
+            alias="tuned",
+        )
+        with wrapper.cursor() as cursor:
+            pragmas = [cursor.execute(f"PRAGMA {p}").fetchone()[0] for p in ("journal_mode", "busy_timeout", "synchronous")]
+        wrapper.close()
+        self.assertEqual(pragmas, ["wal", 3000, 1])
+
+    def test_benchmark_compares_modes(self):
+        out = StringIO()
+        # the command's scratch aliases are opened from worker threads
+        aliases = {"default", "dbbench-sqlite-default", "dbbench-sqlite-wal"}
+        with mock.patch.object(DatabaseSettingsTests, "databases", aliases):
+            call_command("benchmark_database", readers=2, writers=1, duration=0.2, stdout=out)
+        self.assertIn("sqlite-default", out.getvalue())
+        self.assertIn("sqlite-wal", out.getvalue())
+
+
+@override_settings(MARKET_DB_REPLICAS=["replica1"])
+class ReplicaRoutingTests(MarketTestCase):
+    """A second SQLite file stands in for a replica that hasn't caught up yet."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._replica_dir = tempfile.mkdtemp()
+        config = {"ENGINE": "django.db.backends.sqlite3", "NAME": f"{cls._replica_dir}/replica.sqlite3"}
+        connections.settings["replica1"] = connections.configure_settings(
+            {"default": connections.settings["default"], "replica1": config}
+        )["replica1"]
+        # copies the (still empty) schema
+        with override_settings(MARKET_DB_REPLICAS=["replica1"]):
+            call_command("sync_sqlite_replicas", stdout=StringIO())
+        # set here, not on the class, so the test runner doesn't try to create it
+        cls.databases = {"default", "replica1"}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica1"].close()
+        del connections["replica1"]
+        del connections.settings["replica1"]
+        shutil.rmtree(cls._replica_dir, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(make_user(), "Lamp")
+        self.url = reverse("api-v1:product_detail", args=[self.product.slug])
+
+    def test_reads_go_to_the_replica(self):
+        with CaptureQueriesContext(connections["replica1"]) as replica, \
+                CaptureQueriesContext(connections["default"]) as primary:
+            resp = self.client.get(self.url)
+        # the stale replica doesn't have the new listing yet
+        self.assertEqual(resp.status_code, 404)
+        self.assertTrue(replica.captured_queries)
+        self.assertFalse(primary.captured_queries)
+        self.assertNotIn(PIN_COOKIE, resp.cookies)
+
+    def test_page_cache_fills_read_from_the_primary(self):
+        page = reverse("market:product_detail", kwargs={"slug": self.product.slug})
+        with CaptureQueriesContext(connections["replica1"]) as replica:
+            resp = self.client.get(page)
+            self.assertEqual(resp.status_code, 200)
+            # the stored page and ETag are current, not the replica's view
+            resp = self.client.get(page, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(replica.captured_queries)
+
+    def test_writers_read_their_writes_until_the_pin_expires(self):
+        resp = self.client.post(reverse("market:login"), {"email": "nobody@example.com", "password": "x"})
+        self.assertEqual(resp.cookies[PIN_COOKIE]["max-age"], 5)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_writes_during_a_get_pin_the_rest_of_the_request(self):
+        router = ReplicaRouter()
+        token = routers._state.set({"replica": True, "wrote": False})
+        try:
+            self.assertEqual(router.db_for_read(Product), "replica1")
+            self.assertEqual(router.db_for_write(Product), "default")
+            self.assertEqual(router.db_for_read(Product), "default")
+        finally:
+            routers._state.reset(token)
+        # outside a request everything uses the primary
+        self.assertEqual(router.db_for_read(Product), "default")
+
+    def test_replica_settings_from_the_environment(self):
+        primary = database_settings(Path("/srv"), {"MARKET_DB_ENGINE": "postgresql", "MARKET_DB_PORT": "5432"})
+        replicas = replica_settings(primary, {"MARKET_DB_REPLICAS": "db-r1, db-r2:6432"})
+        self.assertEqual(
+            [(alias, c["HOST"], c["PORT"]) for alias, c in replicas.items()],
+            [("replica1", "db-r1", "5432"), ("replica2", "db-r2", "6432")],
+        )
+        self.assertEqual(replicas["replica1"]["TEST"], {"MIRROR": "default"})
+
+
+@override_settings(MARKET_ASYNC_VIEWS=True)
+class AsyncViewTests(MarketTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # urls.py picks the views at import time
+        cls._reload_urls()
+        cls.addClassCleanup(cls._reload_urls)
+
+    @staticmethod
+    def _reload_urls():
+        importlib.reload(market_urls)
+        # the project urlconf's include() resolver caches market.urls' patterns
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.buyer = make_user("buyer")
+        for i in range(13):
+            make_product(cls.seller, f"Lamp {i}", brand="Ikea" if i % 2 else "", category="home", quantity=5)
+        cls.product = Product.objects.get(title="Lamp 0")
+        CartItem.objects.create(user=cls.buyer, product=cls.product, qty=2)
+        place_order(cls.buyer)
+        CartItem.objects.create(user=cls.buyer, product=cls.product, qty=1)
+
+    def get(self, url, params=None):
+        # through the async request handler, from a sync test so that
+        # assertNumQueries can watch this thread's connection
+        return async_to_sync(self.async_client.get)(url, params or {})
+
+    def test_feed_pages_with_facets(self):
+        with self.assertNumQueries(3):
+            resp = self.get(reverse("market:product_list"))
+        self.assertEqual(resp.resolver_match.func.__module__, "market.async_views")
+        self.assertEqual(len(resp.context["page_obj"]), 12)
+        self.assertEqual(resp.context["page_obj"].paginator.count, 13)
+        self.assertEqual({o["value"]: o["count"] for o in resp.context["facets"]["brand"]}, {"Ikea": 6})
+
+        # out-of-range pages fall back to the last one, like Paginator.get_page
+        resp = self.get(reverse("market:product_list"), {"page": 7})
+        self.assertEqual(resp.context["page_obj"].number, 2)
+        self.assertEqual(len(resp.context["page_obj"]), 1)
+
+        resp = self.get(reverse("market:product_list"), {"cursor": "", "brand": "Ikea"})
+        self.assertTrue(resp.context["cursor_mode"])
+        self.assertEqual(len(resp.context["page_obj"]), 6)
+
+    def test_detail_is_cached_for_anonymous_visitors(self):
+        url = reverse("market:product_detail", kwargs={"slug": self.product.slug})
+        with self.assertNumQueries(5):
+            resp = self.get(url)
+        self.assertContains(resp, "Lamp 0")
+        self.assertEqual(resp["X-Page-Cache"], "miss")
+        with self.assertNumQueries(0):
+            resp = self.get(url)
+        self.assertEqual(resp["X-Page-Cache"], "hit")
+
+    def test_conditional_get_skips_the_view(self):
+        url = reverse("market:product_detail", kwargs={"slug": self.product.slug})
+        etag = self.get(url)["ETag"]
+        caches["pages"].clear()
+        with self.assertNumQueries(2):
+            resp = async_to_sync(self.async_client.get)(url, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+
+    def test_cart_and_orders(self):
+        resp = self.get(reverse("market:cart"))
+        self.assertRedirects(resp, reverse("market:login"), fetch_redirect_response=False)
+
+        login(self.async_client, self.buyer)
+        cart = self.get(reverse("market:cart"))
+        self.assertEqual(cart.context["cart_total"], 10)
+        self.assertEqual([i["qty"] for i in cart.context["cart_items"]], [1])
+        orders = self.get(reverse("market:previous_purchases"))
+        self.assertEqual([[i.qty for i in o.items.all()] for o in orders.context["orders"]], [[2]])
+
+
+def session_queries(captured):
+    return [q["sql"] for q in captured.captured_queries if "django_session" in q["sql"]]
+
+
+class SessionTests(MarketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("buyer")
+
+    def test_logged_in_requests_read_the_session_from_the_cache(self):
+        self.assertEqual(settings.SESSION_ENGINE, "django.contrib.sessions.backends.cached_db")
+        login(self.client, self.user)
+        # written through to the database too
+        self.assertTrue(Session.objects.filter(pk=self.client.session.session_key).exists())
+        with CaptureQueriesContext(connection) as captured:
+            resp = self.client.get(reverse("market:about"))
+        self.assertContains(resp, "buyer")
+        self.assertEqual(session_queries(captured), [])
+
+    def test_anonymous_visitors_get_no_session(self):
+        with CaptureQueriesContext(connection) as captured:
+            resp = self.client.get(reverse("market:about"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(session_queries(captured), [])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, resp.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_logout_ends_the_cached_session(self):
+        login(self.client, self.user)
+        key = self.client.session.session_key
+        self.client.get(reverse("market:logout"))
+        self.assertFalse(Session.objects.filter(pk=key).exists())
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = key
+        resp = self.client.get(reverse("market:user_dashboard"))
+        self.assertRedirects(resp, reverse("market:login"), fetch_redirect_response=False)
+
+    def test_clearsessions_deletes_only_expired_rows(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f"old{i}", session_data="", expire_date=now - timedelta(days=1)) for i in range(5)]
+            + [Session(session_key="live", session_data="", expire_date=now + timedelta(days=1))]
+        )
+        call_command("clearsessions")
+        self.assertEqual(list(Session.objects.values_list("pk", flat=True)), ["live"])
+
+    def test_benchmark_compares_engines(self):
+        out = StringIO()
+        call_command("benchmark_sessions", iterations=2, warmup=0, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith("anonymous"))
+        self.assertIn("cached_db (configured)", out.getvalue())
+        # only the db engine queries the session table on a plain page view
+        queries = {line.split()[0]: int(line.split()[-1]) for line in lines[1:]}
+        self.assertEqual(queries, {"anonymous": 0, "db": 1, "cached_db": 0, "cache": 0, "signed_cookies": 0})
+        with self.assertRaises(CommandError):
+            call_command("benchmark_sessions", "redis", stdout=StringIO())
+
+
+class ConditionalGetTests(MarketTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.lamp = make_product(cls.seller, "Brass lamp", category="home")
+        cls.book = make_product(cls.seller, "Old atlas", category="books")
+
+    def setUp(self):
+        super().setUp()
+        self.feed = reverse("market:product_list")
+        self.detail = reverse("market:product_detail", args=[self.lamp.slug])
+
+    def revalidate(self, url, etag, **params):
+        # a fresh render each time: the page cache is tested on its own
+        version = feed_version()
+        caches["pages"].clear()
+        caches["pages"].set(FEED_VERSION_KEY, version, None)
+        return self.client.get(url, params, headers={"if-none-match": etag})
+
+    def test_unchanged_detail_page_is_not_rendered(self):
+        resp = self.client.get(self.detail)
+        self.assertEqual(resp["Cache-Control"], "public, max-age=0, s-maxage=60")
+        self.assertIn("Cookie", resp["Vary"])
+        self.assertTrue(resp["Last-Modified"])
+        etag = resp["ETag"]
+
+        caches["pages"].clear()
+        with self.assertNumQueries(2):  # the validators
+            resp = self.client.get(self.detail, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.templates, [])
+        self.assertEqual((resp["ETag"], resp["Cache-Control"]), (etag, "public, max-age=0, s-maxage=60"))
+
+        # a cached page answers from its stored validators
+        self.client.get(self.detail)
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.detail, headers={"if-none-match": etag})
+        self.assertEqual((resp.status_code, resp["X-Page-Cache"]), (304, "hit"))
+
+        last_modified = self.client.get(self.detail)["Last-Modified"]
+        caches["pages"].clear()
+        resp = self.client.get(self.detail, headers={"if-modified-since": last_modified})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_detail_etag_follows_the_listing_its_photos_and_similar_items(self):
+        etag = self.client.get(self.detail)["ETag"]
+        ProductImage.objects.create(product=self.lamp, image="products/lamp.jpg")
+        self.assertEqual(self.revalidate(self.detail, etag).status_code, 200)
+
+        etag = self.client.get(self.detail)["ETag"]
+        SimilarProduct.objects.create(product=self.lamp, neighbour=self.book, rank=0, score=0.5)
+        self.assertEqual(self.revalidate(self.detail, etag).status_code, 200)
+
+        etag = self.client.get(self.detail)["ETag"]
+        self.lamp.price = 12
+        self.lamp.save()
+        self.assertEqual(self.revalidate(self.detail, etag).status_code, 200)
+        self.assertEqual(self.revalidate(self.detail, self.client.get(self.detail)["ETag"]).status_code, 304)
+
+    def test_feed_etag_follows_the_feed_version(self):
+        etag = self.client.get(self.feed, {"category": "home"})["ETag"]
+        self.assertNotEqual(self.client.get(self.feed)["ETag"], etag)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(self.feed, etag, category="home").status_code, 304)
+
+        # books' facet count is on the home page too
+        self.book.price = 3
+        self.book.save()
+        self.assertEqual(self.revalidate(self.feed, etag, category="home").status_code, 200)
+
+        etag = self.client.get(self.feed)["ETag"]
+        self.book.delete()
+        self.assertEqual(self.revalidate(self.feed, etag).status_code, 200)
+
+    def test_first_photo_changes_the_feed(self):
+        etag = self.client.get(self.feed)["ETag"]
+        ProductImage.objects.create(product=self.book, image="products/atlas.jpg")
+        self.assertEqual(self.revalidate(self.feed, etag).status_code, 200)
+
+    def test_logged_in_pages_are_private(self):
+        login(self.client, make_user("buyer"))
+        resp = self.client.get(self.detail)
+        self.assertNotIn("ETag", resp)
+        self.assertEqual(resp["Cache-Control"], "private, no-cache")
+        self.assertIn("private", self.client.get(self.feed)["Cache-Control"])
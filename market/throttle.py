@@ -0,0 +1,59 @@
+"""
+Cache-backed login attempt limiter.
+
+Failed logins are counted per client IP and per email address in fixed
+windows of MARKET_LOGIN_WINDOW seconds. Once either counter reaches its
+limit, further attempts are refused before any database or KDF work, so a
+credential-stuffing burst costs us a couple of cache reads per request.
+
+The counters live in the "shared" cache so every worker process enforces
+the same limits; with per-process counters an attacker gets the limit once
+per worker.
+"""
+import hashlib
+
+from django.conf import settings
+
+from .utils import shared_cache
+
+
+def _limits():
+    return (
+        getattr(settings, "MARKET_LOGIN_MAX_PER_IP", 50),
+        getattr(settings, "MARKET_LOGIN_MAX_PER_EMAIL", 5),
+        getattr(settings, "MARKET_LOGIN_WINDOW", 300),
+    )
+
+
+def client_ip(request):
+    # only REMOTE_ADDR: X-Forwarded-For is client-controlled unless a proxy
+    # we trust rewrites it, and then the proxy should set REMOTE_ADDR
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _keys(ip, email):
+    email_digest = hashlib.sha256((email or "").strip().lower().encode()).hexdigest()
+    return f"market:login:ip:{ip}", f"market:login:email:{email_digest}"
+
+
+def login_blocked(ip, email):
+    max_ip, max_email, _ = _limits()
+    ip_key, email_key = _keys(ip, email)
+    counts = shared_cache.get_many([ip_key, email_key])
+    return counts.get(ip_key, 0) >= max_ip or counts.get(email_key, 0) >= max_email
+
+
+def record_failure(ip, email):
+    window = _limits()[2]
+    for key in _keys(ip, email):
+        # add() starts the window; incr() never extends it
+        if not shared_cache.add(key, 1, window):
+            try:
+                shared_cache.incr(key)
+            except ValueError:
+                # expired between add() and incr()
+                shared_cache.add(key, 1, window)
+
+
+def reset_failures(email):
+    shared_cache.delete(_keys("", email)[1])
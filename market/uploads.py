@@ -0,0 +1,216 @@
+"""
+Background handling of listing photos.
+
+The request only parks each upload in staging storage (a rename when Django
+already spooled it to a temp file) and records an ImageUploadJob. Files over
+MARKET_MAX_IMAGE_BYTES are turned away first, so they are never written out
+or decoded. A worker
+then validates the file, strips EXIF metadata, saves the ProductImage and
+builds its variants.
+
+Where jobs run is controlled by MARKET_IMAGE_PROCESSING:
+- "thread": an in-process pool picks them up after commit (default)
+- "worker": left for `manage.py process_image_jobs` running elsewhere
+- "sync":   processed inline after commit (tests, scripts)
+- "off":    queued but never processed
+"""
+import logging
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .images import process_image
+from .instrumentation import instrumented
+from .models import ImageUploadJob, Product, ProductImage
+from .pagecache import invalidate_product_pages
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = "uploads/pending"
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+_executor = None
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _stage(upload):
+    _, ext = os.path.splitext(upload.name)
+    name = f"{STAGING_DIR}/{uuid.uuid4().hex}{ext.lower()[:10]}"
+    temp_path = getattr(upload, "temporary_file_path", None)
+    if temp_path:
+        try:
+            target = default_storage.path(name)
+        except NotImplementedError:
+            target = None
+        if target:
+            # large uploads are already on disk; moving them is a rename
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(temp_path(), target)
+            return name
+    return default_storage.save(name, upload)
+
+
+def stage_local_file(path):
+    """Copy a file from the local filesystem into staging storage."""
+    _, ext = os.path.splitext(path)
+    name = f"{STAGING_DIR}/{uuid.uuid4().hex}{ext.lower()[:10]}"
+    with open(path, "rb") as f:
+        return default_storage.save(name, File(f))
+
+
+def max_image_bytes():
+    return getattr(settings, "MARKET_MAX_IMAGE_BYTES", 10 * 1024 * 1024)
+
+
+def enqueue_uploads(product, files):
+    """
+    Stage the uploaded files and queue one job per file. Returns (jobs, the
+    names of files rejected for being over MARKET_MAX_IMAGE_BYTES).
+    """
+    limit = max_image_bytes()
+    too_large = [os.path.basename(f.name) for f in files if f.size > limit]
+    files = [f for f in files if f.size <= limit]
+    if not files:
+        return [], too_large
+    jobs = ImageUploadJob.objects.bulk_create([
+        ImageUploadJob(product=product, staged_name=_stage(f), original_name=os.path.basename(f.name))
+        for f in files
+    ])
+    Product.objects.filter(pk=product.pk).update(images_pending=F("images_pending") + len(jobs))
+    product.images_pending += len(jobs)
+
+    mode = getattr(settings, "MARKET_IMAGE_PROCESSING", "thread")
+    if mode == "sync":
+        transaction.on_commit(run_pending_jobs)
+    elif mode == "thread":
+        transaction.on_commit(lambda: _get_executor().submit(_drain))
+    return jobs, too_large
+
+
+def clean_image(data, max_bytes=None):
+    """
+    Check that `data` is an image we accept and re-encode it without EXIF
+    (GPS position, camera serials). Returns (bytes, extension).
+    """
+    max_bytes = max_bytes or max_image_bytes()
+    if len(data) > max_bytes:
+        raise InvalidImage("file too large")
+    try:
+        with Image.open(BytesIO(data)) as probe:
+            fmt = probe.format
+            probe.verify()
+        if fmt not in ALLOWED_FORMATS:
+            raise InvalidImage(f"unsupported format {fmt}")
+        with Image.open(BytesIO(data)) as img:
+            # bake the orientation in, since the tag that carried it is dropped
+            img = ImageOps.exif_transpose(img)
+            if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            out = BytesIO()
+            img.save(out, fmt, quality=90)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImage(str(e) or "unreadable image")
+    return out.getvalue(), "jpg" if fmt == "JPEG" else fmt.lower()
+
+
+def _claim(job_id):
+    # update() skips auto_now: without a fresh updated_at, a job queued longer
+    # than --stale-after would look orphaned the moment it was claimed
+    claimed = ImageUploadJob.objects.filter(pk=job_id, status="pending").update(
+        status="running", updated_at=timezone.now(),
+    )
+    return claimed == 1
+
+
+def process_job(job):
+    """Turn one claimed job into a ProductImage. Never raises for bad input."""
+    try:
+        with default_storage.open(job.staged_name, "rb") as f:
+            data, ext = clean_image(f.read())
+    except (InvalidImage, OSError) as e:
+        job.status, job.error = "failed", str(e)[:255]
+        logger.warning("rejected upload %s for product %s: %s", job.original_name, job.product_id, e)
+    else:
+        root, _ = os.path.splitext(job.original_name or "image")
+        pi = ProductImage(product_id=job.product_id)
+        # variants are built right here rather than queued a second time
+        pi._defer_variants = True
+        pi.image.save(f"{root}.{ext}", ContentFile(data), save=False)
+        pi.save()
+        process_image(pi.pk)
+        job.status, job.error = "done", ""
+
+    job.save(update_fields=["status", "error", "updated_at"])
+    default_storage.delete(job.staged_name)
+    Product.objects.filter(pk=job.product_id, images_pending__gt=0).update(
+        images_pending=F("images_pending") - 1
+    )
+    slug = Product.objects.filter(pk=job.product_id).values_list("slug", flat=True).first()
+    invalidate_product_pages([slug] if slug else [])
+    return job
+
+
+@instrumented
+def run_pending_jobs(limit=None, workers=1):
+    """Claim and process pending jobs until none are left. Returns the count."""
+    ids = ImageUploadJob.objects.filter(status="pending").values_list("id", flat=True)
+    if limit:
+        ids = ids[:limit]
+    ids = list(ids)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(_run_one, ids))
+    return sum(_run_one(i, close=False) for i in ids)
+
+
+def _run_one(job_id, close=True):
+    try:
+        if not _claim(job_id):
+            return 0
+        job = ImageUploadJob.objects.get(pk=job_id)
+        process_job(job)
+        return 1
+    except Exception:
+        logger.exception("image upload job %s crashed", job_id)
+        job = ImageUploadJob.objects.filter(pk=job_id, status="running").first()
+        if job is not None:
+            ImageUploadJob.objects.filter(pk=job_id).update(status="failed", error="internal error")
+            Product.objects.filter(pk=job.product_id, images_pending__gt=0).update(
+                images_pending=F("images_pending") - 1
+            )
+        return 0
+    finally:
+        if close:
+            close_old_connections()
+
+
+def _drain():
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception("image upload queue drain failed")
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "MARKET_IMAGE_WORKERS", 2),
+            thread_name_prefix="market-uploads",
+        )
+    return _executor
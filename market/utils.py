@@ -1,8 +1,91 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
 from django.shortcuts import redirect
+from django.utils.connection import ConnectionProxy
+
+from .models import UserAccount
+
+# per-user state that every worker process must agree on, see CACHES
+SHARED_CACHE_ALIAS = "shared"
+shared_cache = ConnectionProxy(caches, SHARED_CACHE_ALIAS)
+
+
+def account_cache_key(user_id):
+    return f"market:account:{user_id}"
+
+
+def get_account(request):
+    """
+    The logged-in UserAccount, or None. Loaded at most once per request and,
+    when MARKET_ACCOUNT_CACHE_TTL is set, served from the cache across requests.
+    """
+    if not hasattr(request, "_cached_account"):
+        request._cached_account = _load_account(request.session.get("user_id"))
+    return request._cached_account
+
+
+async def aget_account(request):
+    """get_account() for async views."""
+    if not hasattr(request, "_cached_account"):
+        request._cached_account = await _aload_account(await request.session.aget("user_id"))
+    return request._cached_account
+
+
+def _accounts():
+    # the hash is only needed to log in, and must not end up in the cache
+    return UserAccount.objects.defer("password")
+
+
+def _load_account(user_id):
+    if not user_id:
+        return None
+    ttl = getattr(settings, "MARKET_ACCOUNT_CACHE_TTL", 0)
+    key = account_cache_key(user_id)
+    if ttl:
+        user = shared_cache.get(key)
+        if user is not None:
+            return user
+    user = _accounts().filter(id=user_id).first()
+    if user is not None and ttl:
+        shared_cache.set(key, user, ttl)
+    return user
+
+
+async def _aload_account(user_id):
+    if not user_id:
+        return None
+    ttl = getattr(settings, "MARKET_ACCOUNT_CACHE_TTL", 0)
+    key = account_cache_key(user_id)
+    if ttl:
+        user = await shared_cache.aget(key)
+        if user is not None:
+            return user
+    user = await _accounts().filter(id=user_id).afirst()
+    if user is not None and ttl:
+        await shared_cache.aset(key, user, ttl)
+    return user
+
 
 def login_required_custom(view_func):
+    if iscoroutinefunction(view_func):
+        async def async_wrapper(request, *args, **kwargs):
+            if not await request.session.ahas_key("user_id"):
+                return redirect("market:login")
+            if await aget_account(request) is None:
+                await request.session.aflush()
+                return redirect("market:login")
+            return await view_func(request, *args, **kwargs)
+        return wraps(view_func)(async_wrapper)
+
     def wrapper(request, *args, **kwargs):
         if "user_id" not in request.session:
             return redirect("market:login")
+        if get_account(request) is None:
+            # account was deleted under a live session
+            request.session.flush()
+            return redirect("market:login")
         return view_func(request, *args, **kwargs)
     return wrapper
@@ -1,23 +1,49 @@
 from django.shortcuts import render, redirect ,get_object_or_404
 from django.contrib import messages
 from .models import *
-from django.db.models import Q
-import hashlib
 from django.urls import reverse
 from django.core.paginator import Paginator
+from django.http import Http404, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.defaultfilters import filesizeformat
+import csv
+import json
+import logging
 from django.contrib import messages
-from .utils import login_required_custom
+from .utils import get_account, login_required_custom
+from .search import search_products
+from .pagination import cursor_paginate, encode_cursor
+from .orders import OutOfStock, place_order
+from .cart import get_cart_summary, invalidate_cart_summary
+from .pagecache import cache_anonymous_page, detail_key, detail_validators, feed_key, feed_validators
+from .uploads import enqueue_uploads, max_image_bytes
+from .recommend import similar_products
+from .facets import apply_filters, facet_counts, filter_query, parse_filters
+from .passwords import burn_password_check, hash_password, verify_password
+from .throttle import client_ip, login_blocked, record_failure, reset_failures
+
 from django.db import transaction , IntegrityError
 
+FEED_PAGE_SIZE = 12
+# ?page= is kept for shallow pages only; past this, browse with ?cursor=
+FEED_MAX_PAGE = 50
+ORDERS_PAGE_SIZE = 10
+EXPORT_CHUNK_SIZE = 500
+# the columns product_edit's form writes
+PRODUCT_FORM_FIELDS = [
+    "title", "description", "category", "price", "quantity", "condition", "brand", "model",
+    "length_cm", "width_cm", "height_cm", "weight_kg", "material", "color",
+    "original_packaging", "manual_included", "working_condition_description",
+]
+
+logger = logging.getLogger(__name__)
+
 def home(request):
     return render(request, "market/home.html")
 
 def about(request):
     return render(request, "market/about.html")
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
 def register_view(request):
     if request.method == "POST":
         username = request.POST.get("username")
@@ -51,21 +77,30 @@ def register_view(request):
 
 def login_view(request):
     if request.method == "POST":
-        email = request.POST.get("email")
-        password = request.POST.get("password")
-
-        hashed_pw = hash_password(password)
-
-        try:
-            user = UserAccount.objects.get(email=email, password=hashed_pw)
-            # set session
-            request.session["user_id"] = user.id
-            request.session["username"] = user.username
-            return redirect("market:user_dashboard")
-        except UserAccount.DoesNotExist:
+        email = request.POST.get("email", "").strip()
+        password = request.POST.get("password", "")
+        ip = client_ip(request)
+
+        if login_blocked(ip, email):
+            messages.error(request, "Too many login attempts. Please wait a few minutes and try again.")
+            return render(request, "market/login.html", status=429)
+
+        user = UserAccount.objects.filter(email=email).first()
+        if user is None:
+            burn_password_check(password)
+        if user is None or not verify_password(user, password):
+            record_failure(ip, email)
             messages.error(request, "Invalid email or password.")
             return redirect("market:login")
 
+        reset_failures(email)
+        # new session key on login, so a planted pre-login cookie is useless
+        request.session.cycle_key()
+        # set session
+        request.session["user_id"] = user.id
+        request.session["username"] = user.username
+        return redirect("market:user_dashboard")
+
     return render(request, "market/login.html")
 
 
@@ -80,31 +115,48 @@ def profile_view(request):
     return render(request, "market/profile.html", {"username": username})
 
 
+@cache_anonymous_page(feed_key, feed_validators)
 def product_list(request):
     q = request.GET.get("q", "").strip()
-    cat = request.GET.get("category", "").strip()
+    filters = parse_filters(request.GET)
 
-    qs = Product.objects.filter(is_available=True)
-    if cat:
-        qs = qs.filter(category=cat)
+    base = Product.objects.filter(is_available=True)
     if q:
-        qs = qs.filter(Q(title__icontains=q) | Q(description__icontains=q))
-
-    paginator = Paginator(qs, 12)
-    page_obj = paginator.get_page(request.GET.get("page"))
+        base = search_products(base, q)
+    qs = apply_filters(base, filters)
+
+    cursor = request.GET.get("cursor")
+    next_cursor = None
+    # search results are ordered by rank, so they stay on page numbers
+    if cursor is not None and not q:
+        page_obj = cursor_paginate(qs, cursor, FEED_PAGE_SIZE)
+        next_cursor = page_obj.next_cursor
+    else:
+        page = request.GET.get("page")
+        if page and page.isdigit() and int(page) > FEED_MAX_PAGE:
+            raise Http404("Page too deep, use cursor pagination.")
+        page_obj = Paginator(qs, FEED_PAGE_SIZE).get_page(page)
+        if not q and page_obj.has_next() and page_obj.number >= FEED_MAX_PAGE:
+            next_cursor = encode_cursor(page_obj.object_list[len(page_obj) - 1])
 
     context = {
         "page_obj": page_obj,
+        "cursor_mode": cursor is not None and not q,
+        "next_cursor": next_cursor,
         "q": q,
-        "category": cat,
-        "categories": CATEGORIES,
+        "filters": filters,
+        "filter_query": filter_query(q, filters),
+        "facets": facet_counts(base, filters, q),
     }
     return render(request, "market/product_list.html", context)
 
 
+@cache_anonymous_page(detail_key, detail_validators)
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    context = {"product": product}
+    product = get_object_or_404(
+        Product.objects.select_related("owner").prefetch_related("images"), slug=slug
+    )
+    context = {"product": product, "similar_products": similar_products(product)}
     return render(request, "market/product_detail.html", context)
 
 
@@ -151,7 +203,7 @@ def product_create(request):
         if errors:
             return render(request, "market/product_create.html", {"errors": errors, "categories": CATEGORIES, "conditions": CONDITIONS})
 
-        owner = UserAccount.objects.get(id=request.session["user_id"])
+        owner = _get_logged_user(request)
 
         prod = Product.objects.create(
             owner=owner,
@@ -175,20 +227,26 @@ def product_create(request):
             working_condition_description=working_condition_description,
         )
 
-        # handle multiple images
-        images = request.FILES.getlist("images")
-        for img in images:
-            ProductImage.objects.create(product=prod, image=img)
+        # images are validated and saved in the background; the page shows
+        # them as processing until the jobs finish
+        _, too_large = enqueue_uploads(prod, request.FILES.getlist("images"))
+        _warn_too_large(request, too_large)
 
         return redirect("market:product_detail", slug=prod.slug)
 
     return render(request, "market/product_create.html", {"categories": CATEGORIES, "conditions": CONDITIONS})
 
 
+def _warn_too_large(request, names):
+    if names:
+        limit = filesizeformat(max_image_bytes())
+        messages.warning(request, f"Skipped photos over {limit}: {', '.join(names)}")
+
+
 @login_required_custom
 def product_edit(request, pk):
     prod = get_object_or_404(Product, pk=pk)
-    if prod.owner.id != request.session.get("user_id"):
+    if prod.owner_id != request.session.get("user_id"):
         messages.error(request, "You are not allowed to edit this product.")
         return redirect("market:product_detail", slug=prod.slug)
 
@@ -217,12 +275,14 @@ def product_edit(request, pk):
         prod.original_packaging = True if request.POST.get("original_packaging") == "on" else False
         prod.manual_included = True if request.POST.get("manual_included") == "on" else False
         prod.working_condition_description = request.POST.get("working_condition_description", prod.working_condition_description)
-        prod.save()
+        # only the form's columns: the upload worker may have changed
+        # primary_image/images_pending since `prod` was loaded
+        prod.similar_stale = True
+        prod.save(update_fields=PRODUCT_FORM_FIELDS + ["similar_stale", "updated_at"])
 
         # new images:
-        images = request.FILES.getlist("images")
-        for img in images:
-            ProductImage.objects.create(product=prod, image=img)
+        _, too_large = enqueue_uploads(prod, request.FILES.getlist("images"))
+        _warn_too_large(request, too_large)
 
         messages.success(request, "Product updated.")
         return redirect("market:product_detail", slug=prod.slug)
@@ -233,7 +293,7 @@ def product_edit(request, pk):
 @login_required_custom
 def product_delete(request, pk):
     prod = get_object_or_404(Product, pk=pk)
-    if prod.owner.id != request.session.get("user_id"):
+    if prod.owner_id != request.session.get("user_id"):
         messages.error(request, "Not allowed.")
         return redirect("market:product_detail", slug=prod.slug)
 
@@ -247,13 +307,7 @@ def product_delete(request, pk):
 
 
 def _get_logged_user(request):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        return None
-    try:
-        return UserAccount.objects.get(id=user_id)
-    except UserAccount.DoesNotExist:
-        return None
+    return get_account(request)
 
 @login_required_custom
 def add_to_cart(request):
@@ -306,6 +360,7 @@ def add_to_cart(request):
         messages.error(request, "Could not add to cart. Try again.")
         return redirect("market:product_detail", slug=product.slug)
 
+    invalidate_cart_summary(user.id)
     messages.success(request, "Added to cart.")
     return redirect("market:product_detail", slug=product.slug)
 
@@ -364,6 +419,7 @@ def update_cart(request):
 
     cart_item.qty = qty
     cart_item.save()
+    invalidate_cart_summary(user.id)
     messages.success(request, "Cart updated.")
     return redirect("market:cart")
 
@@ -380,6 +436,7 @@ def remove_from_cart(request):
     item_id = request.POST.get("item_id")
     cart_item = get_object_or_404(CartItem, id=item_id, user=user)
     cart_item.delete()
+    invalidate_cart_summary(user.id)
     messages.success(request, "Removed from cart.")
     return redirect("market:cart")
 
@@ -390,62 +447,23 @@ def checkout(request):
     if not user:
         return redirect("market:login")
 
-    cart_items = CartItem.objects.filter(user=user).select_related("product")
-    if not cart_items.exists():
-        messages.error(request, "Your cart is empty.")
-        return redirect("market:cart")
-
     try:
-        with transaction.atomic():
-            # Lock products used by cart to avoid race conditions
-            product_ids = [ci.product.id for ci in cart_items]
-            products = Product.objects.select_for_update().filter(id__in=product_ids)
-            prod_map = {p.id: p for p in products}
-
-            # Validate stock for each cart item
-            for ci in cart_items:
-                p = prod_map.get(ci.product.id)
-                if p is None:
-                    messages.error(request, f"Product not found: {ci.product.title}")
-                    raise ValueError("product missing")
-                if not p.is_available or (p.quantity is not None and ci.qty > p.quantity):
-                    messages.error(request, f"Not enough stock for {p.title}. Available: {p.quantity or 'unlimited'}")
-                    raise ValueError("insufficient stock")
-
-            # Create order (mark ordered=True since your model uses ordered to mean completed)
-            order = Order.objects.create(user=user, ordered=True)
-
-            # Create order items and deduct stock
-            for ci in cart_items:
-                p = prod_map[ci.product.id]
-
-                OrderItem.objects.create(
-                    order=order,
-                    product_id=p.id,
-                    title=p.title,
-                    qty=ci.qty,
-                    price_snapshot=p.price,
-                )
-
-                # deduct product quantity if tracked
-                if p.quantity is not None:
-                    p.quantity = max(0, p.quantity - ci.qty)
-                    if p.quantity <= 0:
-                        p.is_available = False
-                    p.save(update_fields=["quantity", "is_available"])
-
-            # clear cart only after order creation
-            cart_items.delete()
-
-    except ValueError:
-        # ValueErrors above already added messages; redirect back to cart
+        order = place_order(user)
+    except OutOfStock as e:
+        p = e.product
+        p.refresh_from_db(fields=["quantity"])
+        messages.error(request, f"Not enough stock for {p.title}. Available: {p.quantity or 'unlimited'}")
         return redirect("market:cart")
-    except Exception as e:
-        # Unexpected error
-        # log.exception(e)  # uncomment in real app
+    except Exception:
+        # the order transaction has rolled back; keep the cart, report the failure
+        logger.exception("checkout failed for user %s", user.id)
         messages.error(request, "Could not complete checkout. Please try again.")
         return redirect("market:cart")
 
+    if order is None:
+        messages.error(request, "Your cart is empty.")
+        return redirect("market:cart")
+
     messages.success(request, "Checkout complete — order created.")
     # Redirect to order detail so user sees confirmation (better UX than previous_purchases)
     return redirect(reverse("market:order_detail", kwargs={"pk": order.id}))
@@ -464,38 +482,83 @@ def previous_purchases(request):
     if not user:
         return redirect("market:login")
 
-    try:
-        # fetch orders and prefetch items
-        orders_qs = (
-            Order.objects
-                 .filter(user=user, ordered=True)
-                 .order_by("-created_at")
-                 .prefetch_related("items")
-        )
-    except Exception as e:
-        # fallback: log and show friendly message
-        # import logging; logging.exception(e)
-        messages.error(request, "Could not load your orders. Please try again.")
-        return redirect("market:product_list")
-
-    # If some templates still expect list-of-dicts, we can provide both:
-    # pass orders_qs and a list-of-dicts (orders_list) for compatibility
-    orders_list = []
-    for order in orders_qs:
-        orders_list.append({
-            "id": order.id,
-            "ordered": order.ordered,
-            "created_at": order.created_at,
-            "items": list(order.items.all()),  # already prefetched
-            "total_amount": order.total_amount
-        })
+    orders_qs = Order.objects.filter(user=user, ordered=True).prefetch_related("items")
+    page_obj = cursor_paginate(orders_qs, request.GET.get("cursor"), ORDERS_PAGE_SIZE)
 
     return render(request, "market/previous_purchases.html", {
-        "orders": orders_qs,         # preferred: QuerySet of Order objects
-        "orders_list": orders_list,  # optional: backwards-compatible list
+        "orders": page_obj,
+        "next_cursor": page_obj.next_cursor,
     })
 
 
+def _export_rows(user):
+    """Every line item the user has bought, newest order first, read in chunks."""
+    return (
+        OrderItem.objects
+        .filter(order__user=user, order__ordered=True)
+        .select_related("order")
+        .order_by("-order__created_at", "-order_id", "id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+class _Echo:
+    """csv.writer target that hands each row back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def _stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(["order_id", "ordered_at", "product_id", "title", "qty", "price", "order_total"])
+    for it in rows:
+        yield writer.writerow([
+            it.order_id, it.order.created_at.isoformat(), it.product_id,
+            it.title, it.qty, it.price_snapshot, it.order.total,
+        ])
+
+
+def _stream_json(rows):
+    # one order per element; rows arrive grouped by order so we only ever
+    # hold the order currently being written
+    yield "["
+    current = None
+    for it in rows:
+        if current is None or current["id"] != it.order_id:
+            if current is not None:
+                yield json.dumps(current, cls=DjangoJSONEncoder) + ","
+            current = {
+                "id": it.order_id,
+                "created_at": it.order.created_at,
+                "total": it.order.total,
+                "items": [],
+            }
+        current["items"].append({
+            "product_id": it.product_id,
+            "title": it.title,
+            "qty": it.qty,
+            "price": it.price_snapshot,
+        })
+    if current is not None:
+        yield json.dumps(current, cls=DjangoJSONEncoder)
+    yield "]"
+
+
+@login_required_custom
+def export_orders(request):
+    user = _get_logged_user(request)
+    if not user:
+        return redirect("market:login")
+
+    fmt = request.GET.get("format", "csv")
+    if fmt == "json":
+        response = StreamingHttpResponse(_stream_json(_export_rows(user)), content_type="application/json")
+    else:
+        fmt = "csv"
+        response = StreamingHttpResponse(_stream_csv(_export_rows(user)), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="orders.{fmt}"'
+    return response
 
 
 @login_required_custom
@@ -526,13 +589,18 @@ def user_dashboard(request):
 
         try:
             with transaction.atomic():
+                # `user` may be a cached copy: write only the columns this form
+                # changes, so stale values of the others can't overwrite newer ones
+                changed = ["username"]
                 user.username = new_username
                 if new_email:
                     user.email = new_email
+                    changed.append("email")
 
                 # Use your custom hash function to set password (consistent with register/login)
                 if new_password:
                     user.password = hash_password(new_password)
+                    changed.append("password")
 
                 # handle uploaded avatar (if your model has an ImageField named 'avatar')
                 if avatar:
@@ -550,8 +618,9 @@ def user_dashboard(request):
                     # assign the new file
                     # ensure your model has avatar = models.ImageField(...)
                     user.avatar = avatar
+                    changed.append("avatar")
 
-                user.save()
+                user.save(update_fields=changed)
         except Exception as e:
             # optionally log.exception(e)
             messages.error(request, "Could not update profile. Please try again.")
@@ -567,7 +636,7 @@ def user_dashboard(request):
     # Only show listings that are available and quantity > 0
     my_listings = Product.objects.filter(owner=user, is_available=True, quantity__gt=0).order_by("-created_at")[:8]
     recent_orders = Order.objects.filter(user=user, ordered=True).order_by("-created_at")[:6]
-    cart_count = CartItem.objects.filter(user=user).count()
+    cart_count = get_cart_summary(user.id)["count"]
 
     return render(request, "market/profile.html", {
         "user_obj": user,